@@ -0,0 +1,99 @@
+import os
+import struct
+
+# File sotto questa soglia vengono impacchettati in un unico flusso
+SMALL_FILE_LIMIT = 64 * 1024
+
+# Dimensione dei blocchi inviati sul socket: raggruppa molti file piccoli in una sola send
+PACK_BLOCK_SIZE = 256 * 1024
+
+# Intestazione di ogni voce: lunghezza del nome, dimensione, mtime (ns), permessi
+_NAME_LEN = struct.Struct("!H")
+_ENTRY = struct.Struct("!QqI")
+
+# umask del processo (letta una volta: os.umask la modifica per leggerla)
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+def safe_join(base_dir, relative_path):
+    """Unisce un percorso relativo ricevuto dalla rete alla cartella base,
+    rifiutando percorsi assoluti o che escono dalla cartella"""
+    parts = [p for p in relative_path.replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or any(p == ".." for p in parts) or os.path.isabs(relative_path) or ":" in parts[0]:
+        raise ValueError(f"Percorso non valido: {relative_path}")
+    return os.path.join(base_dir, *parts)
+
+
+def safe_mode(mode):
+    """Permessi ricevuti dalla rete applicabili in locale: solo rwx (niente
+    setuid, setgid o sticky) e filtrati dalla umask, come un file creato qui"""
+    return mode & 0o777 & ~_UMASK
+
+
+def encode_entry(relative_path, data, mtime_ns, mode):
+    """Codifica una voce dell'archivio (intestazione + contenuto)"""
+    name = relative_path.encode("utf-8")
+    return _NAME_LEN.pack(len(name)) + name + _ENTRY.pack(len(data), mtime_ns, mode & 0o7777) + data
+
+
+def end_marker():
+    return _NAME_LEN.pack(0)
+
+
+def iter_pack(entries, block_size=PACK_BLOCK_SIZE):
+    """Genera blocchi di byte pronti per il socket.
+
+    entries: iterabile di (percorso_locale, percorso_relativo, stat_result)
+    """
+    buffer = bytearray()
+    for local_path, relative_path, st in entries:
+        with open(local_path, "rb") as f:
+            data = f.read()
+        buffer += encode_entry(relative_path, data, st.st_mtime_ns, st.st_mode)
+        if len(buffer) >= block_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += end_marker()
+    yield bytes(buffer)
+
+
+def _read_exact(reader, size):
+    data = reader.read(size)
+    if len(data) != size:
+        raise ConnectionError("Archivio troncato")
+    return data
+
+
+def iter_unpack(reader):
+    """Legge le voci da un oggetto file binario (es. socket.makefile('rb')).
+
+    Restituisce tuple (percorso_relativo, dati, mtime_ns, permessi).
+    """
+    while True:
+        (name_len,) = _NAME_LEN.unpack(_read_exact(reader, _NAME_LEN.size))
+        if name_len == 0:
+            return
+        relative_path = _read_exact(reader, name_len).decode("utf-8")
+        size, mtime_ns, mode = _ENTRY.unpack(_read_exact(reader, _ENTRY.size))
+        data = _read_exact(reader, size) if size else b""
+        yield relative_path, data, mtime_ns, mode
+
+
+def write_entry(base_dir, relative_path, data, mtime_ns, mode, finalizer=None, policy=None):
+    """Scrive un file estratto dall'archivio preservando mtime e permessi"""
+    path = safe_join(base_dir, relative_path)
+    if finalizer is not None:
+        # Scrittura atomica: file temporaneo e rename
+        return finalizer.write(path, data, mtime_ns, mode, policy)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    try:
+        os.chmod(path, safe_mode(mode))
+    except OSError:
+        pass
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
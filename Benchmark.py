@@ -0,0 +1,921 @@
+import os
+import sys
+import json
+import time
+import socket
+import selectors
+import random
+import argparse
+import threading
+import tempfile
+import hashlib
+import http.client
+import contextlib
+
+from ConfigService import ConfigService
+from Receiver import Receiver
+from ReceiverPool import ReceiverPool
+from Sender import Sender
+from HashCache import get_hash_cache
+from Discovery import DISCOVERY_REQUEST_COMPACT, decode_response
+from Sinks import IteratorSink
+from Discovery import RateLimiter
+from NetEmu import PRESETS, TcpProxy, UdpProxy
+
+
+def free_port(sock_type=socket.SOCK_STREAM):
+    """Trova una porta libera sul loopback"""
+    s = socket.socket(socket.AF_INET, sock_type)
+    try:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+class LoopbackHarness:
+    """Receiver e Sender collegati sul loopback, in una cartella temporanea"""
+
+    def __init__(self, work_dir, link=None):
+        self.work_dir = work_dir
+        self.receive_dir = os.path.join(work_dir, "received")
+        self.source_dir = os.path.join(work_dir, "source")
+        os.makedirs(self.receive_dir)
+        os.makedirs(self.source_dir)
+        self._devnull = open(os.devnull, "w")
+
+        config = ConfigService(os.path.join(work_dir, "zapshare_config.json"), {
+            "receive_directory": self.receive_dir,
+            "start_with_windows": False,
+            "computer_name": "benchmark"
+        })
+
+        with self.quiet():
+            self.receiver = Receiver(config)
+            self.receiver.port = free_port()
+            self.receiver.discovery_port = free_port(socket.SOCK_DGRAM)
+            self.receiver.start(block=False)
+
+            self.sender = Sender()
+        self.sender.devices = {"devices": [{"name": "benchmark", "ip": "127.0.0.1", "port": self.receiver.port}]}
+
+        # Con un profilo di rete il dispositivo principale passa dal proxy di emulazione
+        self.link = None
+        if link:
+            self.link = TcpProxy(self.receiver.port, link)
+            self.sender.devices["devices"][0]["port"] = self.link.port
+
+    def close(self):
+        if self.link:
+            self.link.close()
+        with self.quiet():
+            self.receiver.stop()
+        self._devnull.close()
+
+    def quiet(self):
+        """Silenzia le print di Sender/Receiver durante le misure"""
+        return contextlib.redirect_stdout(self._devnull)
+
+    def add_receivers(self, count, discovery=False):
+        """Altri receiver sul loopback, ognuno con la propria cartella; restituisce
+        i receiver (il primo è quello principale) e gli indici dei dispositivi"""
+        receivers = [self.receiver]
+        indexes = [0]
+        for i in range(1, count):
+            directory = os.path.join(self.work_dir, f"node_{i}")
+            os.makedirs(directory)
+            config = ConfigService(os.path.join(directory, "zapshare_config.json"), {
+                "receive_directory": directory,
+                "start_with_windows": False,
+                "computer_name": f"node_{i}"
+            })
+            with self.quiet():
+                receiver = Receiver(config)
+                receiver.port = free_port()
+                receiver.discovery_port = free_port(socket.SOCK_DGRAM)
+                receiver.serve_discovery = discovery
+                receiver.start(block=False)
+            receivers.append(receiver)
+            indexes.append(len(self.sender.devices["devices"]))
+            self.sender.devices["devices"].append({"name": f"node_{i}", "ip": "127.0.0.1", "port": receiver.port})
+        return receivers, indexes
+
+    def wait_received(self, path, size, timeout=30):
+        """Il protocollo a file singolo non ha una conferma finale: attende il file sul disco"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(path) and os.path.getsize(path) >= size and self.receiver.active_transfers() == 0:
+                return True
+            time.sleep(0.001)
+        return False
+
+
+def bench_single_file(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "large.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    harness.sender.include_digest = args.digest
+    start = time.perf_counter()
+    with harness.quiet():
+        ok = harness.sender.send_file(path, 0)
+    ok = ok and harness.wait_received(os.path.join(harness.receive_dir, "large.bin"), size)
+    elapsed = time.perf_counter() - start
+    return {"ok": ok, "bytes": size, "seconds": elapsed, "mb_per_sec": size / elapsed / 1e6}
+
+
+def bench_small_files(harness, args):
+    folder = os.path.join(harness.source_dir, "small")
+    os.makedirs(folder)
+    total = 0
+    for i in range(args.small_files):
+        data = os.urandom(args.small_file_size)
+        with open(os.path.join(folder, f"file_{i:06d}.bin"), "wb") as f:
+            f.write(data)
+        total += len(data)
+
+    start = time.perf_counter()
+    with harness.quiet():
+        ok = harness.sender.send_directory(folder, 0)
+    elapsed = time.perf_counter() - start
+    return {
+        "ok": ok,
+        "files": args.small_files,
+        "bytes": total,
+        "seconds": elapsed,
+        "files_per_sec": args.small_files / elapsed,
+        "mb_per_sec": total / elapsed / 1e6
+    }
+
+
+def bench_sparse_file(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "sparse.img")
+    # File quasi vuoto: 1 MB di dati ogni 16 MB
+    with open(path, "wb") as f:
+        f.truncate(size)
+        for offset in range(0, size, 16 * 1024 * 1024):
+            f.seek(offset)
+            f.write(os.urandom(min(1024 * 1024, size - offset)))
+
+    start = time.perf_counter()
+    with harness.quiet():
+        ok = harness.sender.send_file(path, 0)
+    received = os.path.join(harness.receive_dir, "sparse.img")
+    ok = ok and harness.wait_received(received, size)
+    elapsed = time.perf_counter() - start
+    st = os.stat(received)
+    return {
+        "ok": ok,
+        "bytes": size,
+        "seconds": elapsed,
+        "mb_per_sec": size / elapsed / 1e6,
+        "allocated_bytes": getattr(st, "st_blocks", 0) * 512
+    }
+
+
+def bench_multipath(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "multipath.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    # Sul loopback i percorsi usano indirizzi sorgente diversi di 127.0.0.0/8
+    paths = [(f"127.0.0.{i + 1}", "127.0.0.1") for i in range(args.paths)]
+    start = time.perf_counter()
+    with harness.quiet():
+        ok = harness.sender.send_file_multipath(path, 0, paths=paths)
+    elapsed = time.perf_counter() - start
+    received = os.path.join(harness.receive_dir, "multipath.bin")
+    with open(path, "rb") as a, open(received, "rb") as b:
+        ok = ok and a.read() == b.read()
+    return {"ok": ok, "paths": args.paths, "bytes": size, "seconds": elapsed, "mb_per_sec": size / elapsed / 1e6}
+
+
+def bench_sync(harness, args):
+    folder = os.path.join(harness.source_dir, "mirror")
+    for i in range(args.small_files):
+        subdir = os.path.join(folder, f"dir_{i % 10}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, f"file_{i:06d}.bin"), "wb") as f:
+            f.write(os.urandom(args.small_file_size))
+
+    with harness.quiet():
+        start = time.perf_counter()
+        ok = harness.sender.sync_directory(folder, 0)
+        full_sync = time.perf_counter() - start
+
+        # Modifica alcuni file e ne elimina uno: la seconda sincronizzazione invia solo le differenze
+        changed = max(1, args.small_files // 100)
+        for i in range(changed):
+            with open(os.path.join(folder, f"dir_{i % 10}", f"file_{i:06d}.bin"), "wb") as f:
+                f.write(os.urandom(args.small_file_size))
+        os.remove(os.path.join(folder, f"dir_{(args.small_files - 1) % 10}", f"file_{args.small_files - 1:06d}.bin"))
+
+        start = time.perf_counter()
+        ok = harness.sender.sync_directory(folder, 0, delete=True) and ok
+        incremental_sync = time.perf_counter() - start
+
+    received = os.path.join(harness.receive_dir, "mirror")
+    received_files = sum(len(files) for _, _, files in os.walk(received))
+    return {
+        "ok": ok and received_files == args.small_files - 1,
+        "files": args.small_files,
+        "changed": changed,
+        "full_sync_seconds": full_sync,
+        "incremental_sync_seconds": incremental_sync,
+        "hash_cache_hit_rate": get_hash_cache().stats()["hit_rate"]
+    }
+
+
+def bench_dedup(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "dedup.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    harness.receiver.blob_store = harness.receiver.open_blob_store(os.path.join(harness.work_dir, "blobs"))
+    harness.sender.include_digest = True
+    with harness.quiet():
+        start = time.perf_counter()
+        ok = harness.sender.send_file(path, 0, remote_name="first.bin")
+        ok = ok and harness.wait_received(os.path.join(harness.receive_dir, "first.bin"), size)
+        first_send = time.perf_counter() - start
+
+        # Stesso contenuto con un altro nome: il receiver lo collega dall'archivio
+        start = time.perf_counter()
+        ok = harness.sender.send_file(path, 0, remote_name="second.bin") and ok
+        ok = ok and harness.wait_received(os.path.join(harness.receive_dir, "second.bin"), size)
+        second_send = time.perf_counter() - start
+
+    with open(path, "rb") as a, open(os.path.join(harness.receive_dir, "second.bin"), "rb") as b:
+        ok = ok and a.read() == b.read()
+    return {"ok": ok, "bytes": size, "first_send_seconds": first_send, "dedup_send_seconds": second_send}
+
+
+def bench_encryption(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "payload.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    # Conta gli handshake TLS ripresi da una sessione precedente
+    handshakes = {"full": 0, "resumed": 0}
+    wrap = harness.sender.tls.wrap
+
+    def counting_wrap(*wrap_args, **wrap_kwargs):
+        tls_socket = wrap(*wrap_args, **wrap_kwargs)
+        handshakes["resumed" if tls_socket.session_reused else "full"] += 1
+        return tls_socket
+    harness.sender.tls.wrap = counting_wrap
+
+    results = {}
+    ok = True
+    for mode, encrypt in (("plain", False), ("tls", True)):
+        harness.sender.encrypt_transfers = encrypt
+        received = os.path.join(harness.receive_dir, f"{mode}.bin")
+        start = time.perf_counter()
+        ok = harness.sender.send_file(path, 0, remote_name=f"{mode}.bin") and ok
+        ok = ok and harness.wait_received(received, size)
+        results[f"{mode}_mb_per_sec"] = size / (time.perf_counter() - start) / 1e6
+
+    # Trasferimenti brevi: dopo il primo, gli handshake riprendono la sessione
+    small = os.path.join(harness.source_dir, "small.bin")
+    with open(small, "wb") as f:
+        f.write(os.urandom(args.small_file_size))
+    count = 50
+    start = time.perf_counter()
+    for i in range(count):
+        ok = harness.sender.send_file(small, 0, remote_name=f"small_{i}.bin") and ok
+    results["tls_small_files_per_sec"] = count / (time.perf_counter() - start)
+
+    with open(path, "rb") as a, open(os.path.join(harness.receive_dir, "tls.bin"), "rb") as b:
+        ok = ok and a.read() == b.read()
+    pinned = harness.sender.devices["devices"][0].get("fingerprint") == harness.receiver.fingerprint
+    return dict({"ok": ok and pinned, "bytes": size}, **results,
+                full_handshakes=handshakes["full"], resumed_handshakes=handshakes["resumed"])
+
+
+def bench_compression(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "log.txt")
+    # Dati comprimibili ma non banali: righe di log con campi casuali
+    words = [os.urandom(4).hex() for _ in range(512)]
+    with open(path, "w") as f:
+        written = 0
+        while written < size:
+            line = " ".join(random.choice(words) for _ in range(12)) + "\n"
+            f.write(line)
+            written += len(line)
+    size = os.path.getsize(path)
+
+    workers = args.workers or os.cpu_count() or 1
+    configurations = [("plain", False, "thread", 1), ("thread_1", True, "thread", 1)]
+    if workers > 1:
+        configurations.append((f"thread_{workers}", True, "thread", workers))
+    configurations.append((f"process_{workers}", True, "process", workers))
+    results = {"bytes": size}
+    ok = True
+    for label, compress, mode, count in configurations:
+        harness.sender.compress_transfers = compress
+        harness.sender.pipeline_mode = mode
+        harness.sender.pipeline_workers = count
+        received = os.path.join(harness.receive_dir, f"{label}.txt")
+        start = time.perf_counter()
+        ok = harness.sender.send_file(path, 0, remote_name=f"{label}.txt") and ok
+        ok = ok and harness.wait_received(received, size)
+        results[f"{label}_mb_per_sec"] = size / (time.perf_counter() - start) / 1e6
+        with open(path, "rb") as a, open(received, "rb") as b:
+            ok = ok and a.read() == b.read()
+    results["ok"] = ok
+    return results
+
+
+def bench_discovery(harness, args):
+    # Un host che invia richieste a raffica: il receiver risponde solo entro il limite
+    requests = 5000
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.2)
+    try:
+        start = time.perf_counter()
+        for _ in range(requests):
+            sock.sendto(DISCOVERY_REQUEST_COMPACT, ("127.0.0.1", harness.receiver.discovery_port))
+        elapsed = time.perf_counter() - start
+        responses = []
+        try:
+            while True:
+                responses.append(sock.recv(1024))
+        except socket.timeout:
+            pass
+    finally:
+        sock.close()
+
+    info = decode_response(responses[0]) if responses else {}
+    stats = dict(harness.receiver.discovery_stats)
+    return {
+        "ok": bool(responses) and info.get("port") == harness.receiver.port,
+        "requests_sent": requests,
+        "responses": len(responses),
+        "response_bytes": len(responses[0]) if responses else 0,
+        "json_response_bytes": len(harness.receiver.discovery_response(compact=False)),
+        "received": stats["requests"],
+        "rate_limited": stats["rate_limited"],
+        "seconds": elapsed
+    }
+
+
+def bench_zero_copy(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "payload.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    # Confronta il ciclo recv()/write() con splice(); il tempo CPU è dell'intero processo
+    results = {"bytes": size}
+    ok = True
+    for label, zero_copy in (("recv", False), ("splice", True)):
+        harness.receiver.zero_copy_receive = zero_copy
+        received = os.path.join(harness.receive_dir, f"{label}.bin")
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        ok = harness.sender.send_file(path, 0, remote_name=f"{label}.bin") and ok
+        ok = ok and harness.wait_received(received, size)
+        results[f"{label}_mb_per_sec"] = size / (time.perf_counter() - start) / 1e6
+        results[f"{label}_cpu_seconds"] = time.process_time() - cpu_start
+        with open(path, "rb") as a, open(received, "rb") as b:
+            ok = ok and a.read() == b.read()
+    results["ok"] = ok
+    return results
+
+
+def bench_receiver_pool(harness, args):
+    size = max(1, args.size_mb // 4) * 1024 * 1024
+    peers = args.peers
+    paths = []
+    for i in range(peers):
+        path = os.path.join(harness.source_dir, f"peer_{i}.bin")
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+
+    workers = args.workers or os.cpu_count() or 1
+    pool = ReceiverPool(harness.receiver.config_service, workers)
+    pool.port = free_port()
+    pool.receiver.discovery_port = free_port(socket.SOCK_DGRAM)
+    # I worker sono processi separati: si silenzia il loro stdout a livello di descrittore
+    sys.stdout.flush()
+    saved_stdout = os.dup(1)
+    os.dup2(harness._devnull.fileno(), 1)
+    try:
+        started = pool.start(block=False)
+    finally:
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+    if not started:
+        return {"ok": False}
+    harness.sender.devices["devices"].append({"name": "pool", "ip": "127.0.0.1", "port": pool.port})
+
+    # Più peer inviano contemporaneamente: prima al receiver singolo, poi al pool
+    results = {"peers": peers, "workers": workers, "bytes": size * peers}
+    ok = True
+    try:
+        for label, device_index in (("single", 0), ("pool", 1)):
+            outcomes = []
+            start = time.perf_counter()
+            threads = [threading.Thread(target=lambda i=i: outcomes.append(
+                harness.sender.send_file(paths[i], device_index, remote_name=f"{label}_{i}.bin"))) for i in range(peers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for i in range(peers):
+                ok = ok and harness.wait_received(os.path.join(harness.receive_dir, f"{label}_{i}.bin"), size)
+            results[f"{label}_mb_per_sec"] = size * peers / (time.perf_counter() - start) / 1e6
+            ok = ok and all(outcomes)
+    finally:
+        pool.stop()
+    results["ok"] = ok
+    return results
+
+
+def bench_stream(harness, args):
+    size = args.size_mb * 1024 * 1024
+    data = os.urandom(size)
+
+    # Una pipe del sistema operativo: il sender non conosce la lunghezza
+    read_fd, write_fd = os.pipe()
+
+    def produce():
+        with os.fdopen(write_fd, "wb") as w:
+            for offset in range(0, size, 64 * 1024):
+                w.write(data[offset:offset + 64 * 1024])
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    start = time.perf_counter()
+    with os.fdopen(read_fd, "rb") as source, harness.quiet():
+        ok = harness.sender.send_stream(source, 0, "stream.bin")
+    elapsed = time.perf_counter() - start
+    producer.join()
+
+    # La conferma arriva dopo il rename: il file è già completo
+    with open(os.path.join(harness.receive_dir, "stream.bin"), "rb") as f:
+        ok = ok and f.read() == data
+    return {"ok": ok, "bytes": size, "seconds": elapsed, "mb_per_sec": size / elapsed / 1e6}
+
+
+def bench_sink(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "payload.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    expected = hashlib.sha256(open(path, "rb").read()).hexdigest()
+
+    # Consumatore tipico: calcola l'hash dei dati ricevuti.
+    # Su disco: ricezione nella cartella e rilettura del file
+    start = time.perf_counter()
+    with harness.quiet():
+        ok = harness.sender.send_file(path, 0, remote_name="disk.bin")
+    received = os.path.join(harness.receive_dir, "disk.bin")
+    ok = ok and harness.wait_received(received, size)
+    with open(received, "rb") as f:
+        ok = ok and hashlib.sha256(f.read()).hexdigest() == expected
+    disk_elapsed = time.perf_counter() - start
+
+    # Con un sink: i blocchi arrivano al consumatore senza passare dal disco
+    digests = []
+
+    def consume(sink):
+        hasher = hashlib.sha256()
+        for data in sink:
+            hasher.update(data)
+        digests.append(hasher.hexdigest())
+
+    consumers = []
+
+    def factory(file_info, sender_ip):
+        sink = IteratorSink()
+        consumer = threading.Thread(target=consume, args=(sink,))
+        consumer.start()
+        consumers.append(consumer)
+        return sink
+
+    harness.receiver.set_sink_factory(factory)
+    try:
+        start = time.perf_counter()
+        with harness.quiet():
+            ok = harness.sender.send_file(path, 0, remote_name="sink.bin") and ok
+        while not consumers:
+            time.sleep(0.001)
+        consumers[0].join(30)
+        sink_elapsed = time.perf_counter() - start
+    finally:
+        harness.receiver.set_sink_factory(None)
+    ok = ok and digests == [expected] and not os.path.exists(os.path.join(harness.receive_dir, "sink.bin"))
+    return {
+        "ok": ok,
+        "bytes": size,
+        "disk_mb_per_sec": size / disk_elapsed / 1e6,
+        "sink_mb_per_sec": size / sink_elapsed / 1e6
+    }
+
+
+def bench_http(harness, args):
+    size = args.size_mb * 1024 * 1024
+    data = os.urandom(size)
+    with open(os.path.join(harness.receive_dir, "shared.bin"), "wb") as f:
+        f.write(data)
+
+    port = free_port()
+    with harness.quiet():
+        harness.receiver.config_service.update(http_port=port)
+    if harness.receiver.http_gateway is None:
+        return {"ok": False}
+
+    # Ogni client usa una connessione keep-alive e scarica le sue parti con Range
+    clients = args.peers
+    part_size = 1024 * 1024
+    parts = [(offset, min(offset + part_size, size) - 1) for offset in range(0, size, part_size)]
+    received = {}
+
+    def client(index):
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        try:
+            for start, end in parts[index::clients]:
+                connection.request("GET", "/shared.bin", headers={"Range": f"bytes={start}-{end}"})
+                response = connection.getresponse()
+                if response.status == 206:
+                    received[start] = response.read()
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ok = b"".join(received[offset] for offset, _ in parts) == data if len(received) == len(parts) else False
+
+    # Richiesta condizionale: con l'ETag già noto il server risponde 304
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    try:
+        connection.request("HEAD", "/shared.bin")
+        response = connection.getresponse()
+        response.read()
+        etag = response.getheader("ETag")
+        connection.request("GET", "/shared.bin", headers={"If-None-Match": etag})
+        response = connection.getresponse()
+        response.read()
+        ok = ok and response.status == 304
+    finally:
+        connection.close()
+        with harness.quiet():
+            harness.receiver.config_service.update(http_port=None)
+    return {"ok": ok, "bytes": size, "clients": clients, "seconds": elapsed, "mb_per_sec": size / elapsed / 1e6}
+
+
+def bench_relay(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "image.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    receivers, indexes = harness.add_receivers(args.peers)
+    targets = [os.path.join(r.config["receive_directory"], "image.bin") for r in receivers]
+
+    def verify():
+        with open(path, "rb") as f:
+            data = f.read()
+        ok = True
+        for target in targets:
+            with open(target, "rb") as f:
+                ok = ok and f.read() == data
+            os.remove(target)
+        return ok
+
+    results = {"peers": len(receivers), "bytes": size}
+    try:
+        # Un invio per destinatario, uno dopo l'altro
+        start = time.perf_counter()
+        with harness.quiet():
+            ok = all(harness.sender.send_file(path, i) for i in indexes)
+        ok = ok and all(harness.wait_received(target, size) for target in targets)
+        results["sequential_seconds"] = time.perf_counter() - start
+        ok = verify() and ok
+
+        # Catena: ogni nodo inoltra al successivo mentre scrive
+        messages = []
+        start = time.perf_counter()
+        with harness.quiet():
+            ok = harness.sender.send_relay(path, indexes, progress_callback=messages.append) and ok
+        results["chain_seconds"] = time.perf_counter() - start
+        ok = verify() and ok
+        results["progress_messages"] = len(messages)
+    finally:
+        with harness.quiet():
+            for receiver in receivers[1:]:
+                receiver.stop()
+    results["ok"] = ok
+    return results
+
+
+def bench_swarm(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "rollout.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+    # Gli annunci dei pezzi passano dalla porta di discovery: serve su ogni receiver
+    receivers, indexes = harness.add_receivers(args.peers, discovery=True)
+    targets = [os.path.join(r.config["receive_directory"], "rollout.bin") for r in receivers]
+    messages = []
+    try:
+        start = time.perf_counter()
+        with harness.quiet():
+            ok = harness.sender.send_swarm(path, indexes, progress_callback=messages.append)
+        elapsed = time.perf_counter() - start
+        with open(path, "rb") as f:
+            data = f.read()
+        for target in targets:
+            with open(target, "rb") as f:
+                ok = ok and f.read() == data
+    finally:
+        with harness.quiet():
+            for receiver in receivers[1:]:
+                receiver.stop()
+    return {
+        "ok": ok,
+        "peers": len(receivers),
+        "bytes": size,
+        "seconds": elapsed,
+        "mb_per_sec_per_peer": size / elapsed / 1e6,
+        "progress_messages": len(messages)
+    }
+
+
+def bench_mux(harness, args):
+    size = args.size_mb * 1024 * 1024
+    bulk_path = os.path.join(harness.source_dir, "image.bin")
+    small_path = os.path.join(harness.source_dir, "config.json")
+    with open(bulk_path, "wb") as f:
+        f.write(os.urandom(size))
+    with open(small_path, "wb") as f:
+        f.write(os.urandom(2048))
+    small_received = os.path.join(harness.receive_dir, "config.json")
+
+    # Latenza del file piccolo accodato quando il trasferimento bulk è al 10%
+    started = threading.Event()
+    progress = lambda percent: percent >= 10 and started.set()
+
+    # Un trasferimento per volta: il file piccolo attende la fine del bulk
+    with harness.quiet():
+        bulk = threading.Thread(target=harness.sender.send_file, args=(bulk_path, 0),
+                                kwargs={"progress_callback": progress})
+        bulk.start()
+        started.wait(30)
+        start = time.perf_counter()
+        bulk.join()
+        ok = harness.wait_received(os.path.join(harness.receive_dir, "image.bin"), size)
+        ok = harness.sender.send_file(small_path, 0) and ok
+        ok = ok and harness.wait_received(small_received, 2048)
+    queued_latency = time.perf_counter() - start
+    os.remove(small_received)
+
+    # Sessione multiplexata: il file piccolo passa tra un frame e l'altro del bulk
+    started.clear()
+    with harness.quiet():
+        session = harness.sender.open_mux(0)
+        if session is None:
+            return {"ok": False}
+        bulk_start = time.perf_counter()
+        bulk = session.send_file(bulk_path, remote_name="image_mux.bin", progress_callback=progress)
+        started.wait(30)
+        start = time.perf_counter()
+        small = session.send_file(small_path)
+        ok = small.wait(30) and ok
+        mux_latency = time.perf_counter() - start
+        ok = bulk.wait(60) and ok
+        bulk_elapsed = time.perf_counter() - bulk_start
+        session.close()
+    with open(bulk_path, "rb") as a, open(os.path.join(harness.receive_dir, "image_mux.bin"), "rb") as b:
+        ok = ok and a.read() == b.read()
+    return {
+        "ok": ok,
+        "bytes": size,
+        "queued_small_latency_ms": queued_latency * 1000,
+        "mux_small_latency_ms": mux_latency * 1000,
+        "mux_bulk_mb_per_sec": size / bulk_elapsed / 1e6
+    }
+
+
+def bench_udp(harness, args):
+    size = args.size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "bulk.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    with open(path, "rb") as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+
+    def received_ok(name):
+        with open(os.path.join(harness.receive_dir, name), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest() == expected
+
+    # Riferimento: TCP sul loopback
+    device = harness.sender.devices["devices"][0]
+    start = time.perf_counter()
+    with harness.quiet():
+        ok = harness.sender.send_file(path, 0, remote_name="tcp.bin")
+    ok = ok and harness.wait_received(os.path.join(harness.receive_dir, "tcp.bin"), size) and received_ok("tcp.bin")
+    tcp_elapsed = time.perf_counter() - start
+
+    # UDP attraverso un collegamento con perdite e ritardo (tipo ponte Wi-Fi)
+    udp_port = free_port(socket.SOCK_DGRAM)
+    harness.receiver.config["udp_port"] = udp_port
+    results = {"tcp_mb_per_sec": size / tcp_elapsed / 1e6}
+    device["transport"] = "udp"
+    for label, loss in (("udp", 0.0), ("udp_loss", 0.02)):
+        link = UdpProxy(udp_port, {"latency": 0.005, "loss": loss, "queue": 1.0})
+        device["udp_port"] = link.port
+        start = time.perf_counter()
+        try:
+            with harness.quiet():
+                ok = harness.sender.send_file(path, 0, remote_name=f"{label}.bin", replace=True) and ok
+        finally:
+            link.close()
+        elapsed = time.perf_counter() - start
+        ok = ok and received_ok(f"{label}.bin")
+        results[f"{label}_mb_per_sec"] = size / elapsed / 1e6
+        results[f"{label}_dropped"] = link.stats["dropped"]
+    del device["transport"], device["udp_port"]
+    return {"ok": ok, "bytes": size, **results}
+
+
+def probe_discovery(port, probes=500, timeout=1.0):
+    """Richieste di discovery singole (come una scansione del Sender), da socket distinti;
+    restituisce la frazione con risposta e la latenza mediana in ms"""
+    sockets = []
+    sent = {}
+    latencies = []
+    # selectors e non select(): con centinaia di sonde i descrittori superano FD_SETSIZE
+    selector = selectors.DefaultSelector()
+
+    def collect(wait):
+        for key, _ in selector.select(wait):
+            sock = key.fileobj
+            sock.recv(1024)
+            latencies.append((time.perf_counter() - sent[sock]) * 1000)
+            selector.unregister(sock)
+
+    try:
+        # Le risposte vengono lette anche durante l'invio, per non gonfiare la latenza
+        for _ in range(probes):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sockets.append(sock)
+            selector.register(sock, selectors.EVENT_READ)
+            sent[sock] = time.perf_counter()
+            sock.sendto(DISCOVERY_REQUEST_COMPACT, ("127.0.0.1", port))
+            collect(0.002)
+        deadline = time.perf_counter() + timeout
+        while selector.get_map() and time.perf_counter() < deadline:
+            collect(max(0.0, deadline - time.perf_counter()))
+    finally:
+        selector.close()
+        for sock in sockets:
+            sock.close()
+    latencies.sort()
+    return len(latencies) / probes, latencies[len(latencies) // 2] if latencies else None
+
+
+def bench_network(harness, args):
+    size = args.network_size_mb * 1024 * 1024
+    path = os.path.join(harness.source_dir, "payload.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    with open(path, "rb") as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+
+    # Si misura il collegamento, non il rate limiter: le sonde arrivano tutte dallo stesso IP
+    harness.receiver.discovery_limiter = RateLimiter(rate=10000, burst=10000)
+    udp_port = free_port(socket.SOCK_DGRAM)
+    harness.receiver.config["udp_port"] = udp_port
+
+    presets = args.presets.split(",") if args.presets else list(PRESETS)
+    # Seme diverso a ogni esecuzione (riportato nei risultati, --seed per ripeterla)
+    seed = args.seed if args.seed is not None else random.randrange(1 << 30)
+    ok = True
+    results = {"seed": seed}
+    for preset in presets:
+        tcp_proxy = TcpProxy(harness.receiver.port, preset, seed=seed)
+        udp_proxy = UdpProxy(udp_port, preset, seed=seed + 2)
+        discovery_proxy = UdpProxy(harness.receiver.discovery_port, preset, seed=seed + 4)
+        index = len(harness.sender.devices["devices"])
+        device = {"name": preset, "ip": "127.0.0.1", "port": tcp_proxy.port, "transport": "tcp"}
+        harness.sender.devices["devices"].append(device)
+        try:
+            for transport in ("tcp", "udp"):
+                name = f"{preset}_{transport}.bin"
+                device["transport"] = transport
+                device["udp_port"] = udp_proxy.port
+                start = time.perf_counter()
+                with harness.quiet():
+                    sent = harness.sender.send_file(path, index, remote_name=name)
+                received = os.path.join(harness.receive_dir, name)
+                sent = sent and harness.wait_received(received, size, timeout=120)
+                elapsed = time.perf_counter() - start
+                if sent:
+                    with open(received, "rb") as f:
+                        sent = hashlib.sha256(f.read()).hexdigest() == expected
+                ok = ok and sent
+                results[f"{preset}_{transport}_seconds"] = elapsed if sent else None
+            reliability, latency = probe_discovery(discovery_proxy.port, args.discovery_probes)
+            loss = discovery_proxy.up.profile["loss"]
+            results[f"{preset}_discovery_ratio"] = reliability
+            results[f"{preset}_discovery_expected"] = (1 - loss) ** 2  # Richiesta e risposta
+            results[f"{preset}_discovery_dropped"] = discovery_proxy.stats["dropped"]
+            results[f"{preset}_discovery_ms"] = latency
+            results[f"{preset}_tcp_retransmits"] = tcp_proxy.stats["retransmitted"]
+        finally:
+            for proxy in (tcp_proxy, udp_proxy, discovery_proxy):
+                proxy.close()
+    return {"ok": ok, "bytes": size, **results}
+
+
+# Scenari disponibili: nome -> funzione(harness, args)
+SCENARIOS = {
+    "single_file": bench_single_file,
+    "small_files": bench_small_files,
+    "sparse_file": bench_sparse_file,
+    "multipath": bench_multipath,
+    "sync": bench_sync,
+    "dedup": bench_dedup,
+    "encryption": bench_encryption,
+    "compression": bench_compression,
+    "discovery": bench_discovery,
+    "zero_copy": bench_zero_copy,
+    "receiver_pool": bench_receiver_pool,
+    "stream": bench_stream,
+    "sink": bench_sink,
+    "http": bench_http,
+    "relay": bench_relay,
+    "swarm": bench_swarm,
+    "mux": bench_mux,
+    "udp": bench_udp,
+    "network": bench_network
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di ZapShare sul loopback")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help="Scenari da eseguire")
+    parser.add_argument("--size-mb", type=int, default=64, help="Dimensione del file singolo (MB)")
+    parser.add_argument("--small-files", type=int, default=2000, help="Numero di file piccoli")
+    parser.add_argument("--small-file-size", type=int, default=4096, help="Dimensione dei file piccoli (bytes)")
+    parser.add_argument("--paths", type=int, default=2, help="Percorsi per lo scenario multipath")
+    parser.add_argument("--digest", action="store_true", help="Invia e verifica lo SHA-256 nello scenario single_file")
+    parser.add_argument("--peers", type=int, default=4, help="Invii contemporanei nello scenario receiver_pool")
+    parser.add_argument("--workers", type=int, default=0, help="Processi/thread della pipeline (0 = numero di core)")
+    parser.add_argument("--link", choices=list(PRESETS), help="Profilo di rete emulato verso il receiver principale")
+    parser.add_argument("--presets", help="Profili dello scenario network, separati da virgole (default: tutti)")
+    parser.add_argument("--discovery-probes", type=int, default=500, help="Richieste di discovery per profilo nello scenario network")
+    parser.add_argument("--seed", type=int, help="Seme dei profili di rete nello scenario network (default: casuale)")
+    parser.add_argument("--network-size-mb", type=int, default=8, help="Dimensione del file nello scenario network (MB)")
+    parser.add_argument("--json", action="store_true", help="Stampa i risultati in formato JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    original_dir = os.getcwd()
+    # Identità TLS e cache degli hash del benchmark fuori dalla cartella dati dell'utente
+    data_dir = tempfile.TemporaryDirectory(prefix="zapshare_bench_data_")
+    os.environ["ZAPSHARE_DATA_DIR"] = data_dir.name
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            print(f"Scenario sconosciuto: {name}")
+            return 1
+        with tempfile.TemporaryDirectory(prefix="zapshare_bench_") as work_dir:
+            # Sender e Receiver salvano i file dei dispositivi nella cartella corrente
+            os.chdir(work_dir)
+            harness = LoopbackHarness(work_dir, args.link)
+            try:
+                with harness.quiet():
+                    results[name] = SCENARIOS[name](harness, args)
+            finally:
+                harness.close()
+                os.chdir(original_dir)
+
+        if not args.json:
+            summary = ", ".join(
+                f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in results[name].items()
+            )
+            print(f"{name}: {summary}")
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
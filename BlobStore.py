@@ -0,0 +1,87 @@
+import os
+import sys
+import stat
+import shutil
+import tempfile
+
+# ioctl di Linux per clonare un file (reflink, es. btrfs/XFS)
+FICLONE = 0x40049409
+
+
+def reflink(source, destination):
+    """Copia copy-on-write del file; solleva OSError se il filesystem non la supporta"""
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflink non supportato")
+    import fcntl
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+class BlobStore:
+    """Archivio di file indirizzati per contenuto (SHA-256) lato receiver.
+
+    Quando un sender offre l'hash di un file già presente, il receiver lo
+    clona nella cartella di ricezione (reflink, altrimenti copia) senza
+    trasferire dati. Niente hardlink: un file ricevuto modificato sul posto
+    altererebbe il blob, che poi verrebbe offerto con l'hash sbagliato.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, digest):
+        digest = digest.lower()
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Hash non valido: {digest}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def has(self, digest):
+        try:
+            st = os.stat(self.path_for(digest))
+        except (ValueError, OSError):
+            return False
+        # Un blob con altri link (archivi creati prima del divieto di hardlink) può
+        # essere stato modificato attraverso il file ricevuto: non è affidabile
+        return stat.S_ISREG(st.st_mode) and st.st_nlink == 1
+
+    def add(self, path, digest):
+        """Aggiunge all'archivio un file appena ricevuto (già verificato)"""
+        blob_path = self.path_for(digest)
+        if os.path.exists(blob_path):
+            return blob_path
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # Clone o copia in un file temporaneo, poi rename: il blob è sempre completo
+        fd, tmp_path = tempfile.mkstemp(prefix=".blob.", dir=os.path.dirname(blob_path))
+        os.close(fd)
+        try:
+            try:
+                reflink(path, tmp_path)
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, blob_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return blob_path
+
+    def link_into(self, digest, destination):
+        """Crea destination a partire dal blob; restituisce il metodo usato"""
+        blob_path = self.path_for(digest)
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            reflink(blob_path, destination)
+            return "reflink"
+        except OSError:
+            pass
+        shutil.copyfile(blob_path, destination)
+        return "copy"
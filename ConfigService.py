@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import threading
+import tempfile
+
+
+class ConfigService:
+    """Configurazione condivisa in-process con notifiche di modifica.
+
+    Tutti i componenti (ZapShareApp, Sender, Receiver) leggono lo stesso
+    dizionario `data`, che viene aggiornato sul posto: i riferimenti restano
+    sempre validi. Le scritture su disco sono atomiche (file temporaneo +
+    os.replace), quindi un crash non lascia mai un JSON troncato.
+    """
+
+    def __init__(self, config_file="zapshare_config.json", defaults=None):
+        self.config_file = config_file
+        self.data = {}
+        self._lock = threading.RLock()
+        self._listeners = []
+
+        if os.path.exists(self.config_file):
+            self.reload(notify=False)
+        else:
+            # Configurazione di default
+            self.data.update(defaults or {})
+            self.save()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self.data[key]
+
+    def snapshot(self):
+        """Copia della configurazione corrente"""
+        with self._lock:
+            return dict(self.data)
+
+    def subscribe(self, callback):
+        """Registra una callback chiamata con il dizionario delle chiavi modificate"""
+        with self._lock:
+            if callable(callback) and callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def update(self, **values):
+        """Aggiorna una o più chiavi, salva su disco e notifica i listener"""
+        with self._lock:
+            changes = {k: v for k, v in values.items() if self.data.get(k, object()) != v}
+            if not changes:
+                return {}
+            self.data.update(changes)
+            self.save()
+            listeners = list(self._listeners)
+
+        self._notify(listeners, changes)
+        return changes
+
+    def set(self, key, value):
+        return self.update(**{key: value})
+
+    def reload(self, notify=True):
+        """Rilegge il file di configurazione (es. se modificato esternamente)"""
+        with open(self.config_file, 'r') as f:
+            loaded = json.load(f)
+
+        with self._lock:
+            changes = {k: v for k, v in loaded.items() if self.data.get(k, object()) != v}
+            self.data.update(loaded)
+            listeners = list(self._listeners)
+
+        if notify and changes:
+            self._notify(listeners, changes)
+        return changes
+
+    def save(self):
+        """Scrittura atomica del file di configurazione"""
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.config_file))
+            fd, tmp_path = tempfile.mkstemp(prefix=".zapshare_config.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.config_file)
+            except Exception:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+    def _notify(self, listeners, changes):
+        for callback in listeners:
+            try:
+                callback(dict(changes))
+            except Exception as e:
+                print(f"Errore nella callback di configurazione: {e}")
+
+
+def user_data_dir():
+    """Cartella per utente dei dati privati (identità TLS, cache degli hash), creata con permessi 0700.
+
+    ZAPSHARE_DATA_DIR la sostituisce (test e benchmark).
+    """
+    directory = os.environ.get("ZAPSHARE_DATA_DIR")
+    if not directory:
+        if sys.platform == "win32":
+            base = os.environ.get("APPDATA") or os.path.expanduser("~")
+            directory = os.path.join(base, "ZapShare")
+        elif sys.platform == "darwin":
+            directory = os.path.expanduser("~/Library/Application Support/ZapShare")
+        else:
+            base = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+            directory = os.path.join(base, "zapshare")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_config_service(config_file="zapshare_config.json", defaults=None):
+    """Restituisce l'istanza condivisa del servizio di configurazione per il file indicato"""
+    key = os.path.abspath(config_file)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = ConfigService(config_file, defaults)
+            _services[key] = service
+        return service
@@ -0,0 +1,116 @@
+import time
+import errno
+import socket
+import selectors
+
+# Ritardo tra un tentativo e il successivo (RFC 8305 suggerisce 250 ms)
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+_IN_PROGRESS = (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035)  # 10035 = WSAEWOULDBLOCK
+
+
+def order_addresses(addresses):
+    """Ordina gli indirizzi alternando le famiglie (IPv6, IPv4, IPv6, ...) senza duplicati"""
+    unique = []
+    for address in addresses:
+        if address and address not in unique:
+            unique.append(address)
+    v6 = [a for a in unique if ":" in a]
+    v4 = [a for a in unique if ":" not in a]
+    ordered = []
+    while v6 or v4:
+        if v6:
+            ordered.append(v6.pop(0))
+        if v4:
+            ordered.append(v4.pop(0))
+    return ordered
+
+
+def device_addresses(device):
+    """Tutti gli indirizzi annunciati da un dispositivo, in ordine di tentativo"""
+    return order_addresses(list(device.get("addresses", [])) + [device.get("ip")])
+
+
+def _sockaddr(address, port):
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    # getaddrinfo gestisce anche lo scope degli indirizzi link-local (fe80::1%eth0)
+    info = socket.getaddrinfo(address, port, family, socket.SOCK_STREAM, 0, socket.AI_NUMERICHOST)
+    return family, info[0][4]
+
+
+def _connect_error(err, address):
+    if err in (errno.ECONNREFUSED, 10061):  # 10061 = WSAECONNREFUSED
+        return ConnectionRefusedError(err, f"Connessione rifiutata da {address}")
+    return OSError(err, f"Connessione a {address} fallita")
+
+
+def connect_fastest(addresses, port, timeout=10, delay=CONNECTION_ATTEMPT_DELAY, source_address=None):
+    """Connessione "happy eyeballs": avvia i tentativi verso tutti gli indirizzi,
+    uno ogni `delay` secondi (o subito se il precedente fallisce), e usa il primo
+    che si connette. Restituisce (socket, indirizzo).
+    """
+    queue = list(addresses)
+    if not queue:
+        raise ConnectionError("Nessun indirizzo disponibile")
+
+    deadline = time.monotonic() + timeout
+    next_attempt = time.monotonic()
+    pending = {}
+    last_error = None
+
+    with selectors.DefaultSelector() as selector:
+        try:
+            while queue or pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+
+                # Avvia il prossimo tentativo
+                if queue and (now >= next_attempt or not pending):
+                    address = queue.pop(0)
+                    try:
+                        family, sockaddr = _sockaddr(address, port)
+                        sock = socket.socket(family, socket.SOCK_STREAM)
+                    except OSError as e:
+                        last_error = e
+                        continue
+                    try:
+                        if source_address is not None:
+                            sock.bind(source_address)
+                        sock.setblocking(False)
+                        err = sock.connect_ex(sockaddr)
+                    except OSError as e:
+                        sock.close()
+                        last_error = e
+                        continue
+                    if err not in _IN_PROGRESS:
+                        sock.close()
+                        last_error = _connect_error(err, address)
+                        next_attempt = now
+                        continue
+                    pending[sock] = address
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    next_attempt = now + delay
+
+                wait = deadline - now
+                if queue:
+                    wait = min(wait, max(0.0, next_attempt - now))
+                for key, _ in selector.select(wait):
+                    sock = key.fileobj
+                    address = pending.pop(sock)
+                    selector.unregister(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        sock.setblocking(True)
+                        return sock, address
+                    sock.close()
+                    last_error = _connect_error(err, address)
+                    # Un tentativo fallito fa partire subito il successivo
+                    next_attempt = time.monotonic()
+        finally:
+            for sock in pending:
+                sock.close()
+
+    if last_error is not None and not pending:
+        raise last_error
+    raise socket.timeout(f"Timeout durante la connessione a {', '.join(addresses)}")
@@ -0,0 +1,98 @@
+import json
+import time
+import socket
+import struct
+import threading
+from collections import OrderedDict
+
+# Richiesta originale (risposta JSON) e richiesta compatta (risposta binaria)
+DISCOVERY_REQUEST = b"DISCOVERY_REQUEST"
+DISCOVERY_REQUEST_COMPACT = b"ZSD1"
+
+# Risposta compatta: magic, versione, flag, porta, lunghezza del nome, numero di indirizzi
+_MAGIC = b"ZS"
+_VERSION = 1
+_HEADER = struct.Struct("!2sBBHBB")
+_FLAG_TLS = 0x01
+_FAMILIES = {4: (socket.AF_INET, 4), 6: (socket.AF_INET6, 16)}
+
+
+def encode_response(info):
+    """Codifica le informazioni del dispositivo nel formato binario compatto.
+
+    Il primo indirizzo è l'IP principale; gli indirizzi IPv6 sono senza scope.
+    """
+    name = info["name"].encode()[:255]
+    addresses = []
+    for address in [info["ip"]] + [a for a in info.get("addresses", []) if a != info["ip"]]:
+        address = address.split("%", 1)[0]
+        version = 6 if ":" in address else 4
+        family, _ = _FAMILIES[version]
+        try:
+            addresses.append(bytes([version]) + socket.inet_pton(family, address))
+        except OSError:
+            continue
+    addresses = addresses[:255]
+    flags = _FLAG_TLS if info.get("tls") else 0
+    return _HEADER.pack(_MAGIC, _VERSION, flags, info["port"], len(name), len(addresses)) + name + b"".join(addresses)
+
+
+def decode_response(data):
+    """Decodifica una risposta di discovery, compatta o JSON, nello stesso dizionario"""
+    if not data.startswith(_MAGIC):
+        return json.loads(data.decode())
+
+    magic, version, flags, port, name_length, count = _HEADER.unpack_from(data)
+    if version != _VERSION:
+        raise ValueError(f"Versione del formato di discovery non supportata: {version}")
+    offset = _HEADER.size
+    name = data[offset:offset + name_length].decode(errors="replace")
+    offset += name_length
+    addresses = []
+    for _ in range(count):
+        family, size = _FAMILIES[data[offset]]
+        addresses.append(socket.inet_ntop(family, data[offset + 1:offset + 1 + size]))
+        offset += 1 + size
+    if not addresses:
+        raise ValueError("Risposta di discovery senza indirizzi")
+    return {
+        "name": name,
+        "ip": addresses[0],
+        "port": port,
+        "addresses": addresses,
+        "tls": bool(flags & _FLAG_TLS)
+    }
+
+
+class RateLimiter:
+    """Token bucket per ogni indirizzo sorgente.
+
+    Ogni sorgente può inviare `burst` richieste di fila e poi `rate` al
+    secondo. Si ricordano al massimo max_sources sorgenti (le meno recenti
+    vengono dimenticate), così un flood da molti indirizzi non fa crescere
+    la memoria.
+    """
+
+    def __init__(self, rate=2.0, burst=5, max_sources=1024):
+        self.rate = rate
+        self.burst = burst
+        self.max_sources = max_sources
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, source, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.pop(source, None)
+            if bucket is None:
+                tokens, last = self.burst, now
+            else:
+                tokens, last = bucket
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[source] = (tokens, now)
+            if len(self._buckets) > self.max_sources:
+                self._buckets.popitem(last=False)
+            return allowed
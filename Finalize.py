@@ -0,0 +1,170 @@
+import os
+import uuid
+import filecmp
+import threading
+
+from Archive import safe_mode
+from Metrics import metrics
+from HashCache import get_hash_cache
+
+FSYNC_POLICIES = ("none", "file", "batched")
+COLLISION_POLICIES = ("overwrite", "rename", "skip-if-identical")
+
+PART_SUFFIX = ".zapshare-part"
+
+
+def temp_path_for(path):
+    """File temporaneo nascosto, nella stessa cartella (il rename resta atomico)"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}{PART_SUFFIX}")
+
+
+def numbered_path(path, number):
+    """'foto.jpg' -> 'foto (1).jpg'"""
+    root, ext = os.path.splitext(path)
+    return f"{root} ({number}){ext}"
+
+
+def fsync_directory(directory):
+    # Rende persistenti i rename (non supportato su Windows)
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Finalizer:
+    """Rende visibili i file ricevuti solo quando sono completi.
+
+    I dati vengono scritti in un file temporaneo nascosto che poi viene
+    rinominato al suo posto. fsync_policy decide la persistenza: "none"
+    (lascia fare al sistema operativo), "file" (fsync del file prima del
+    rename e della cartella dopo) oppure "batched" (fsync del file prima del
+    rename, mentre le fsync delle cartelle sono raggruppate in flush(), da
+    chiamare alla fine di un trasferimento di più file). I dati sono sempre
+    su disco prima del rename: dopo un crash, sotto il nome definitivo non
+    può comparire un file vuoto o troncato.
+    collision_policy decide cosa fare se il file esiste già: "overwrite",
+    "rename" (aggiunge " (1)", " (2)", ...) o "skip-if-identical".
+    """
+
+    def __init__(self, fsync_policy="batched", collision_policy="overwrite"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Politica di fsync non valida: {fsync_policy}")
+        if collision_policy not in COLLISION_POLICIES:
+            raise ValueError(f"Politica per i file esistenti non valida: {collision_policy}")
+        self.fsync_policy = fsync_policy
+        self.collision_policy = collision_policy
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def temp_path(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return temp_path_for(path)
+
+    def commit(self, temp_path, path, mtime_ns=None, mode=None, digest=None, policy=None):
+        """Sposta il file temporaneo completo al suo posto.
+
+        Restituisce il percorso finale, oppure None se il file era già
+        presente e identico (il temporaneo viene eliminato).
+        """
+        policy = policy or self.collision_policy
+        if mode is not None:
+            try:
+                os.chmod(temp_path, safe_mode(mode))
+            except OSError:
+                pass
+        if mtime_ns is not None:
+            os.utime(temp_path, ns=(mtime_ns, mtime_ns))
+        if self.fsync_policy != "none":
+            self._fsync_file(temp_path)
+
+        if policy == "skip-if-identical" and self._identical(temp_path, path, digest):
+            os.remove(temp_path)
+            metrics.inc("zapshare_files_skipped_total")
+            return None
+        if policy == "rename":
+            path = self._claim(temp_path, path)
+        else:
+            os.replace(temp_path, path)
+
+        if self.fsync_policy == "file":
+            fsync_directory(os.path.dirname(path) or ".")
+        elif self.fsync_policy == "batched":
+            with self._lock:
+                self._pending.append(os.path.dirname(path) or ".")
+        return path
+
+    def write(self, path, data, mtime_ns=None, mode=None, policy=None):
+        """Scrive un file piccolo già in memoria (temporaneo + commit)"""
+        temp_path = self.temp_path(path)
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            return self.commit(temp_path, path, mtime_ns, mode, policy=policy)
+        except BaseException:
+            self.discard(temp_path)
+            raise
+
+    def discard(self, temp_path):
+        """Elimina il file temporaneo di un trasferimento fallito"""
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    def flush(self):
+        """Rende persistenti i rename confermati con la politica "batched" (una fsync per cartella)"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        for directory in set(pending):
+            fsync_directory(directory)
+        metrics.inc("zapshare_fsync_batches_total")
+        return len(pending)
+
+    def _fsync_file(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _identical(self, temp_path, path, digest):
+        try:
+            if os.path.getsize(temp_path) != os.path.getsize(path):
+                return False
+        except OSError:
+            return False
+        if digest:
+            return get_hash_cache().digest(path) == digest
+        return filecmp.cmp(temp_path, path, shallow=False)
+
+    def _claim(self, temp_path, path):
+        # os.link non sovrascrive mai: il primo nome libero viene occupato in modo atomico
+        candidate = path
+        number = 0
+        while True:
+            try:
+                os.link(temp_path, candidate)
+                os.remove(temp_path)
+                return candidate
+            except FileExistsError:
+                number += 1
+                candidate = numbered_path(path, number)
+            except OSError:
+                # Filesystem senza hardlink
+                if not os.path.exists(candidate):
+                    os.replace(temp_path, candidate)
+                    return candidate
+                number += 1
+                candidate = numbered_path(path, number)
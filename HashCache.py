@@ -0,0 +1,151 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+from Metrics import metrics
+from ConfigService import user_data_dir
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+HASH_DB_FILE = "zapshare_hashes.db"
+
+# Un accesso aggiorna last_used solo se il valore salvato è più vecchio di così
+_TOUCH_INTERVAL = 3600
+
+
+def file_digest(path):
+    """SHA-256 del file (hashlib rilascia il GIL sui blocchi grandi)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashCache:
+    """Cache persistente degli hash dei file, su SQLite.
+
+    La chiave è (device, inode): una voce è valida solo se dimensione e
+    mtime_ns coincidono con quelli attuali del file, quindi un file non
+    modificato non viene mai riletto. Le voci meno usate vengono eliminate
+    quando si supera max_entries.
+    """
+
+    def __init__(self, db_path=None, max_entries=200000):
+        db_path = db_path or os.path.join(user_data_dir(), HASH_DB_FILE)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (dev, ino))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        self._db.commit()
+        self._entries = self._db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def lookup(self, path, st=None):
+        """Restituisce l'hash in cache se il file non è cambiato, altrimenti None"""
+        st = st or os.stat(path)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, mtime_ns, digest, last_used FROM hashes WHERE dev = ? AND ino = ?",
+                (st.st_dev, st.st_ino)
+            ).fetchone()
+            if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                self.hits += 1
+                if now - row[3] > _TOUCH_INTERVAL:
+                    self._db.execute("UPDATE hashes SET last_used = ? WHERE dev = ? AND ino = ?",
+                                     (now, st.st_dev, st.st_ino))
+                    self._db.commit()
+                metrics.inc("zapshare_hash_cache_hits_total")
+                return row[2]
+            self.misses += 1
+        metrics.inc("zapshare_hash_cache_misses_total")
+        return None
+
+    def store(self, path, digest, st=None):
+        """Salva l'hash di un file (st deve essere lo stat del file hashato)"""
+        st = st or os.stat(path)
+        with self._lock:
+            inserted = self._db.execute(
+                "SELECT 1 FROM hashes WHERE dev = ? AND ino = ?", (st.st_dev, st.st_ino)
+            ).fetchone() is None
+            self._db.execute(
+                "INSERT OR REPLACE INTO hashes (dev, ino, size, mtime_ns, digest, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, digest, time.time())
+            )
+            if inserted:
+                self._entries += 1
+            if self._entries > self.max_entries:
+                self._evict()
+            self._db.commit()
+        metrics.set_gauge("zapshare_hash_cache_entries", self._entries)
+
+    def digest(self, path):
+        """Hash del file: O(1) se in cache, altrimenti calcolato e salvato"""
+        st = os.stat(path)
+        cached = self.lookup(path, st)
+        if cached is not None:
+            return cached
+        digest = file_digest(path)
+        # Salva solo se il file non è cambiato durante la lettura
+        after = os.stat(path)
+        if after.st_size == st.st_size and after.st_mtime_ns == st.st_mtime_ns:
+            self.store(path, digest, after)
+        return digest
+
+    def _evict(self):
+        # Elimina le voci meno usate, lasciando un margine del 10%
+        target = int(self.max_entries * 0.9)
+        remove = self._entries - target
+        self._db.execute(
+            "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY last_used LIMIT ?)", (remove,)
+        )
+        self._entries = self._db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def stats(self):
+        """Statistiche della cache (per il monitoraggio)"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": self._entries,
+                "max_entries": self.max_entries
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_hash_cache(db_path=None):
+    """Restituisce la cache degli hash condivisa dal processo per il file indicato
+    (predefinito: nella cartella dati dell'utente)"""
+    db_path = db_path or os.path.join(user_data_dir(), HASH_DB_FILE)
+    key = os.path.abspath(db_path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = HashCache(db_path)
+            _caches[key] = cache
+        return cache
@@ -0,0 +1,210 @@
+import os
+import html
+import threading
+import mimetypes
+import urllib.parse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Metrics import metrics
+from Archive import safe_join
+from Finalize import PART_SUFFIX
+
+
+def make_etag(st):
+    """ETag forte da inode, dimensione e data di modifica (il Finalizer sostituisce i file con un rename)"""
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """Intervallo (inizio, fine inclusa) di un header Range "bytes=...".
+
+    Restituisce None se l'header va ignorato (sintassi non valida o più
+    intervalli: si risponde con il file intero) e "unsatisfiable" se
+    l'intervallo è fuori dal file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # Suffisso: gli ultimi N byte
+            length = int(last)
+            if length <= 0:
+                return "unsatisfiable"
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start > end:
+        return None
+    if start >= size:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    server_version = "ZapShare"
+    timeout = 60  # Connessioni inattive
+
+    def handle(self):
+        if not self.server.gateway.is_allowed(self.client_address[0]):
+            metrics.inc("zapshare_http_requests_total", status="forbidden")
+            return
+        super().handle()
+
+    def do_GET(self):
+        self.serve(head=False)
+
+    def do_HEAD(self):
+        self.serve(head=True)
+
+    def log_message(self, format, *args):
+        # Una riga per richiesta sarebbe troppo: restano le metriche
+        pass
+
+    def serve(self, head):
+        directory = self.server.gateway.directory()
+        relative = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip("/")
+        try:
+            path = safe_join(directory, relative) if relative.strip("/") else directory
+        except ValueError:
+            return self.reply_error(400)
+        # I file temporanei e quelli nascosti non sono condivisi (si controllano le parti
+        # del percorso effettivo: safe_join tratta anche "\\" come separatore)
+        parts = os.path.relpath(path, directory).split(os.sep)
+        if any(part.startswith(".") and part != "." for part in parts) or path.endswith(PART_SUFFIX):
+            return self.reply_error(404)
+        if os.path.isdir(path):
+            return self.serve_listing(path, relative, head)
+
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return self.reply_error(404)
+        with f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = make_etag(st)
+
+            if etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                metrics.inc("zapshare_http_requests_total", status="304")
+                return
+
+            # If-Range: l'intervallo vale solo se il file non è cambiato
+            byte_range = None
+            if "Range" in self.headers and self.headers.get("If-Range", etag) == etag:
+                byte_range = parse_range(self.headers["Range"], size)
+            if byte_range == "unsatisfiable":
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                metrics.inc("zapshare_http_requests_total", status="416")
+                return
+
+            if byte_range is None:
+                status, offset, count = 200, 0, size
+            else:
+                status, offset, count = 206, byte_range[0], byte_range[1] - byte_range[0] + 1
+            self.send_response(status)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(count))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", formatdate(st.st_mtime, usegmt=True))
+            if status == 206:
+                self.send_header("Content-Range", f"bytes {offset}-{offset + count - 1}/{size}")
+            self.end_headers()
+            metrics.inc("zapshare_http_requests_total", status=str(status))
+            if head or count == 0:
+                return
+
+            # sendfile(): i dati vanno dal page cache al socket senza passare in userspace
+            sent = self.connection.sendfile(f, offset, count)
+            metrics.inc("zapshare_http_bytes_sent_total", sent)
+            if sent < count:
+                # File accorciato durante l'invio: la risposta non si può completare
+                self.close_connection = True
+
+    def serve_listing(self, path, relative, head):
+        base = "/" + relative.strip("/") + "/" if relative.strip("/") else "/"
+        items = []
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.name.startswith(".") or entry.name.endswith(PART_SUFFIX):
+                continue
+            name = entry.name + ("/" if entry.is_dir() else "")
+            href = urllib.parse.quote(base + name)
+            items.append(f'<li><a href="{href}">{html.escape(name)}</a></li>')
+        body = (f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{html.escape(base)}</title></head>"
+                f"<body><h1>{html.escape(base)}</h1><ul>{''.join(items)}</ul></body></html>").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        metrics.inc("zapshare_http_requests_total", status="200")
+        if not head:
+            self.wfile.write(body)
+
+    def reply_error(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        metrics.inc("zapshare_http_requests_total", status=str(status))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 64  # Molti client in parallelo
+
+    def __init__(self, sock, gateway):
+        # Il socket è già collegato dal Receiver (dual-stack, porta esclusiva)
+        super().__init__(sock.getsockname()[:2], _Handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.gateway = gateway
+        self.server_activate()
+
+
+class HttpGateway:
+    """Server HTTP/1.1 in sola lettura sulla cartella condivisa.
+
+    Pensato per i client della LAN senza ZapShare (browser, curl, download
+    manager): connessioni keep-alive, richieste Range (più client o più
+    connessioni possono scaricare parti diverse in parallelo), invio con
+    sendfile() ed ETag per le richieste condizionali.
+    """
+
+    def __init__(self, directory, is_allowed=None):
+        # directory è una funzione: la cartella può cambiare a caldo nella configurazione
+        self.directory = directory
+        self.is_allowed = is_allowed or (lambda ip: True)
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server else None
+
+    def start(self, sock):
+        self._server = _Server(sock, self)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="zapshare-http")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(1.0)
+        self._server = self._thread = None
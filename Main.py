@@ -13,14 +13,24 @@ import pystray
 
 from Sender import Sender
 from Receiver import Receiver
+from ReceiverPool import ReceiverPool
+from Metrics import metrics
+from ConfigService import get_config_service
 
 class ZapShareApp:
     def __init__(self, root=None):
         self.config_file = "zapshare_config.json"
         self.config = self.load_config()
 
+        # Strumentazione opzionale: endpoint Prometheus/JSON sulla porta configurata
+        if self.config.get("metrics_port"):
+            try:
+                metrics.start_http_server(self.config["metrics_port"])
+            except Exception as e:
+                print(f"Impossibile avviare il server delle metriche: {e}")
+
         # Inizializza sender e receiver
-        self.sender = Sender()
+        self.sender = Sender(self.config_service)
         self.receiver = None
         self.tray_icon = None  # Inizializza la variabile tray_icon
 
@@ -55,26 +65,19 @@ class ZapShareApp:
             self.start_receiver()
 
     def load_config(self):
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
-        else:
-            # Configurazione di default
-            default_config = {
-                "receive_directory": str(Path.home() / "Downloads"),
-                "start_with_windows": False,
-                "computer_name": socket.gethostname(),
-                "first_run": True
-            }
-            with open(self.config_file, 'w') as f:
-                json.dump(default_config, f, indent=4)
-            return default_config
+        # Configurazione di default (usata solo se il file non esiste)
+        default_config = {
+            "receive_directory": str(Path.home() / "Downloads"),
+            "start_with_windows": False,
+            "computer_name": socket.gethostname(),
+            "first_run": True
+        }
+        self.config_service = get_config_service(self.config_file, default_config)
+        return self.config_service.data
 
     def save_config(self):
         """Salva la configurazione su file"""
-        self.config["first_run"] = False
-        with open(self.config_file, 'w') as f:
-            json.dump(self.config, f, indent=4)
+        self.config_service.update(first_run=False)
 
     def setup_ui(self):
         # Menu principale
@@ -369,8 +372,10 @@ class ZapShareApp:
         btn_frame.pack(fill="x", padx=20, pady=20)
         
         def save_settings():
-            self.config["computer_name"] = computer_name_var.get()
-            self.config["receive_directory"] = receive_dir_var.get()
+            self.config_service.update(
+                computer_name=computer_name_var.get(),
+                receive_directory=receive_dir_var.get()
+            )
             
             # Crea la directory di destinazione se non esiste
             if not os.path.exists(receive_dir_var.get()):
@@ -403,14 +408,14 @@ class ZapShareApp:
             if enable:
                 # Aggiunge l'applicazione all'avvio di Windows
                 winreg.SetValueEx(key, app_name, 0, winreg.REG_SZ, sys.executable)
-                self.config["start_with_windows"] = True
+                self.config_service.update(start_with_windows=True)
             else:
                 # Rimuove l'applicazione dall'avvio di Windows
                 try:
                     winreg.DeleteValue(key, app_name)
                 except:
                     pass
-                self.config["start_with_windows"] = False
+                self.config_service.update(start_with_windows=False)
             
             winreg.CloseKey(key)
             return True
@@ -430,15 +435,18 @@ class ZapShareApp:
     def start_receiver(self):
         # Avvia il receiver in un thread separato
         if not self.receiver:
-            self.receiver = Receiver()
-            self.receiver.config = self.config.copy()
+            # Con più processi il kernel distribuisce le connessioni tra i worker (SO_REUSEPORT)
+            processes = self.config_service.get("receiver_processes", 1)
+            if processes > 1:
+                self.receiver = ReceiverPool(self.config_service, processes)
+            else:
+                self.receiver = Receiver(self.config_service)
             
             # Aggiungi una callback per la ricezione dei file
             self.receiver.add_transfer_callback(self.on_file_received)
             
-            receiver_thread = threading.Thread(target=self.receiver.start)
-            receiver_thread.daemon = True
-            receiver_thread.start()
+            # Collega subito i socket e avvia i servizi in background
+            self.receiver.start(block=False)
             
             # Aggiorna stato
             self.connection_status.config(text=f"Stato: In ascolto su {self.receiver.ip}")
@@ -602,10 +610,6 @@ class ZapShareApp:
         })
 
     def save_settings(self):
-        # Salva le impostazioni
-        self.config["computer_name"] = self.computer_name_var.get()
-        self.config["receive_directory"] = self.receive_dir_var.get()
-        
         # Crea la directory di destinazione se non esiste
         receive_dir = self.receive_dir_var.get()
         if not os.path.exists(receive_dir):
@@ -616,36 +620,17 @@ class ZapShareApp:
                 messagebox.showerror("Errore", f"Impossibile creare la directory: {e}")
                 return
         
-        # Salva le modifiche nel file di configurazione
-        with open(self.config_file, 'w') as f:
-            json.dump(self.config, f, indent=4)
+        # Salva le impostazioni: il receiver in esecuzione riceve la notifica
+        # e applica le modifiche a caldo, senza chiudere le connessioni attive
+        self.config_service.update(
+            computer_name=self.computer_name_var.get(),
+            receive_directory=receive_dir
+        )
         
         # Imposta l'avvio automatico
         if self.startup_var.get() != self.config["start_with_windows"]:
             self.set_startup(self.startup_var.get())
         
-        # Aggiorna le impostazioni del receiver
-        if self.receiver:
-            # Aggiorna la configurazione nel receiver
-            self.receiver.config.update(self.config)
-            self.receiver.save_config()
-            
-            # Importante: registra di nuovo il dispositivo con il nuovo nome
-            self.receiver.register_device()
-            
-            # Se il receiver è in esecuzione, riavvialo per applicare le modifiche
-            if self.receiver.running:
-                messagebox.showinfo("Riavvio Necessario", 
-                                  "Alcune impostazioni richiedono il riavvio del servizio di ricezione. " + 
-                                  "ZapShare verrà riavviato.")
-                
-                # Ferma il receiver attuale
-                self.receiver.stop()
-                
-                # Avvia un nuovo receiver con le nuove impostazioni
-                self.receiver = None
-                self.start_receiver()
-        
         messagebox.showinfo("Impostazioni", "Impostazioni salvate con successo")
         
         # Aggiorna l'interfaccia utente
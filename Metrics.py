@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket (in secondi) usati per gli istogrammi delle durate
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _NullSpan:
+    """Span vuoto restituito quando la strumentazione è disattivata"""
+    timed = False
+
+    def stage(self, name):
+        return _NULL_CONTEXT
+
+    def add(self, stage, seconds):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def end(self, status="ok"):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Traccia un singolo trasferimento e il tempo speso in ogni fase"""
+    timed = True
+
+    def __init__(self, metrics, op, attrs):
+        self.metrics = metrics
+        self.op = op
+        self.attrs = dict(attrs)
+        self.stages = {}
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._ended = False
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, stage, seconds):
+        """Accumula il tempo speso in una fase (usato nei loop caldi)"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self, status="ok"):
+        if self._ended:
+            return
+        self._ended = True
+        self.metrics._finish_span(self, status, time.perf_counter() - self._start)
+
+
+class Metrics:
+    """Contatori, istogrammi e span per la pipeline di trasferimento.
+
+    Quando è disattivata ogni chiamata ritorna subito, così il costo sul
+    percorso critico è quello di un controllo booleano.
+    """
+
+    def __init__(self, enabled=False, max_spans=200):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._spans = deque(maxlen=max_spans)
+        self._server = None
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        """Incrementa un contatore"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Imposta il valore corrente di un indicatore"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Registra un valore in un istogramma"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+                self._histograms[key] = hist
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def span(self, op, **attrs):
+        """Apre uno span per un trasferimento (send, receive, discover...)"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, op, attrs)
+
+    def _finish_span(self, span, status, duration):
+        self.inc("zapshare_transfers_total", op=span.op, status=status)
+        self.observe("zapshare_transfer_seconds", duration, op=span.op)
+        for stage, seconds in span.stages.items():
+            self.observe("zapshare_stage_seconds", seconds, op=span.op, stage=stage)
+        with self._lock:
+            self._spans.append({
+                "op": span.op,
+                "status": status,
+                "started_at": span.started_at,
+                "duration": duration,
+                "stages": dict(span.stages),
+                "attrs": dict(span.attrs)
+            })
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._spans.clear()
+
+    def snapshot(self):
+        """Restituisce una fotografia delle metriche come dizionario serializzabile"""
+        def fmt(key):
+            name, labels = key
+            return {"name": name, "labels": dict(labels)}
+
+        with self._lock:
+            return {
+                "counters": [dict(fmt(k), value=v) for k, v in self._counters.items()],
+                "gauges": [dict(fmt(k), value=v) for k, v in self._gauges.items()],
+                "histograms": [
+                    dict(fmt(k), buckets=dict(zip(DEFAULT_BUCKETS, h["buckets"])), sum=h["sum"], count=h["count"])
+                    for k, h in self._histograms.items()
+                ],
+                "spans": list(self._spans)
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4)
+
+    def to_prometheus(self):
+        """Esporta le metriche nel formato testuale di Prometheus"""
+        def labels_str(labels, extra=None):
+            items = list(labels) + (extra or [])
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{labels_str(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} gauge")
+                    seen.add(name)
+                lines.append(f"{name}{labels_str(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                for bound, count in zip(DEFAULT_BUCKETS, hist["buckets"]):
+                    lines.append(f"{name}_bucket{labels_str(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{labels_str(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{labels_str(labels)} {hist['sum']}")
+                lines.append(f"{name}_count{labels_str(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port=9100, host="127.0.0.1"):
+        """Espone /metrics (Prometheus) e /metrics.json su un server HTTP locale"""
+        if self._server:
+            return self._server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.to_prometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = metrics.to_json().encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.enabled = True
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        server_thread = threading.Thread(target=self._server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        print(f"Metriche disponibili su http://{host}:{port}/metrics")
+        return self._server
+
+    def stop_http_server(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# Istanza condivisa da Sender, Receiver e ZapShareApp
+metrics = Metrics(enabled=os.environ.get("ZAPSHARE_METRICS", "0") not in ("", "0"))
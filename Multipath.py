@@ -0,0 +1,84 @@
+import threading
+import ipaddress
+
+# Dimensione di base di una striscia assegnata a un percorso
+DEFAULT_STRIPE_SIZE = 1024 * 1024
+MIN_STRIPE_SIZE = 64 * 1024
+MAX_STRIPE_SIZE = 16 * 1024 * 1024
+
+
+def pair_paths(local_interfaces, remote_addresses):
+    """Abbina ogni interfaccia locale a un indirizzo remoto raggiungibile sulla stessa rete.
+
+    Restituisce una lista di (ip_locale, ip_remoto). Se il peer ha più
+    indirizzi sulla stessa rete, si preferisce usarne uno diverso per ogni
+    interfaccia.
+    """
+    remote = [a for a in remote_addresses if a and ":" not in a]
+    pairs = []
+    used = set()
+    for interface in local_interfaces:
+        network = ipaddress.IPv4Network(interface["network"])
+        candidates = [a for a in remote if ipaddress.IPv4Address(a) in network]
+        if not candidates:
+            continue
+        unused = [a for a in candidates if a not in used]
+        remote_ip = (unused or candidates)[0]
+        used.add(remote_ip)
+        pairs.append((interface["ip"], remote_ip))
+    return pairs
+
+
+class StripeScheduler:
+    """Distribuisce le strisce del file tra i percorsi in base al throughput misurato.
+
+    Ogni percorso chiede la striscia successiva quando ha finito la precedente
+    (i percorsi veloci ne prendono di più); inoltre la dimensione della
+    striscia è proporzionale alla velocità del percorso rispetto alla media,
+    così un link lento non trattiene una grossa striscia alla fine del file.
+    """
+
+    def __init__(self, total_size, paths, stripe_size=DEFAULT_STRIPE_SIZE, smoothing=0.3):
+        self.total_size = total_size
+        self.stripe_size = stripe_size
+        self.smoothing = smoothing
+        self._next_offset = 0
+        self._lock = threading.Lock()
+        self._throughput = {path: None for path in range(paths)}
+        self._bytes = {path: 0 for path in range(paths)}
+
+    def next_stripe(self, path):
+        """Restituisce (offset, lunghezza) della prossima striscia per il percorso, o None se finito"""
+        with self._lock:
+            if self._next_offset >= self.total_size:
+                return None
+            length = self._stripe_length(path)
+            offset = self._next_offset
+            length = min(length, self.total_size - offset)
+            self._next_offset += length
+            return offset, length
+
+    def record(self, path, nbytes, seconds):
+        """Aggiorna la stima di throughput del percorso (media mobile esponenziale)"""
+        if seconds <= 0:
+            return
+        rate = nbytes / seconds
+        with self._lock:
+            previous = self._throughput[path]
+            self._throughput[path] = rate if previous is None else (1 - self.smoothing) * previous + self.smoothing * rate
+            self._bytes[path] += nbytes
+
+    def stats(self):
+        """Byte inviati e throughput stimato (byte/s) per ogni percorso"""
+        with self._lock:
+            return {path: {"bytes": self._bytes[path], "throughput": self._throughput[path] or 0.0}
+                    for path in self._throughput}
+
+    def _stripe_length(self, path):
+        measured = [r for r in self._throughput.values() if r]
+        rate = self._throughput[path]
+        if not rate or not measured:
+            return self.stripe_size
+        weight = rate / (sum(measured) / len(measured))
+        return int(max(MIN_STRIPE_SIZE, min(MAX_STRIPE_SIZE, self.stripe_size * weight)))
+
@@ -0,0 +1,247 @@
+import os
+import json
+import socket
+import select
+import struct
+import hashlib
+import threading
+
+from Sparse import recv_exact
+from Archive import SMALL_FILE_LIMIT
+
+# Frame: tipo, id del flusso logico, lunghezza del contenuto
+FRAME_HEADER = struct.Struct("!BII")
+OPEN, DATA, END, WINDOW, RESULT, GOAWAY = range(1, 7)
+WINDOW_UPDATE = struct.Struct("!I")
+
+# Frame piccoli: un file urgente attende al massimo un frame del trasferimento in corso
+MUX_FRAME_SIZE = 64 * 1024
+
+# Byte che un flusso può inviare senza conferma del receiver (controllo di flusso per flusso)
+MUX_WINDOW = 1024 * 1024
+
+# Priorità: valori bassi passano prima
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+def send_frame(sock, kind, stream_id, payload=b""):
+    sock.sendall(FRAME_HEADER.pack(kind, stream_id, len(payload)) + payload)
+
+
+def encode_frame(kind, stream_id, payload=b""):
+    return FRAME_HEADER.pack(kind, stream_id, len(payload)) + payload
+
+
+def recv_frame(sock):
+    kind, stream_id, length = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    return kind, stream_id, recv_exact(sock, length) if length else b""
+
+
+def default_priority(filesize):
+    """I file piccoli sono interattivi, gli altri bulk"""
+    return PRIORITY_INTERACTIVE if filesize <= SMALL_FILE_LIMIT else PRIORITY_BULK
+
+
+class MuxTransfer:
+    """Un trasferimento logico all'interno di una sessione multiplexata"""
+
+    def __init__(self, stream_id, path, info, priority, progress_callback=None):
+        self.stream_id = stream_id
+        self.path = path
+        self.info = info
+        self.priority = priority
+        self.progress_callback = progress_callback
+        self.window = MUX_WINDOW
+        self.turn = 0  # Ordine round-robin tra i flussi con la stessa priorità
+        self.opened = False
+        self.sent = 0
+        self.result = None
+        self.done = threading.Event()
+        self._file = None
+        self._hasher = hashlib.sha256()
+
+    def ready(self):
+        """True se il flusso ha un frame da inviare adesso"""
+        return not self.opened or self.sent >= self.info["filesize"] or self.window > 0
+
+    def next_frame(self):
+        """Prossimo frame del flusso: apertura, dati (entro la finestra) o fine.
+        Restituisce (frame, finito)."""
+        if not self.opened:
+            self.opened = True
+            self._file = open(self.path, "rb")
+            return encode_frame(OPEN, self.stream_id, json.dumps(self.info).encode()), False
+
+        data = b""
+        if self.sent < self.info["filesize"]:
+            data = self._file.read(min(MUX_FRAME_SIZE, self.window, self.info["filesize"] - self.sent))
+        if not data:
+            self._file.close()
+            trailer = {"size": self.sent, "sha256": self._hasher.hexdigest()}
+            return encode_frame(END, self.stream_id, json.dumps(trailer).encode()), True
+
+        self._hasher.update(data)
+        self.sent += len(data)
+        self.window -= len(data)
+        if self.progress_callback and self.info["filesize"]:
+            self.progress_callback(int(self.sent * 100 / self.info["filesize"]))
+        return encode_frame(DATA, self.stream_id, data), False
+
+    def finish(self, result):
+        self.result = result
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """Attende l'esito dal receiver; True se il file è stato ricevuto"""
+        self.done.wait(timeout)
+        return bool(self.result and self.result.get("status") == "ok")
+
+
+class MuxSession:
+    """Molti trasferimenti su una sola connessione, a frame intercalati.
+
+    Un solo thread di I/O legge e scrive il socket (sicuro anche con TLS):
+    a ogni giro legge gli aggiornamenti di finestra e gli esiti, poi invia
+    un frame del flusso pronto con priorità più alta (a parità, a turno).
+    Un file interattivo aperto durante un trasferimento bulk attende così
+    al massimo un frame, e il bulk riprende appena il file è finito.
+    """
+
+    def __init__(self, sock, on_result=None):
+        self.sock = sock
+        self.on_result = on_result
+        self._pending = []  # Flussi con frame ancora da inviare
+        self._active = {}  # Flussi in attesa dell'esito, per id
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._turn = 0
+        self._closing = False
+        self._error = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_w.setblocking(False)
+        self._thread = threading.Thread(target=self._run, name="zapshare-mux")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send_file(self, path, remote_name=None, priority=None, progress_callback=None, replace=False):
+        """Accoda un file; restituisce il MuxTransfer da attendere con wait()"""
+        file_stat = os.stat(path)
+        info = {
+            "filename": remote_name or os.path.basename(path),
+            "filesize": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns
+        }
+        if replace:
+            info["replace"] = True
+        if priority is None:
+            priority = default_priority(file_stat.st_size)
+        with self._lock:
+            if self._closing or self._error:
+                raise ConnectionError(f"Sessione chiusa: {self._error or 'chiusura in corso'}")
+            transfer = MuxTransfer(self._next_id, path, info, priority, progress_callback)
+            self._next_id += 1
+            self._pending.append(transfer)
+            self._active[transfer.stream_id] = transfer
+        self._wake()
+        return transfer
+
+    def close(self, timeout=None):
+        """Attende i trasferimenti accodati e chiude la sessione"""
+        with self._lock:
+            self._closing = True
+        self._wake()
+        self._thread.join(timeout)
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        self.sock.close()
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b"x")
+        except OSError:
+            pass
+
+    def _next_frame(self):
+        with self._lock:
+            ready = [t for t in self._pending if t.ready()]
+            if not ready:
+                return None
+            transfer = min(ready, key=lambda t: (t.priority, t.turn))
+            self._turn += 1
+            transfer.turn = self._turn
+        try:
+            frame, finished = transfer.next_frame()
+        except OSError as e:
+            # File non leggibile: fallisce solo questo flusso (il receiver lo scarta alla chiusura)
+            with self._lock:
+                self._pending.remove(transfer)
+                self._active.pop(transfer.stream_id, None)
+            transfer.finish({"status": "failed", "error": str(e)})
+            if self.on_result:
+                self.on_result(transfer)
+            return b""
+        if finished:
+            with self._lock:
+                self._pending.remove(transfer)
+        return frame
+
+    def _readable(self, timeout):
+        pending = getattr(self.sock, "pending", None)
+        if pending and pending():
+            return [self.sock]
+        readable, _, _ = select.select([self.sock, self._wakeup_r], [], [], timeout)
+        if self._wakeup_r in readable:
+            self._wakeup_r.recv(4096)
+        return readable
+
+    def _handle(self, kind, stream_id, payload):
+        with self._lock:
+            transfer = self._active.get(stream_id)
+        if transfer is None:
+            return
+        if kind == WINDOW:
+            (increment,) = WINDOW_UPDATE.unpack(payload)
+            transfer.window += increment
+        elif kind == RESULT:
+            with self._lock:
+                self._active.pop(stream_id, None)
+                if transfer in self._pending:
+                    # Il receiver ha rifiutato il flusso: non si invia altro
+                    self._pending.remove(transfer)
+            transfer.finish(json.loads(payload.decode()))
+            if self.on_result:
+                self.on_result(transfer)
+
+    def _run(self):
+        try:
+            while True:
+                while self.sock in self._readable(0):
+                    self._handle(*recv_frame(self.sock))
+
+                frame = self._next_frame()
+                if frame is not None:
+                    if frame:
+                        self.sock.sendall(frame)
+                    continue
+
+                with self._lock:
+                    finished = self._closing and not self._active
+                if finished:
+                    send_frame(self.sock, GOAWAY, 0)
+                    return
+                # Niente da inviare: attende finestre, esiti o nuovi file
+                if self.sock in self._readable(1.0):
+                    self._handle(*recv_frame(self.sock))
+        except Exception as e:
+            self._error = str(e)
+            with self._lock:
+                transfers = list(self._active.values())
+                self._active.clear()
+                self._pending.clear()
+            for transfer in transfers:
+                transfer.finish({"status": "failed", "error": str(e)})
+                if self.on_result:
+                    self.on_result(transfer)
@@ -0,0 +1,344 @@
+import time
+import heapq
+import random
+import selectors
+import socket
+import threading
+from collections import deque
+
+# Emulazione di collegamenti lenti o disturbati sul loopback, solo per test e benchmark.
+# Profilo: latenza e jitter di sola andata (secondi), banda (byte/s, None = illimitata),
+# probabilità di perdita e di riordino, coda massima davanti al collegamento (secondi di dati).
+DEFAULT_PROFILE = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "bandwidth": None,
+    "loss": 0.0,
+    "reorder": 0.0,
+    "queue": 0.1
+}
+
+PRESETS = {
+    "lan": {"latency": 0.0005},
+    "wifi": {"latency": 0.003, "jitter": 0.002, "bandwidth": 12.5e6, "loss": 0.005, "reorder": 0.005},
+    "bad_wifi": {"latency": 0.01, "jitter": 0.008, "bandwidth": 2.5e6, "loss": 0.03, "reorder": 0.02},
+    "wan": {"latency": 0.04, "jitter": 0.005, "bandwidth": 6.25e6, "loss": 0.001},
+    "lossy_wan": {"latency": 0.04, "jitter": 0.01, "bandwidth": 6.25e6, "loss": 0.02, "reorder": 0.01}
+}
+
+# Una perdita su TCP non si vede nel flusso: ritarda il segmento (e quelli dopo) di un RTO
+MIN_RTO = 0.2
+TCP_SEGMENT_SIZE = 16 * 1024
+MAX_INFLIGHT = 8 * 1024 * 1024  # Byte in transito per direzione di una connessione TCP
+# Una sessione UDP senza traffico per questo tempo viene chiusa (come la voce di un NAT)
+UDP_SESSION_IDLE = 5.0
+
+
+def make_profile(profile):
+    """Profilo completo da un nome di PRESETS o da un dizionario parziale"""
+    if isinstance(profile, str):
+        if profile not in PRESETS:
+            raise ValueError(f"Profilo di rete sconosciuto: {profile}")
+        profile = PRESETS[profile]
+    return dict(DEFAULT_PROFILE, **(profile or {}))
+
+
+class LinkShaper:
+    """Una direzione del collegamento: decide quando (e se) consegnare ogni pacchetto.
+
+    La banda è condivisa da tutto ciò che attraversa la direzione: ogni
+    pacchetto occupa il collegamento per size/bandwidth e attende in coda
+    dietro i precedenti. Con reliable=True (TCP) le perdite diventano un
+    ritardo di ritrasmissione e il riordino non si applica.
+    """
+
+    def __init__(self, profile, seed=None):
+        self.profile = make_profile(profile)
+        self.random = random.Random(seed)
+        self.stats = {"packets": 0, "bytes": 0, "dropped": 0, "reordered": 0, "retransmitted": 0}
+        self._free = 0.0  # Istante in cui il collegamento finisce di trasmettere la coda
+        self._lock = threading.Lock()
+
+    def backlog(self, now=None):
+        """Secondi di dati in coda davanti al collegamento"""
+        return max(0.0, self._free - (time.monotonic() if now is None else now))
+
+    def schedule(self, size, reliable=False, now=None):
+        """Istante di consegna del pacchetto, o None se va perso"""
+        p = self.profile
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.stats["packets"] += 1
+            if not reliable and p["bandwidth"] and self.backlog(now) > p["queue"]:
+                # Coda piena: i datagrammi in eccesso vengono scartati
+                self.stats["dropped"] += 1
+                return None
+            departure = now
+            if p["bandwidth"]:
+                departure = max(now, self._free) + size / p["bandwidth"]
+                self._free = departure
+            delay = max(0.0, p["latency"] + self.random.uniform(-p["jitter"], p["jitter"]))
+            if self.random.random() < p["loss"]:
+                if not reliable:
+                    self.stats["dropped"] += 1
+                    return None
+                self.stats["retransmitted"] += 1
+                delay += max(MIN_RTO, 4 * p["latency"])
+            elif not reliable and self.random.random() < p["reorder"]:
+                # Trattenuto abbastanza da essere superato dai pacchetti successivi
+                self.stats["reordered"] += 1
+                delay += p["latency"] + p["jitter"] + 0.002
+            self.stats["bytes"] += size
+            return departure + delay
+
+
+def _merge_stats(*shapers):
+    stats = {}
+    for shaper in shapers:
+        for key, value in shaper.stats.items():
+            stats[key] = stats.get(key, 0) + value
+    return stats
+
+
+def _sleep_until(deadline):
+    delay = deadline - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+class _TcpPipe:
+    """Una direzione di una connessione: un thread legge, un thread consegna in ordine"""
+
+    def __init__(self, connection, src, dst, shaper):
+        self.connection = connection
+        self.src = src
+        self.dst = dst
+        self.shaper = shaper
+        self._queue = deque()
+        self._queued = 0
+        self._last = 0.0
+        self._cond = threading.Condition()
+        for target in (self._read, self._write):
+            threading.Thread(target=target, name="zapshare-netemu", daemon=True).start()
+
+    def _read(self):
+        try:
+            while True:
+                data = self.src.recv(TCP_SEGMENT_SIZE)
+                # Controllo di flusso: non si legge oltre la coda del collegamento
+                limit = self.shaper.profile["queue"]
+                excess = self.shaper.backlog() - limit
+                while excess > 0:
+                    time.sleep(min(0.01, excess))
+                    excess = self.shaper.backlog() - limit
+                with self._cond:
+                    while self._queued > MAX_INFLIGHT:
+                        self._cond.wait()
+                    if not data:
+                        self._queue.append((self._last, b""))
+                        self._cond.notify_all()
+                        return
+                    # Un flusso TCP resta ordinato: il jitter non fa superare i segmenti precedenti
+                    self._last = max(self.shaper.schedule(len(data), reliable=True), self._last)
+                    self._queue.append((self._last, data))
+                    self._queued += len(data)
+                    self._cond.notify_all()
+        except OSError:
+            self.connection.close()
+
+    def _write(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue:
+                        self._cond.wait()
+                    deliver, data = self._queue.popleft()
+                _sleep_until(deliver)
+                if not data:
+                    self.dst.shutdown(socket.SHUT_WR)
+                    break
+                self.dst.sendall(data)
+                with self._cond:
+                    self._queued -= len(data)
+                    self._cond.notify_all()
+        except OSError:
+            self.connection.close()
+            return
+        self.connection.half_closed()
+
+
+class _TcpConnection:
+    def __init__(self, proxy, client, upstream):
+        self.proxy = proxy
+        self.sockets = (client, upstream)
+        self._open_directions = 2
+        self._lock = threading.Lock()
+        _TcpPipe(self, client, upstream, proxy.up)
+        _TcpPipe(self, upstream, client, proxy.down)
+
+    def half_closed(self):
+        with self._lock:
+            self._open_directions -= 1
+            finished = self._open_directions == 0
+        if finished:
+            self.close()
+
+    def close(self):
+        for sock in self.sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self.proxy._forget(self)
+
+
+class TcpProxy:
+    """Proxy TCP sul loopback che applica un profilo di rete alle due direzioni.
+
+    Il Sender si collega a proxy.port invece che alla porta del Receiver;
+    TLS e tutti i protocolli di ZapShare passano invariati.
+    """
+
+    def __init__(self, target_port, profile, target_host="127.0.0.1", seed=None):
+        self.target = (target_host, target_port)
+        self.up = LinkShaper(profile, seed)
+        self.down = LinkShaper(profile, None if seed is None else seed + 1)
+        self.connections = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._running = True
+        self._listener = socket.create_server(("127.0.0.1", 0), backlog=64)
+        self._listener.settimeout(0.2)
+        self.port = self._listener.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, name="zapshare-netemu", daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self):
+        return _merge_stats(self.up, self.down)
+
+    def _accept(self):
+        while self._running:
+            try:
+                client, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                upstream = socket.create_connection(self.target, timeout=10)
+                upstream.settimeout(None)
+            except OSError:
+                client.close()
+                continue
+            client.settimeout(None)
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self.connections += 1
+                self._active.add(_TcpConnection(self, client, upstream))
+
+    def _forget(self, connection):
+        with self._lock:
+            self._active.discard(connection)
+
+    def close(self):
+        self._running = False
+        self._thread.join(1.0)
+        self._listener.close()
+        with self._lock:
+            active = list(self._active)
+        for connection in active:
+            connection.close()
+
+
+class UdpProxy:
+    """Proxy UDP sul loopback con perdita, riordino, jitter e banda limitata.
+
+    Ogni indirizzo del client ha il proprio socket verso la destinazione
+    (come un NAT), così le risposte tornano al client giusto.
+    """
+
+    def __init__(self, target_port, profile, target_host="127.0.0.1", seed=None):
+        self.target = (target_host, target_port)
+        self.up = LinkShaper(profile, seed)
+        self.down = LinkShaper(profile, None if seed is None else seed + 1)
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.front.bind(("127.0.0.1", 0))
+        self.port = self.front.getsockname()[1]
+        self._sessions = {}  # indirizzo del client -> socket verso la destinazione
+        self._clients = {}  # socket verso la destinazione -> indirizzo del client
+        self._last_seen = {}  # socket verso la destinazione -> ultimo pacchetto in una delle due direzioni
+        # selectors e non select(): le sessioni possono superare FD_SETSIZE descrittori
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.front, selectors.EVENT_READ)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="zapshare-netemu", daemon=True)
+        self._thread.start()
+
+    @property
+    def stats(self):
+        return _merge_stats(self.up, self.down)
+
+    def _session(self, client):
+        sock = self._sessions.get(client)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.bind(("127.0.0.1", 0))
+            self._sessions[client] = sock
+            self._clients[sock] = client
+            self._selector.register(sock, selectors.EVENT_READ)
+        return sock
+
+    def _expire_sessions(self, now):
+        for sock, last_seen in list(self._last_seen.items()):
+            if now - last_seen > UDP_SESSION_IDLE:
+                self._selector.unregister(sock)
+                del self._sessions[self._clients.pop(sock)]
+                del self._last_seen[sock]
+                sock.close()
+
+    def _run(self):
+        self.front.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        pending = []  # (istante di consegna, ordine, dati, socket, destinazione)
+        order = 0
+        next_expiry = time.monotonic() + UDP_SESSION_IDLE
+        while self._running:
+            timeout = min(0.1, max(0.0, pending[0][0] - time.monotonic())) if pending else 0.1
+            for key, _ in self._selector.select(timeout):
+                sock = key.fileobj
+                try:
+                    data, address = sock.recvfrom(65535)
+                except OSError:
+                    continue
+                if sock is self.front:
+                    out, destination, shaper = self._session(address), self.target, self.up
+                    self._last_seen[out] = time.monotonic()
+                else:
+                    out, destination, shaper = self.front, self._clients[sock], self.down
+                    self._last_seen[sock] = time.monotonic()
+                deliver = shaper.schedule(len(data))
+                if deliver is None:
+                    continue
+                order += 1
+                heapq.heappush(pending, (deliver, order, data, out, destination))
+            now = time.monotonic()
+            while pending and pending[0][0] <= now:
+                _, _, data, out, destination = heapq.heappop(pending)
+                try:
+                    out.sendto(data, destination)
+                except OSError:
+                    pass
+            if now >= next_expiry:
+                # Un pacchetto resta in coda molto meno di UDP_SESSION_IDLE: le sessioni scadute non hanno consegne
+                self._expire_sessions(now)
+                next_expiry = now + 1.0
+
+    def close(self):
+        self._running = False
+        self._thread.join(1.0)
+        self._selector.close()
+        self.front.close()
+        for sock in self._clients:
+            sock.close()
@@ -0,0 +1,285 @@
+import os
+import sys
+import time
+import socket
+import struct
+import ipaddress
+import threading
+
+# ioctl di Linux per leggere indirizzo, netmask e flag di un'interfaccia
+SIOCGIFFLAGS = 0x8913
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+IFF_UP = 0x1
+IFF_LOOPBACK = 0x8
+
+# Gruppi netlink per le notifiche di cambio link/indirizzo
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+# Gruppo multicast IPv6 link-local usato per la discovery
+DISCOVERY_GROUP6 = "ff02::5a50"
+
+
+def make_interface(name, ip, netmask):
+    """Costruisce la descrizione di un'interfaccia calcolando rete e broadcast per qualsiasi prefisso"""
+    network = ipaddress.IPv4Network(f"{ip}/{netmask}", strict=False)
+    return {
+        "name": name,
+        "ip": ip,
+        "netmask": str(network.netmask),
+        "prefixlen": network.prefixlen,
+        "network": str(network),
+        "broadcast": str(network.broadcast_address)
+    }
+
+
+def normalize_ip(ip):
+    """Converte gli indirizzi IPv4-mapped (::ffff:a.b.c.d) dei socket dual-stack in IPv4"""
+    if ip.startswith("::ffff:") and "." in ip:
+        return ip[len("::ffff:"):]
+    return ip
+
+
+def _is_usable(ip):
+    addr = ipaddress.IPv4Address(ip)
+    return not (addr.is_loopback or addr.is_link_local or addr.is_unspecified)
+
+
+class InterfaceInventory:
+    """Elenco delle interfacce di rete locali, calcolato una sola volta e messo in cache.
+
+    Su Linux la cache viene invalidata dagli eventi netlink (link o indirizzo
+    cambiati); sugli altri sistemi scade dopo `ttl` secondi.
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._interfaces = None
+        self._interfaces6 = None
+        self._loaded_at = 0.0
+        self._watcher = None
+        self._listeners = []
+
+    def interfaces(self):
+        """Interfacce IPv4 utilizzabili (niente loopback e link-local)"""
+        with self._lock:
+            if self._interfaces is None or (self._watcher is None and time.monotonic() - self._loaded_at > self.ttl):
+                self._interfaces = self._enumerate()
+                self._loaded_at = time.monotonic()
+                self._start_watcher()
+            return [dict(i) for i in self._interfaces]
+
+    def invalidate(self):
+        """Forza una nuova enumerazione alla prossima richiesta"""
+        with self._lock:
+            self._interfaces = None
+            self._interfaces6 = None
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Errore nella callback delle interfacce: {e}")
+
+    def subscribe(self, callback):
+        """Registra una callback chiamata quando le interfacce cambiano"""
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def primary_ip(self):
+        """Indirizzo usato per raggiungere la LAN (quello della rotta di default)"""
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Non ha bisogno di essere raggiungibile
+            s.connect(('10.255.255.255', 1))
+            ip = s.getsockname()[0]
+            if _is_usable(ip):
+                return ip
+        except Exception:
+            pass
+        finally:
+            s.close()
+
+        interfaces = self.interfaces()
+        if interfaces:
+            return interfaces[0]["ip"]
+        try:
+            return socket.gethostbyname(socket.gethostname())
+        except Exception:
+            return "127.0.0.1"
+
+    def ipv6_addresses(self):
+        """Indirizzi IPv6 delle interfacce attive: dizionari con name, ip, prefixlen, index, link_local"""
+        with self._lock:
+            if self._interfaces6 is None or (self._watcher is None and time.monotonic() - self._loaded_at > self.ttl):
+                self._interfaces6 = self._enumerate6()
+            return [dict(i) for i in self._interfaces6]
+
+    def multicast_indexes(self):
+        """Indici delle interfacce su cui inviare/ricevere il multicast IPv6"""
+        return sorted({i["index"] for i in self.ipv6_addresses() if i["index"]})
+
+    def is_local_network(self, ip):
+        """True se l'indirizzo appartiene a una delle reti locali (o al loopback)"""
+        try:
+            addr = ipaddress.ip_address(ip.split("%", 1)[0])
+        except ValueError:
+            return False
+        if addr.is_loopback:
+            return True
+        if isinstance(addr, ipaddress.IPv6Address):
+            if addr.ipv4_mapped is None:
+                return addr.is_link_local or addr.is_private
+            addr = addr.ipv4_mapped
+        return any(addr in ipaddress.IPv4Network(i["network"]) for i in self.interfaces())
+
+    def _enumerate(self):
+        for method in (self._from_psutil, self._from_netifaces, self._from_linux_ioctl, self._from_hostname):
+            try:
+                interfaces = method()
+            except Exception:
+                interfaces = None
+            if interfaces:
+                return interfaces
+        return []
+
+    def _from_psutil(self):
+        import psutil
+
+        interfaces = []
+        stats = psutil.net_if_stats()
+        for name, addrs in psutil.net_if_addrs().items():
+            if name in stats and not stats[name].isup:
+                continue
+            for addr in addrs:
+                if addr.family == socket.AF_INET and addr.netmask and _is_usable(addr.address):
+                    interfaces.append(make_interface(name, addr.address, addr.netmask))
+        return interfaces
+
+    def _from_netifaces(self):
+        import netifaces
+
+        interfaces = []
+        for name in netifaces.interfaces():
+            for addr in netifaces.ifaddresses(name).get(netifaces.AF_INET, []):
+                if addr.get("addr") and addr.get("netmask") and _is_usable(addr["addr"]):
+                    interfaces.append(make_interface(name, addr["addr"], addr["netmask"]))
+        return interfaces
+
+    def _from_linux_ioctl(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        import fcntl
+
+        interfaces = []
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for name in sorted(os.listdir("/sys/class/net")):
+                request = struct.pack("256s", name[:15].encode())
+                try:
+                    flags = struct.unpack("H", fcntl.ioctl(s.fileno(), SIOCGIFFLAGS, request)[16:18])[0]
+                    if not flags & IFF_UP or flags & IFF_LOOPBACK:
+                        continue
+                    ip = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24])
+                    netmask = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFNETMASK, request)[20:24])
+                except OSError:
+                    # Interfaccia senza indirizzo IPv4
+                    continue
+                if _is_usable(ip):
+                    interfaces.append(make_interface(name, ip, netmask))
+        finally:
+            s.close()
+        return interfaces
+
+    def _from_hostname(self):
+        # Ultima risorsa: nessuna informazione sulla netmask, si assume /24
+        interfaces = []
+        for ip in socket.gethostbyname_ex(socket.gethostname())[2]:
+            if _is_usable(ip):
+                interfaces.append(make_interface(f"interface-{len(interfaces)+1}", ip, "255.255.255.0"))
+        return interfaces
+
+    def _enumerate6(self):
+        if not socket.has_ipv6:
+            return []
+        indexes = {}
+        try:
+            indexes = {name: index for index, name in socket.if_nameindex()}
+        except (OSError, AttributeError):
+            pass
+
+        addresses = []
+        try:
+            import psutil
+
+            stats = psutil.net_if_stats()
+            for name, addrs in psutil.net_if_addrs().items():
+                if name in stats and not stats[name].isup:
+                    continue
+                for addr in addrs:
+                    if addr.family == socket.AF_INET6:
+                        ip = ipaddress.IPv6Address(addr.address.split("%", 1)[0])
+                        prefixlen = ipaddress.IPv6Network(f"::/{addr.netmask}").prefixlen if addr.netmask else 64
+                        addresses.append((name, ip, prefixlen))
+        except Exception:
+            addresses = []
+            # Linux: /proc/net/if_inet6 (indirizzo, indice, prefisso, scope, flag, nome)
+            if os.path.exists("/proc/net/if_inet6"):
+                with open("/proc/net/if_inet6") as f:
+                    for line in f:
+                        fields = line.split()
+                        if len(fields) < 6:
+                            continue
+                        ip = ipaddress.IPv6Address(bytes.fromhex(fields[0]))
+                        addresses.append((fields[5], ip, int(fields[2], 16)))
+
+        result = []
+        for name, ip, prefixlen in addresses:
+            if ip.is_loopback or ip.is_unspecified:
+                continue
+            result.append({
+                "name": name,
+                "ip": str(ip),
+                "prefixlen": prefixlen,
+                "index": indexes.get(name, 0),
+                "link_local": ip.is_link_local
+            })
+        return result
+
+    def _start_watcher(self):
+        """Su Linux ascolta gli eventi netlink per invalidare la cache"""
+        if self._watcher is not None or not hasattr(socket, "AF_NETLINK"):
+            return
+        try:
+            nl_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            nl_socket.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        except OSError:
+            return
+
+        def watch():
+            try:
+                while True:
+                    if not nl_socket.recv(65536):
+                        break
+                    self.invalidate()
+            except OSError:
+                pass
+            finally:
+                nl_socket.close()
+
+        self._watcher = threading.Thread(target=watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+
+# Istanza condivisa da Sender e Receiver
+inventory = InterfaceInventory()
@@ -0,0 +1,234 @@
+import os
+import zlib
+import struct
+import atexit
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from Sparse import recv_exact
+
+# Dimensione dei blocchi elaborati in parallelo
+PIPELINE_CHUNK_SIZE = 1024 * 1024
+
+# Intestazione di un blocco compresso sul socket: lunghezza dei dati che seguono
+FRAME = struct.Struct("!I")
+
+# Limite di un blocco compresso ricevuto, prima e dopo la decompressione
+# (il sender comprime blocchi di PIPELINE_CHUNK_SIZE: ne resta un ampio margine)
+MAX_FRAME_SIZE = 4 * PIPELINE_CHUNK_SIZE
+
+
+def recv_compressed_frame(sock, limit):
+    """Riceve e decomprime un blocco; restituisce (byte sul socket, dati).
+
+    Il blocco viene rifiutato se supera MAX_FRAME_SIZE o se decompresso
+    produrrebbe più di `limit` byte: un blocco ostile non può allocare
+    più memoria di così (zip bomb).
+    """
+    (frame_size,) = FRAME.unpack(recv_exact(sock, FRAME.size))
+    if frame_size > MAX_FRAME_SIZE:
+        raise IOError(f"Blocco compresso troppo grande: {frame_size} byte")
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(recv_exact(sock, frame_size), min(limit, MAX_FRAME_SIZE))
+    if decompressor.unconsumed_tail or not decompressor.eof or not data:
+        raise IOError("Blocco compresso non valido")
+    return frame_size, data
+
+
+def compress_zlib(data):
+    # Livello 1: il più veloce, adatto alla LAN (zlib rilascia il GIL)
+    return zlib.compress(data, 1)
+
+
+# Stadi disponibili: nome -> funzione(bytes) -> bytes.
+# Si usano i nomi perché i processi del pool devono poterli ritrovare.
+STAGES = {
+    "zlib": compress_zlib
+}
+
+
+def register_stage(name, function):
+    """Registra uno stadio (la funzione deve essere definita a livello di modulo)"""
+    STAGES[name] = function
+
+
+def run_stages(stage_names, data):
+    for name in stage_names:
+        data = STAGES[name](data)
+    return data
+
+
+# Segmenti di memoria condivisa già aperti dal processo di lavoro
+_attached = {}
+
+
+def _attach(name):
+    shm = _attached.get(name)
+    if shm is None:
+        if len(_attached) >= 64:
+            for old in list(_attached.values()):
+                old.close()
+            _attached.clear()
+        # Il resource tracker è condiviso con il processo principale, che elimina il segmento
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+    return shm
+
+
+def _run_in_slot(stage_names, input_name, length, output_name):
+    """Eseguito nel processo di lavoro: legge il blocco e scrive il risultato in memoria condivisa"""
+    source = _attach(input_name)
+    with source.buf[:length] as view:
+        result = bytes(run_stages(stage_names, view))
+    target = _attach(output_name)
+    if len(result) > target.size:
+        return result
+    target.buf[:len(result)] = result
+    return len(result)
+
+
+class _Slot:
+    """Coppia di buffer condivisi (ingresso/uscita) per un blocco in elaborazione"""
+
+    def __init__(self, chunk_size):
+        self.input = shared_memory.SharedMemory(create=True, size=chunk_size)
+        # Spazio extra per gli stadi che possono espandere i dati (es. dati incomprimibili)
+        self.output = shared_memory.SharedMemory(create=True, size=chunk_size + chunk_size // 8 + 1024)
+
+    def close(self):
+        for shm in (self.input, self.output):
+            shm.close()
+            shm.unlink()
+
+
+class PipelineExecutor:
+    """Esegue gli stadi CPU (compressione, hash, cifratura) su più core.
+
+    mode="thread" usa un pool di thread: adatto agli stadi che rilasciano il
+    GIL (zlib, hashlib). mode="process" usa un pool di processi; i blocchi
+    passano in memoria condivisa, senza copie dovute al pickling. In entrambi
+    i casi map() restituisce i risultati nell'ordine dei blocchi, pronti per
+    la scrittura sul socket.
+    """
+
+    def __init__(self, stages, workers=None, mode="thread", chunk_size=PIPELINE_CHUNK_SIZE):
+        unknown = [name for name in stages if name not in STAGES]
+        if unknown:
+            raise ValueError(f"Stadi sconosciuti: {', '.join(unknown)}")
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Modalità non valida: {mode}")
+        self.stages = tuple(stages)
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.window = self.workers * 2
+        self._lock = threading.Lock()
+        self._slot_sets = []
+        self._closed = False
+        if mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="zapshare-pipeline")
+
+    def map(self, chunks):
+        """Elabora i blocchi in parallelo (al massimo `window` in volo) e li restituisce in ordine"""
+        if self.mode == "process":
+            yield from self._map_process(chunks)
+            return
+
+        pending = deque()
+        try:
+            for chunk in chunks:
+                if len(pending) >= self.window:
+                    yield pending.popleft().result()
+                pending.append(self._pool.submit(run_stages, self.stages, chunk))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _map_process(self, chunks):
+        slots = self._take_slots()
+        free = deque(slots)
+        pending = deque()
+        try:
+            for chunk in chunks:
+                if len(chunk) > self.chunk_size:
+                    raise ValueError("Blocco più grande della dimensione configurata")
+                if not free:
+                    yield self._collect(pending.popleft(), free)
+                slot = free.popleft()
+                slot.input.buf[:len(chunk)] = chunk
+                future = self._pool.submit(_run_in_slot, self.stages, slot.input.name, len(chunk), slot.output.name)
+                pending.append((future, slot))
+            while pending:
+                yield self._collect(pending.popleft(), free)
+        finally:
+            # I buffer si riusano solo quando nessun processo li sta ancora usando
+            for future, _ in pending:
+                future.cancel()
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            self._return_slots(slots)
+
+    def _collect(self, item, free):
+        future, slot = item
+        result = future.result()
+        free.append(slot)
+        if isinstance(result, int):
+            return bytes(slot.output.buf[:result])
+        return result
+
+    def _take_slots(self):
+        # Ogni chiamata a map() usa un proprio gruppo di buffer: più invii in
+        # parallelo non si contendono gli stessi slot
+        with self._lock:
+            if self._slot_sets:
+                return self._slot_sets.pop()
+        return [_Slot(self.chunk_size) for _ in range(self.window)]
+
+    def _return_slots(self, slots):
+        with self._lock:
+            if not self._closed:
+                self._slot_sets.append(slots)
+                return
+        for slot in slots:
+            slot.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            slot_sets, self._slot_sets = self._slot_sets, []
+        self._pool.shutdown(wait=True)
+        for slots in slot_sets:
+            for slot in slots:
+                slot.close()
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_pipeline(stages, workers=None, mode="thread"):
+    """Restituisce un esecutore condiviso dal processo per la combinazione di stadi indicata"""
+    key = (tuple(stages), workers, mode)
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            executor = PipelineExecutor(stages, workers, mode)
+            _executors[key] = executor
+        return executor
+
+
+@atexit.register
+def _shutdown_pipelines():
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.close()
@@ -3,93 +3,171 @@ import json
 import os
 import threading
 import sys
+import time
+import selectors
+import contextlib
+import struct
+import hashlib
+import ssl
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import messagebox
 
+from Metrics import metrics
+from ConfigService import get_config_service
+from Archive import safe_join, iter_unpack, write_entry
+from Sparse import EXTENT, recv_exact
+from HashCache import get_hash_cache, file_digest
+from Sync import ManifestStore, build_manifest, send_json, recv_json
+from NetInterfaces import inventory, normalize_ip, DISCOVERY_GROUP6
+from BlobStore import BlobStore
+from Finalize import Finalizer
+from HttpGateway import HttpGateway
+from ZeroCopy import SPLICE_AVAILABLE, SplicePipe, splice_to_file
+from Stream import STREAM_CHUNK_SIZE, iter_received_chunks
+from Discovery import DISCOVERY_REQUEST, DISCOVERY_REQUEST_COMPACT, RateLimiter, encode_response
+from Pipeline import recv_compressed_frame
+from Security import ensure_identity, server_context, is_tls_hello, fingerprint, TLSConnector
+from Connection import connect_fastest, device_addresses
+from Relay import RelayFanout, RELAY_PROGRESS_INTERVAL, RELAY_TIMEOUT, node_message
+from Mux import OPEN, DATA, END, WINDOW, RESULT, GOAWAY, WINDOW_UPDATE, MUX_WINDOW, send_frame, recv_frame
+from UdpBulk import UdpReceiver, UDP_PAYLOAD_SIZE, open_udp_socket
+from Swarm import (SwarmSession, SWARM_ANNOUNCE, SWARM_ANNOUNCE_INTERVAL, SWARM_STALL, SWARM_TIMEOUT,
+                   END_OF_PIECES, recv_piece, serve_pieces, download_from_peer, decode_announce)
+
 class Receiver:
-    def __init__(self):
+    def __init__(self, config_service=None):
         self.host = socket.gethostname()
         
-        # Ottieni specificamente un indirizzo IP sulla rete 192.168.1.x
+        # Indirizzo IP sulla LAN
         self.ip = self.get_lan_ip()
         
         self.port = 9999
         self.buffer_size = 4096
         self.config_file = "zapshare_config.json" 
         self.devices_file = "zapshare_devices.json"
-        self.config = self.load_config()
+        self.manifest_store = ManifestStore("zapshare_manifest.json")
+        self.config_service = config_service or self.load_config()
+        self.buffer_size = self.config.get("buffer_size", self.buffer_size)
+        self.blob_store = self.open_blob_store(self.config.get("blob_store_directory"))
+        self.finalizer = self.make_finalizer()
+        self.tls_context, self.fingerprint = self.load_identity()
+        self.relay_tls = TLSConnector()  # Connessioni cifrate verso i nodi successivi di una catena
+        self.discovery_port = 9998
+        self.writer_threads = 4  # Thread di scrittura per gli archivi di file piccoli
+        self.max_pending_writes = 256
+        self.dual_stack = False  # True se il socket TCP accetta anche connessioni IPv6
+        self.zero_copy_receive = self.config.get("zero_copy_receive", True)  # splice() socket -> file su Linux
+        
+        # Ruoli (per il receiver multi-processo: i worker ricevono, il supervisore fa la discovery)
+        self.serve_transfers = True
+        self.serve_discovery = True
+        self.serve_http = True  # Gateway HTTP, se configurato (http_port)
+        self.reuse_port = False  # SO_REUSEPORT: più processi in ascolto sulla stessa porta
         self.running = False
         self.transfer_callbacks = []
+        self.sink_factory = None  # Destinazione alternativa alla cartella di ricezione
+        
+        # Stato del ciclo di vita (socket in ascolto, thread e trasferimenti attivi)
+        self.drain_timeout = 5.0
+        self._server_socket = None
+        self._discovery_socket = None
+        self._wakeup_r = None
+        self._wakeup_w = None
+        self._accept_thread = None
+        self._discovery_thread = None
+        self.http_gateway = None
+        self._active = {}
+        self._active_lock = threading.Lock()
+        self._multipath = {}  # Trasferimenti multipath in corso, per transfer_id (condivisibile tra processi)
+        self._multipath_lock = threading.Lock()
+        self._swarms = {}  # Sessioni swarm attive, per swarm_id
+        
+        # Discovery: risposte già codificate e limite di richieste per sorgente
+        self.discovery_limiter = RateLimiter()
+        self.discovery_stats = {"requests": 0, "responses": 0, "rate_limited": 0, "not_local": 0, "invalid": 0}
+        self._discovery_responses = {}
         
         print(f"Inizializzato Receiver con indirizzo IP: {self.ip}")
     
     def get_lan_ip(self):
-        """Ottiene specificamente un indirizzo IP sulla rete 192.168.1.x"""
-        # Prova a trovare l'indirizzo specifico per la rete 192.168.1.x
-        try:
-            # Metodo 1: socket temporaneo
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            try:
-                # Non ha bisogno di essere raggiungibile
-                s.connect(('10.255.255.255', 1))
-                ip = s.getsockname()[0]
-                # Controlla se l'IP è nella rete 192.168.1.x
-                if ip.startswith('192.168.1.'):
-                    return ip
-            except Exception:
-                pass
-            finally:
-                s.close()
-            
-            # Metodo 2: ottieni tutti gli IP
-            hostname = socket.gethostname()
-            ip_list = socket.gethostbyname_ex(hostname)[2]
-            
-            # Filtra per trovare un indirizzo 192.168.1.x
-            for ip in ip_list:
-                if ip.startswith('192.168.1.'):
-                    return ip
-            
-            # Se non troviamo un IP specifico 192.168.1.x, proviamo a prendere qualsiasi IP nella classe 192.168
-            for ip in ip_list:
-                if ip.startswith('192.168.'):
-                    print(f"Attenzione: non trovato IP nella rete 192.168.1.x, utilizzo {ip}")
-                    return ip
-            
-            # Ultima risorsa: usa qualsiasi IP non locale
-            for ip in ip_list:
-                if not ip.startswith('127.') and not ip.startswith('169.254.'):
-                    print(f"Attenzione: utilizzo IP alternativo: {ip}")
-                    return ip
-            
-            # Se tutto fallisce, usa l'IP generico
-            return socket.gethostbyname(hostname)
-            
-        except Exception as e:
-            print(f"Errore nell'ottenere l'IP LAN: {e}")
-            # Fallback: IP generico
-            return socket.gethostbyname(socket.gethostname())
+        """Ottiene l'indirizzo IP usato per raggiungere la LAN"""
+        return inventory.primary_ip()
+    
+    @property
+    def config(self):
+        """Configurazione condivisa (sempre aggiornata)"""
+        return self.config_service.data
     
     def load_config(self):
-        # Caricamento configurazione
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                return json.load(f)
-        else:
-            # Configurazione di default
-            default_config = {
-                "receive_directory": str(Path.home() / "Downloads"),
-                "start_with_windows": False,
-                "computer_name": socket.gethostname()
-            }
-            with open(self.config_file, 'w') as f:
-                json.dump(default_config, f, indent=4)
-            return default_config
+        # Caricamento configurazione tramite il servizio condiviso
+        default_config = {
+            "receive_directory": str(Path.home() / "Downloads"),
+            "start_with_windows": False,
+            "computer_name": socket.gethostname()
+        }
+        return get_config_service(self.config_file, default_config)
     
     def save_config(self):
-        with open(self.config_file, 'w') as f:
-            json.dump(self.config, f, indent=4)
+        self.config_service.save()
+    
+    def on_config_changed(self, changes):
+        """Applica a caldo le impostazioni modificate, senza riavviare i socket"""
+        if "computer_name" in changes and self.serve_discovery:
+            print(f"Nome computer aggiornato: {changes['computer_name']}")
+            self.register_device()
+            self.invalidate_discovery_response()
+        
+        if "receive_directory" in changes:
+            print(f"Cartella di ricezione aggiornata: {changes['receive_directory']}")
+        
+        if "buffer_size" in changes:
+            self.buffer_size = int(changes["buffer_size"])
+        
+        if "blob_store_directory" in changes:
+            self.blob_store = self.open_blob_store(changes["blob_store_directory"])
+        
+        if "http_port" in changes and self.running:
+            if self.http_gateway is not None:
+                self.http_gateway.stop()
+                self.http_gateway = None
+            self.start_http_gateway()
+        
+        if "fsync_policy" in changes or "collision_policy" in changes:
+            self.finalizer.flush()
+            self.finalizer = self.make_finalizer()
+    
+    def make_finalizer(self):
+        """Scrittura atomica dei file ricevuti secondo le politiche configurate"""
+        try:
+            return Finalizer(self.config.get("fsync_policy", "batched"),
+                             self.config.get("collision_policy", "overwrite"))
+        except ValueError as e:
+            print(f"{e}: uso le impostazioni predefinite")
+            return Finalizer()
+    
+    def open_blob_store(self, directory):
+        """Archivio dei file ricevuti per hash (disattivato se directory è vuota)"""
+        if not directory:
+            return None
+        try:
+            return BlobStore(directory)
+        except Exception as e:
+            print(f"Impossibile aprire l'archivio dei file ricevuti: {e}")
+            return None
+    
+    def load_identity(self):
+        """Certificato TLS del dispositivo (creato al primo avvio)"""
+        try:
+            cert_file, key_file = ensure_identity(common_name=self.host)
+            context = server_context(cert_file, key_file)
+            with open(cert_file, "r") as f:
+                der = ssl.PEM_cert_to_DER_cert(f.read())
+            return context, fingerprint(der)
+        except Exception as e:
+            print(f"Trasferimenti cifrati non disponibili: {e}")
+            return None, None
     
     def register_device(self):
         # Aggiunge questo dispositivo al file devices.json
@@ -121,72 +199,1167 @@ class Receiver:
         """Aggiunge una funzione di callback da chiamare quando un file viene ricevuto"""
         self.transfer_callbacks.append(callback)
     
-    def start_discovery_service(self):
-        discovery_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        discovery_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    def set_sink_factory(self, factory):
+        """Registra factory(file_info, sender_ip) -> Sink o None.
+        
+        Per i file singoli e i flussi, il Sink restituito riceve i dati man
+        mano che arrivano invece della cartella di ricezione; None mantiene
+        la scrittura su disco.
+        """
+        self.sink_factory = factory
+    
+    def open_sink(self, file_info, sender_ip):
+        if self.sink_factory is None or file_info.get("type") not in (None, "stream"):
+            return None
+        return self.sink_factory(file_info, sender_ip)
+    
+    def receive_to_sink(self, client_socket, file_info, sender_ip, span, sink):
+        """Passa i dati al sink nell'ordine del file, verificando l'hash alla fine"""
+        hasher = hashlib.sha256()
+        bytes_received = 0
+        try:
+            with span.stage("sink"):
+                if file_info.get("type") == "stream":
+                    for data in iter_received_chunks(client_socket):
+                        sink.write(data)
+                        hasher.update(data)
+                        bytes_received += len(data)
+                    trailer = recv_json(client_socket)
+                    expected_size, expected_digest = trailer.get("size"), trailer.get("sha256")
+                else:
+                    if "sha256" not in file_info:
+                        hasher = None
+                    bytes_received = self._receive_extents_to_sink(client_socket, file_info, sink, hasher)
+                    expected_size, expected_digest = file_info["filesize"], file_info.get("sha256")
+            
+            if bytes_received != expected_size:
+                raise IOError(f"Trasferimento interrotto: {file_info['filename']}")
+            if expected_digest and hasher.hexdigest() != expected_digest:
+                raise IOError(f"Hash non corrispondente per {file_info['filename']}")
+            sink.close()
+        except Exception as e:
+            try:
+                sink.abort(e)
+            except Exception as abort_error:
+                print(f"Errore nell'interruzione del sink: {abort_error}")
+            if file_info.get("type") == "stream":
+                client_socket.send("ERROR flusso non valido".encode())
+            raise
+        
+        if file_info.get("type") == "stream":
+            client_socket.send("DONE".encode())
+        span.set(filesize=bytes_received, sink=type(sink).__name__)
+        metrics.inc("zapshare_bytes_received_total", bytes_received)
+        metrics.inc("zapshare_files_received_total")
+        print(f"File ricevuto: {file_info['filename']} da {sender_ip} (inviato a {type(sink).__name__})")
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": bytes_received,
+            "sender_ip": sender_ip,
+            "save_path": None,
+            "sink": sink
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def _receive_extents_to_sink(self, client_socket, file_info, sink, hasher):
+        """Ricezione di un file singolo verso un sink; restituisce la dimensione logica"""
+        sparse = file_info.get("sparse", False)
+        compressed = "compression" in file_info
+        position = 0
+        for _ in range(file_info.get("extents", 0) if sparse else 1):
+            if sparse:
+                offset, length = EXTENT.unpack(recv_exact(client_socket, EXTENT.size))
+                if offset < position:
+                    raise IOError(f"Regioni non ordinate per {file_info['filename']}")
+                # Il sink è sequenziale: i buchi diventano zeri
+                if offset > position:
+                    self._sink_zeros(sink, hasher, offset - position)
+                    position = offset
+            else:
+                length = file_info["filesize"]
+            
+            remaining = length
+            while remaining > 0:
+                if compressed:
+                    _, data = recv_compressed_frame(client_socket, remaining)
+                else:
+                    # Blocchi grandi: ogni write() può costare un passaggio tra thread o una pipe
+                    data = client_socket.recv(min(STREAM_CHUNK_SIZE, remaining))
+                    if not data:
+                        return position
+                sink.write(data)
+                if hasher:
+                    hasher.update(data)
+                remaining -= len(data)
+                position += len(data)
+        
+        if sparse and position < file_info["filesize"]:
+            self._sink_zeros(sink, hasher, file_info["filesize"] - position)
+            position = file_info["filesize"]
+        return position
+    
+    def _sink_zeros(self, sink, hasher, length):
+        # Il sender calcola l'hash dei file sparsi sul contenuto completo, buchi compresi
+        sink.write_zeros(length)
+        if not hasher:
+            return
+        zeros = bytes(min(length, 1024 * 1024))
+        while length > 0:
+            hasher.update(zeros[:length])
+            length -= min(length, len(zeros))
+    
+    def receive_archive(self, client_socket, file_info, sender_ip, span):
+        """Estrae un archivio di file piccoli, scrivendo i file con un pool di thread"""
+        receive_dir = self.config["receive_directory"]
+        pending = threading.BoundedSemaphore(self.max_pending_writes)
+        errors = []
+        finalizer = self.finalizer
+        policy = "overwrite" if file_info.get("replace") else None
+        
+        def write(entry):
+            try:
+                write_entry(receive_dir, *entry, finalizer=finalizer, policy=policy)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                pending.release()
+        
+        files_received = 0
+        bytes_received = 0
+        reader = client_socket.makefile('rb')
+        try:
+            with ThreadPoolExecutor(max_workers=self.writer_threads) as pool:
+                for entry in iter_unpack(reader):
+                    pending.acquire()
+                    pool.submit(write, entry)
+                    files_received += 1
+                    bytes_received += len(entry[1])
+        finally:
+            reader.close()
+        
+        if errors:
+            client_socket.send(f"ERROR {errors[0]}".encode())
+            raise errors[0]
+        
+        # Una sola serie di fsync per tutto l'archivio, prima della conferma
+        finalizer.flush()
+        client_socket.send("DONE".encode())
+        
+        metrics.inc("zapshare_bytes_received_total", bytes_received)
+        metrics.inc("zapshare_files_received_total", files_received)
+        print(f"Ricevuti {files_received} file da {sender_ip}")
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": bytes_received,
+            "files": files_received,
+            "sender_ip": sender_ip,
+            "save_path": receive_dir
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def send_manifest(self, client_socket, file_info):
+        """Invia il manifest della cartella sincronizzata, aggiornato in modo incrementale"""
+        root = safe_join(self.config["receive_directory"], file_info["folder"])
+        manifest = build_manifest(root, cache=self.manifest_store.get(root))
+        self.manifest_store.put(root, manifest)
+        send_json(client_socket, manifest)
+        print(f"Manifest di {file_info['folder']} inviato ({len(manifest)} file)")
+    
+    def delete_synced(self, client_socket, file_info, sender_ip):
+        """Elimina i file rimossi dal sender nella cartella sincronizzata"""
+        root = safe_join(self.config["receive_directory"], file_info["folder"])
+        deleted = 0
+        for relative_path in recv_json(client_socket):
+            try:
+                os.remove(safe_join(root, relative_path))
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Impossibile eliminare {relative_path}: {e}")
+        
+        # Rimuove le cartelle rimaste vuote
+        for directory, subdirs, files in os.walk(root, topdown=False):
+            if directory != root and not os.listdir(directory):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+        
+        client_socket.send("DONE".encode())
+        print(f"Eliminati {deleted} file da {file_info['folder']} su richiesta di {sender_ip}")
+    
+    def receive_stream(self, client_socket, file_info, sender_ip, span):
+        """Riceve un flusso a blocchi; dimensione e hash arrivano nel trailer finale"""
+        save_path = safe_join(self.config["receive_directory"], file_info["filename"])
+        finalizer = self.finalizer
+        temp_path = finalizer.temp_path(save_path)
+        hasher = hashlib.sha256()
+        bytes_received = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for data in iter_received_chunks(client_socket):
+                    f.write(data)
+                    hasher.update(data)
+                    bytes_received += len(data)
+            
+            # Trailer: dimensione finale e hash, da verificare prima di rendere visibile il file
+            trailer = recv_json(client_socket)
+            digest = hasher.hexdigest()
+            if trailer.get("size") != bytes_received or trailer.get("sha256") != digest:
+                raise IOError(f"Flusso incompleto o corrotto: {file_info['filename']}")
+            
+            policy = "overwrite" if file_info.get("replace") else None
+            with span.stage("finalize"):
+                final_path = finalizer.commit(temp_path, save_path, file_info.get("mtime_ns"),
+                                              digest=digest, policy=policy)
+                finalizer.flush()
+        except Exception:
+            finalizer.discard(temp_path)
+            client_socket.send("ERROR flusso non valido".encode())
+            raise
+        
+        # Conferma solo dopo il rename (e l'fsync, secondo la politica)
+        client_socket.send("DONE".encode())
+        span.set(filesize=bytes_received)
+        if final_path is None:
+            print(f"{file_info['filename']} è già presente e identico: non sostituito")
+        else:
+            save_path = final_path
+            get_hash_cache().store(save_path, digest)
+            if self.blob_store:
+                try:
+                    self.blob_store.add(save_path, digest)
+                except Exception as e:
+                    print(f"Impossibile aggiungere {file_info['filename']} all'archivio: {e}")
+        
+        metrics.inc("zapshare_bytes_received_total", bytes_received)
+        metrics.inc("zapshare_files_received_total")
+        print(f"Flusso ricevuto: {file_info['filename']} ({bytes_received} bytes) da {sender_ip}")
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": bytes_received,
+            "sender_ip": sender_ip,
+            "save_path": save_path
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def receive_relay(self, client_socket, file_info, sender_ip, span):
+        """Riceve un file da una catena di distribuzione e lo inoltra, blocco per
+        blocco, ai nodi successivi mentre lo scrive su disco.
+        
+        I messaggi di stato (propri e dei nodi successivi) risalgono sulla
+        stessa connessione fino al mittente.
+        """
+        subtree = recv_json(client_socket)
+        me = subtree["device"]
+        report = lambda message: send_json(client_socket, message)
+        fanout = RelayFanout(report)
+        
+        # Connessione ai nodi successivi (cifrata se lo è quella in arrivo)
+        encrypted = isinstance(client_socket, ssl.SSLSocket)
+        for child in subtree["children"]:
+            device = child["device"]
+            try:
+                sock, _ = connect_fastest(device_addresses(device), device.get("port", 9999), timeout=10)
+                sock.settimeout(RELAY_TIMEOUT)
+                if encrypted:
+                    sock = self.relay_tls.wrap(sock, device["ip"], device.get("fingerprint"))
+                sock.send(json.dumps(file_info).encode())
+                response = sock.recv(self.buffer_size).decode()
+                if response != "OK":
+                    sock.close()
+                    raise ConnectionError(f"risposta {response}")
+                send_json(sock, child)
+                fanout.add(sock, child)
+            except Exception as e:
+                print(f"Impossibile inoltrare a {device['name']}: {e}")
+                fanout.fail(child, e)
+        
+        save_path = safe_join(self.config["receive_directory"], file_info["filename"])
+        finalizer = self.finalizer
+        temp_path = finalizer.temp_path(save_path)
+        hasher = hashlib.sha256()
+        bytes_received = 0
+        last_report = 0.0
+        try:
+            with open(temp_path, 'wb') as f:
+                for data in iter_received_chunks(client_socket):
+                    # Prima l'inoltro, così i nodi successivi lavorano in parallelo alla scrittura
+                    fanout.send(data)
+                    f.write(data)
+                    hasher.update(data)
+                    bytes_received += len(data)
+                    fanout.poll()
+                    now = time.monotonic()
+                    if now - last_report >= RELAY_PROGRESS_INTERVAL:
+                        report(node_message(me, "progress", bytes_received))
+                        last_report = now
+            
+            trailer = recv_json(client_socket)
+            fanout.end(trailer)
+            digest = hasher.hexdigest()
+            if trailer.get("size") != bytes_received or trailer.get("sha256") != digest:
+                raise IOError(f"File incompleto o corrotto: {file_info['filename']}")
+            
+            policy = "overwrite" if file_info.get("replace") else None
+            with span.stage("finalize"):
+                final_path = finalizer.commit(temp_path, save_path, file_info.get("mtime_ns"),
+                                              digest=digest, policy=policy)
+                finalizer.flush()
+        except Exception as e:
+            finalizer.discard(temp_path)
+            try:
+                report(node_message(me, "failed", bytes_received, e))
+                fanout.abort(e)
+            except OSError:
+                # Il nodo precedente non è raggiungibile: i successivi si chiudono senza segnalazioni
+                fanout.abort(e, notify=False)
+            raise
+        
+        report(node_message(me, "ok", bytes_received))
+        if final_path is not None:
+            save_path = final_path
+            get_hash_cache().store(save_path, digest)
+        metrics.inc("zapshare_bytes_received_total", bytes_received)
+        metrics.inc("zapshare_files_received_total")
+        print(f"File ricevuto: {file_info['filename']} da {sender_ip} (inoltrato a {len(fanout.hops)} nodi)")
+        
+        # La connessione si chiude solo dopo gli esiti di tutti i nodi successivi
+        with span.stage("relay_wait"):
+            fanout.wait()
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": bytes_received,
+            "sender_ip": sender_ip,
+            "save_path": save_path
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def receive_swarm(self, client_socket, file_info, sender_ip, span):
+        """Partecipa alla distribuzione swarm di un file.
+        
+        Il mittente invia a questo receiver solo una parte dei pezzi; gli
+        altri vengono scaricati dai peer (che a loro volta scaricano da qui).
+        Sulla connessione del mittente risalgono avanzamento ed esito; se
+        nessun peer ha un pezzo mancante, lo si chiede al mittente.
+        """
+        meta = recv_json(client_socket)
+        save_path = safe_join(self.config["receive_directory"], file_info["filename"])
+        finalizer = self.finalizer
+        temp_path = finalizer.temp_path(save_path)
+        session = SwarmSession(meta, temp_path)
+        self._swarms[session.id] = session
+        encrypted = isinstance(client_socket, ssl.SSLSocket)
+        
+        def connect(peer):
+            sock, _ = connect_fastest(device_addresses(peer), peer["port"], timeout=10)
+            sock.settimeout(SWARM_TIMEOUT)
+            if encrypted:
+                sock = self.relay_tls.wrap(sock, peer["ip"])
+            sock.send(json.dumps({"type": "swarm_pieces", "filename": file_info["filename"],
+                                  "filesize": None, "swarm_id": session.id}).encode())
+            response = sock.recv(self.buffer_size).decode()
+            if response != "OK":
+                sock.close()
+                raise ConnectionError(response)
+            return sock
+        
+        downloaders = []
+        committed = False
+        try:
+            send_json(client_socket, {"port": self.port, "discovery_port": self.discovery_port})
+            peers = recv_json(client_socket)
+            session.set_peers(peers["you"], peers["peers"])
+            for peer in session.peers.values():
+                thread = threading.Thread(target=download_from_peer, args=(session, peer, connect))
+                thread.daemon = True
+                thread.start()
+                downloaders.append(thread)
+            
+            # Pezzi inviati direttamente dal mittente
+            with span.stage("seed"):
+                while True:
+                    index, data = recv_piece(client_socket)
+                    if index == END_OF_PIECES:
+                        break
+                    if data is not None:
+                        session.store(index, data)
+            
+            # Scambio con i peer; il mittente riceve l'avanzamento e, se serve, fornisce i pezzi
+            with span.stage("swarm"):
+                while not session.complete:
+                    session.announce(force=True)
+                    send_json(client_socket, {"status": "progress", "pieces": session.have_count,
+                                              "bytes": session.have_count * session.piece_size})
+                    if time.monotonic() - session.last_progress > SWARM_STALL:
+                        index = session.pick_unavailable()
+                        if index is not None:
+                            send_json(client_socket, {"status": "request", "piece": index})
+                            _, data = recv_piece(client_socket)
+                            if data is None or not session.store(index, data):
+                                raise IOError(f"Pezzo {index} non disponibile")
+                            metrics.inc("zapshare_swarm_seed_requests_total")
+                    session.wait(SWARM_ANNOUNCE_INTERVAL)
+            session.announce(force=True)
+            
+            session.finish_file()
+            with span.stage("finalize"):
+                policy = "overwrite" if file_info.get("replace") else None
+                final_path = finalizer.commit(temp_path, save_path, file_info.get("mtime_ns"), policy=policy)
+                finalizer.flush()
+            committed = True
+            save_path = final_path or save_path
+            session.serve_from(save_path)
+            # Durante il rename i pezzi non erano leggibili: i peer che li hanno chiesti li hanno scartati
+            session.announce(force=True)
+            send_json(client_socket, {"status": "ok", "pieces": session.count, "bytes": meta["filesize"]})
+            
+            metrics.inc("zapshare_bytes_received_total", meta["filesize"])
+            metrics.inc("zapshare_files_received_total")
+            print(f"File ricevuto: {file_info['filename']} da {sender_ip} (swarm con {len(session.peers)} peer)")
+            
+            # I peer possono ancora scaricare da qui: si resta nello swarm finché il mittente non chiude
+            with span.stage("linger"):
+                client_socket.settimeout(None)
+                while client_socket.recv(self.buffer_size):
+                    pass
+        except Exception as e:
+            try:
+                send_json(client_socket, {"status": "failed", "error": str(e)})
+            except OSError:
+                pass
+            raise
+        finally:
+            self._swarms.pop(session.id, None)
+            session.close()
+            for thread in downloaders:
+                thread.join(1.0)
+            if not committed:
+                finalizer.discard(temp_path)
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": meta["filesize"],
+            "sender_ip": sender_ip,
+            "save_path": save_path
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def receive_udp(self, client_socket, file_info, sender_ip, span):
+        """Riceve i dati del file via UDP (modalità bulk per collegamenti lenti o con perdite).
+        
+        La connessione TCP resta il canale di controllo: porta UDP, conferma
+        di ricezione completa, hash finale ed esito.
+        """
+        family = socket.AF_INET6 if client_socket.family == socket.AF_INET6 else socket.AF_INET
+        port = int(self.config.get("udp_port", 0))
+        try:
+            udp_socket = open_udp_socket(family, port)
+        except OSError:
+            # Porta fissa già occupata da un altro trasferimento UDP
+            udp_socket = open_udp_socket(family)
+        
+        save_path = safe_join(self.config["receive_directory"], file_info["filename"])
+        finalizer = self.finalizer
+        temp_path = finalizer.temp_path(save_path)
+        payload_size = int(file_info.get("datagram_size", UDP_PAYLOAD_SIZE))
         try:
-            discovery_socket.bind(('', 9998))
+            if not 256 <= payload_size <= 65000:
+                raise ValueError(f"Dimensione dei datagrammi non valida: {payload_size}")
+            with open(temp_path, "wb") as f:
+                f.truncate(file_info["filesize"])
+                send_json(client_socket, {"udp_port": udp_socket.getsockname()[1]})
+                receiver = UdpReceiver(udp_socket, f, file_info["filesize"], sender_ip, payload_size)
+                with span.stage("socket_recv"):
+                    receiver.run(client_socket, normalize_ip)
+            span.set(duplicates=receiver.duplicates)
             
-            print(f"Servizio di discovery avviato. In ascolto sulla porta 9998")
+            send_json(client_socket, {"status": "received"})
+            trailer = recv_json(client_socket)
+            # Hash diretto: il temporaneo viene rinominato subito, in cache sarebbe una voce morta
+            digest = file_digest(temp_path)
+            if trailer.get("sha256") != digest:
+                raise IOError(f"Hash non corrispondente per {file_info['filename']}")
             
+            policy = "overwrite" if file_info.get("replace") else None
+            with span.stage("finalize"):
+                final_path = finalizer.commit(temp_path, save_path, file_info.get("mtime_ns"),
+                                              digest=digest, policy=policy)
+                finalizer.flush()
+        except Exception as e:
+            finalizer.discard(temp_path)
+            try:
+                send_json(client_socket, {"status": "failed", "error": str(e)})
+            except OSError:
+                pass
+            raise
+        finally:
+            udp_socket.close()
+        
+        send_json(client_socket, {"status": "ok"})
+        if final_path is not None:
+            save_path = final_path
+            get_hash_cache().store(save_path, digest)
+        metrics.inc("zapshare_bytes_received_total", file_info["filesize"])
+        metrics.inc("zapshare_files_received_total")
+        print(f"File ricevuto: {file_info['filename']} da {sender_ip} (UDP)")
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": file_info["filesize"],
+            "sender_ip": sender_ip,
+            "save_path": save_path
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def receive_mux(self, client_socket, file_info, sender_ip, span):
+        """Sessione multiplexata: molti file su una connessione, a frame intercalati.
+        
+        Ogni flusso ha la sua finestra: dopo aver scritto metà finestra si
+        restituisce il credito al sender. L'esito di ogni file viene inviato
+        appena il file è completo, senza attendere gli altri.
+        """
+        streams = {}
+        files = 0
+        try:
+            while True:
+                kind, stream_id, payload = recv_frame(client_socket)
+                if kind == GOAWAY:
+                    break
+                if kind == OPEN:
+                    info = json.loads(payload.decode())
+                    try:
+                        save_path = safe_join(self.config["receive_directory"], info["filename"])
+                        temp_path = self.finalizer.temp_path(save_path)
+                        streams[stream_id] = {
+                            "info": info,
+                            "save_path": save_path,
+                            "temp_path": temp_path,
+                            "file": open(temp_path, "wb"),
+                            "hasher": hashlib.sha256(),
+                            "received": 0,
+                            "unacked": 0
+                        }
+                    except Exception as e:
+                        self._mux_result(client_socket, stream_id, {"status": "failed", "error": str(e)})
+                    continue
+                
+                stream = streams.get(stream_id)
+                if stream is None:
+                    # Flusso già rifiutato: i frame rimasti in viaggio si scartano
+                    continue
+                try:
+                    if kind == DATA:
+                        stream["file"].write(payload)
+                        stream["hasher"].update(payload)
+                        stream["received"] += len(payload)
+                        stream["unacked"] += len(payload)
+                        if stream["unacked"] >= MUX_WINDOW // 2:
+                            send_frame(client_socket, WINDOW, stream_id, WINDOW_UPDATE.pack(stream["unacked"]))
+                            stream["unacked"] = 0
+                    elif kind == END:
+                        del streams[stream_id]
+                        self._finish_mux_stream(client_socket, stream_id, stream, json.loads(payload.decode()), sender_ip)
+                        files += 1
+                except OSError:
+                    # Errore di rete: la sessione termina
+                    raise
+                except Exception as e:
+                    streams.pop(stream_id, None)
+                    stream["file"].close()
+                    self.finalizer.discard(stream["temp_path"])
+                    print(f"Errore nella ricezione di {stream['info']['filename']}: {e}")
+                    self._mux_result(client_socket, stream_id, {"status": "failed", "error": str(e)})
+        finally:
+            for stream in streams.values():
+                stream["file"].close()
+                self.finalizer.discard(stream["temp_path"])
+        span.set(files=files)
+    
+    def _finish_mux_stream(self, client_socket, stream_id, stream, trailer, sender_ip):
+        info = stream["info"]
+        stream["file"].close()
+        digest = stream["hasher"].hexdigest()
+        if trailer.get("size") != stream["received"] or trailer.get("sha256") != digest:
+            raise IOError(f"File incompleto o corrotto: {info['filename']}")
+        
+        policy = "overwrite" if info.get("replace") else None
+        final_path = self.finalizer.commit(stream["temp_path"], stream["save_path"], info.get("mtime_ns"),
+                                           digest=digest, policy=policy)
+        self.finalizer.flush()
+        self._mux_result(client_socket, stream_id, {"status": "ok", "size": stream["received"]})
+        
+        save_path = final_path or stream["save_path"]
+        if final_path is not None:
+            get_hash_cache().store(save_path, digest)
+        metrics.inc("zapshare_bytes_received_total", stream["received"])
+        metrics.inc("zapshare_files_received_total")
+        print(f"File ricevuto: {info['filename']} da {sender_ip}")
+        
+        transfer_info = {
+            "filename": info["filename"],
+            "filesize": stream["received"],
+            "sender_ip": sender_ip,
+            "save_path": save_path
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def _mux_result(self, client_socket, stream_id, result):
+        send_frame(client_socket, RESULT, stream_id, json.dumps(result).encode())
+    
+    def swarm_announce(self, data, sender_ip):
+        """Annuncio UDP dei pezzi posseduti da un peer"""
+        if not self.is_allowed_peer(sender_ip):
+            self._drop_discovery("not_local")
+            return
+        try:
+            swarm, peer_id, have = decode_announce(data)
+        except Exception:
+            self._drop_discovery("invalid")
+            return
+        session = self._swarms.get(swarm)
+        if session is not None:
+            session.update_peer(peer_id, have)
+    
+    def receive_multipath_stream(self, client_socket, file_info, sender_ip, span):
+        """Riceve le strisce di uno dei flussi multipath e le scrive al loro offset"""
+        transfer_id = file_info["transfer_id"]
+        with self._multipath_lock:
+            transfer = self._multipath.get(transfer_id)
+            if transfer is None:
+                save_path = safe_join(self.config["receive_directory"], file_info["filename"])
+                temp_path = self.finalizer.temp_path(save_path)
+                with open(temp_path, 'wb') as f:
+                    f.truncate(file_info["filesize"])
+                transfer = {
+                    "save_path": save_path,
+                    "temp_path": temp_path,
+                    "streams": file_info["streams"],
+                    "streams_done": 0,
+                    "bytes": 0
+                }
+                self._multipath[transfer_id] = transfer
+        
+        bytes_received = 0
+        try:
+            with open(transfer["temp_path"], 'r+b') as f:
+                while True:
+                    offset, length = EXTENT.unpack(recv_exact(client_socket, EXTENT.size))
+                    if length == 0:
+                        break
+                    f.seek(offset)
+                    remaining = length
+                    while remaining > 0:
+                        data = client_socket.recv(min(self.buffer_size * 16, remaining))
+                        if not data:
+                            raise ConnectionError("Flusso multipath interrotto")
+                        f.write(data)
+                        remaining -= len(data)
+                    bytes_received += length
+        except Exception:
+            # Un flusso fallito invalida l'intero trasferimento
+            with self._multipath_lock:
+                if self._multipath.pop(transfer_id, None) is not None:
+                    self.finalizer.discard(transfer["temp_path"])
+            raise
+        
+        with self._multipath_lock:
+            # Lettura e riscrittura esplicite: il registro può essere condiviso tra processi
+            transfer = self._multipath.get(transfer_id)
+            if transfer is None:
+                raise IOError(f"Trasferimento multipath annullato: {file_info['filename']}")
+            transfer["bytes"] += bytes_received
+            transfer["streams_done"] += 1
+            finished = transfer["streams_done"] == transfer["streams"]
+            if finished:
+                self._multipath.pop(transfer_id, None)
+            else:
+                self._multipath[transfer_id] = transfer
+        
+        metrics.inc("zapshare_bytes_received_total", bytes_received)
+        if not finished:
+            client_socket.send("DONE".encode())
+            return
+        
+        # L'ultimo flusso conferma solo dopo che il file è al suo posto
+        if transfer["bytes"] != file_info["filesize"]:
+            self.finalizer.discard(transfer["temp_path"])
+            client_socket.send("ERROR incompleto".encode())
+            raise IOError(f"Trasferimento multipath incompleto: {file_info['filename']}")
+        save_path = self.finalizer.commit(transfer["temp_path"], transfer["save_path"], file_info.get("mtime_ns"))
+        self.finalizer.flush()
+        client_socket.send("DONE".encode())
+        if save_path is None:
+            save_path = transfer["save_path"]
+            print(f"{file_info['filename']} è già presente e identico: non sostituito")
+        metrics.inc("zapshare_files_received_total")
+        print(f"File ricevuto: {file_info['filename']} da {sender_ip} su {transfer['streams']} percorsi")
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": file_info["filesize"],
+            "sender_ip": sender_ip,
+            "save_path": save_path
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+    
+    def _bind_socket(self, sock_type, port, family=socket.AF_INET, dual_stack=False, reuse_port=False):
+        """Crea e collega un socket, senza permettere a due receiver di condividere la porta
+        (salvo reuse_port: i worker dello stesso receiver si dividono le connessioni)"""
+        sock = socket.socket(family, sock_type)
+        if reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                sock.close()
+                raise OSError("SO_REUSEPORT non supportato su questo sistema")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        elif hasattr(socket, "SO_EXCLUSIVEADDRUSE"):
+            # Su Windows SO_REUSEADDR permette a due processi di usare la stessa porta
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            if family == socket.AF_INET6:
+                # Con dual_stack un solo socket accetta sia IPv6 sia IPv4 (::ffff:a.b.c.d)
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0 if dual_stack else 1)
+                sock.bind(('::', port))
+            else:
+                sock.bind(('', port))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+    
+    def _bind_server_socket(self, port=None):
+        """Socket TCP dual-stack; se IPv6 non è disponibile solo IPv4"""
+        port = self.port if port is None else port
+        if socket.has_ipv6:
+            try:
+                return self._bind_socket(socket.SOCK_STREAM, port, socket.AF_INET6, dual_stack=True,
+                                         reuse_port=self.reuse_port)
+            except OSError as e:
+                print(f"IPv6 non disponibile, ascolto solo su IPv4: {e}")
+        return self._bind_socket(socket.SOCK_STREAM, port, reuse_port=self.reuse_port)
+    
+    def _bind_discovery6_socket(self):
+        """Socket UDP IPv6 iscritto al gruppo multicast link-local di discovery su ogni interfaccia"""
+        sock = self._bind_socket(socket.SOCK_DGRAM, self.discovery_port, socket.AF_INET6)
+        joined = 0
+        group = socket.inet_pton(socket.AF_INET6, DISCOVERY_GROUP6)
+        for index in inventory.multicast_indexes():
+            try:
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, group + struct.pack("@I", index))
+                joined += 1
+            except OSError:
+                pass
+        if not joined:
+            sock.close()
+            raise OSError("nessuna interfaccia IPv6 con multicast")
+        return sock
+    
+    def _wait_readable(self, *socks):
+        """Attende che uno dei socket sia leggibile e lo restituisce; None se è stato richiesto lo stop"""
+        with selectors.DefaultSelector() as selector:
+            for sock in socks:
+                selector.register(sock, selectors.EVENT_READ)
+            selector.register(self._wakeup_r, selectors.EVENT_READ)
+            while self.running:
+                for key, _ in selector.select():
+                    if key.fileobj is self._wakeup_r:
+                        return None
+                    return key.fileobj
+        return None
+    
+    def advertised_addresses(self):
+        """Indirizzi su cui il receiver è raggiungibile (IPv4 e IPv6 non link-local)"""
+        addresses = [self.ip]
+        for interface in inventory.interfaces():
+            if interface["ip"] not in addresses:
+                addresses.append(interface["ip"])
+        if self.dual_stack:
+            for address in inventory.ipv6_addresses():
+                if not address["link_local"] and address["ip"] not in addresses:
+                    addresses.append(address["ip"])
+        return addresses
+    
+    def discovery_response(self, compact=False):
+        """Risposta di discovery codificata (ricostruita solo quando cambia qualcosa)"""
+        response = self._discovery_responses.get(compact)
+        if response is None:
+            info = {
+                "name": self.config["computer_name"],
+                "ip": self.ip,
+                "port": self.port,
+                "addresses": self.advertised_addresses(),
+                "tls": self.tls_context is not None
+            }
+            response = encode_response(info) if compact else json.dumps(info).encode()
+            self._discovery_responses[compact] = response
+        return response
+    
+    def invalidate_discovery_response(self):
+        # Nome, indirizzi o porta cambiati: le risposte vanno ricodificate
+        self._discovery_responses = {}
+    
+    def _drop_discovery(self, reason):
+        self.discovery_stats[reason] += 1
+        metrics.inc("zapshare_discovery_requests_dropped_total", reason=reason)
+    
+    def start_discovery_service(self, discovery_sockets=None):
+        try:
+            if discovery_sockets is None:
+                discovery_sockets = [self._bind_socket(socket.SOCK_DGRAM, self.discovery_port)]
+            
+            print(f"Servizio di discovery avviato. In ascolto sulla porta {self.discovery_port}")
+            
+            stats = self.discovery_stats
             while self.running:
                 try:
-                    data, addr = discovery_socket.recvfrom(1024)
-                    sender_ip = addr[0]
+                    discovery_socket = self._wait_readable(*discovery_sockets)
+                    if discovery_socket is None:
+                        break
+                    data, addr = discovery_socket.recvfrom(65535)
+                    # Annunci dei peer di uno swarm (non sono richieste di discovery)
+                    if data.startswith(SWARM_ANNOUNCE):
+                        self.swarm_announce(data, normalize_ip(addr[0]))
+                        continue
+                    stats["requests"] += 1
+                    if data == DISCOVERY_REQUEST_COMPACT:
+                        compact = True
+                    elif data == DISCOVERY_REQUEST:
+                        compact = False
+                    else:
+                        self._drop_discovery("invalid")
+                        continue
+                    metrics.inc("zapshare_discovery_requests_received_total", format="compact" if compact else "json")
+                    
+                    # Limite per sorgente prima di ogni altro controllo: un host
+                    # che invia richieste a raffica costa solo una lookup
+                    sender_ip = normalize_ip(addr[0])
+                    if not self.discovery_limiter.allow(sender_ip):
+                        self._drop_discovery("rate_limited")
+                        continue
                     
-                    # Verifica se l'IP del mittente è nella rete 192.168.1.x
-                    if not sender_ip.startswith('192.168.1.'):
-                        print(f"Ignorata richiesta di discovery da rete non 192.168.1.x: {sender_ip}")
+                    # Verifica se il mittente è su una delle reti locali
+                    if not self.is_allowed_peer(sender_ip):
+                        self._drop_discovery("not_local")
                         continue
                     
-                    if data == b'DISCOVERY_REQUEST':
-                        print(f"Richiesta di discovery ricevuta da {sender_ip}")
-                        
-                        # Risponde con informazioni sul dispositivo
-                        response = json.dumps({
-                            "name": self.config["computer_name"],
-                            "ip": self.ip,
-                            "port": self.port
-                        }).encode()
-                        discovery_socket.sendto(response, addr)
+                    # Risponde con la risposta già codificata
+                    discovery_socket.sendto(self.discovery_response(compact), addr)
+                    stats["responses"] += 1
                 except Exception as e:
                     if self.running:
                         print(f"Errore nel servizio di discovery: {e}")
         except Exception as e:
             print(f"Impossibile avviare il servizio di discovery: {e}")
         finally:
-            discovery_socket.close()
+            for discovery_socket in discovery_sockets or []:
+                discovery_socket.close()
+    
+    def share_directory(self):
+        """Cartella servita dal gateway HTTP (predefinita: la cartella di ricezione)"""
+        return self.config.get("http_share_directory") or self.config["receive_directory"]
+    
+    def start_http_gateway(self):
+        """Avvia il gateway HTTP sulla porta http_port (disattivato se non configurata)"""
+        port = self.config.get("http_port")
+        if not port or not self.serve_http:
+            return
+        try:
+            sock = self._bind_server_socket(int(port))
+            gateway = HttpGateway(self.share_directory, lambda ip: self.is_allowed_peer(normalize_ip(ip)))
+            gateway.start(sock)
+        except Exception as e:
+            print(f"Impossibile avviare il gateway HTTP: {e}")
+            return
+        self.http_gateway = gateway
+        print(f"Gateway HTTP avviato sulla porta {gateway.port}: {self.share_directory()}")
+    
+    def is_allowed_peer(self, ip):
+        """Accetta solo mittenti sulle reti locali delle interfacce (e il loopback)"""
+        return inventory.is_local_network(ip)
     
     def receive_file(self, client_socket, client_address):
+        span = metrics.span("receive", peer=normalize_ip(client_address[0]))
+        status = "failed"
+        temp_path = None
         try:
-            # Verifica se l'IP del mittente è nella rete 192.168.1.x
-            sender_ip = client_address[0]
-            if not sender_ip.startswith('192.168.1.'):
-                print(f"Ignorata connessione da rete non 192.168.1.x: {sender_ip}")
+            # Verifica se il mittente è su una delle reti locali
+            sender_ip = normalize_ip(client_address[0])
+            if not self.is_allowed_peer(sender_ip):
+                print(f"Ignorata connessione da rete non locale: {sender_ip}")
                 client_socket.close()
+                status = "rejected"
+                return
+            
+            # Connessione cifrata (il ClientHello TLS si distingue dall'header JSON)
+            with span.stage("tls"):
+                encrypted = self.tls_context is not None and is_tls_hello(client_socket)
+                if encrypted:
+                    tls_socket = self.tls_context.wrap_socket(client_socket, server_side=True)
+                    self._replace_active(client_socket, tls_socket)
+                    client_socket = tls_socket
+            if not encrypted and self.config.get("require_encryption", False):
+                print(f"Rifiutata connessione non cifrata da {sender_ip}")
+                status = "rejected"
                 return
+            span.set(encrypted=encrypted)
             
             # Riceve le informazioni sul file
-            file_info = client_socket.recv(self.buffer_size).decode()
-            file_info = json.loads(file_info)
+            with span.stage("handshake"):
+                file_info = client_socket.recv(self.buffer_size).decode()
+                file_info = json.loads(file_info)
+                
+                # Sink registrato dall'applicazione (i dati non passano dal disco)
+                sink = self.open_sink(file_info, sender_ip)
+                
+                # File già presente nell'archivio: lo collega senza ricevere dati
+                if sink is None and self.link_known_file(client_socket, file_info, sender_ip):
+                    span.set(filename=file_info["filename"], filesize=file_info["filesize"])
+                    status = "dedup"
+                    return
+                
+                if file_info.get("compression") not in (None, "zlib"):
+                    client_socket.send(f"ERRORE: compressione non supportata ({file_info['compression']})".encode())
+                    if sink is not None:
+                        sink.abort("compressione non supportata")
+                    status = "rejected"
+                    return
+                
+                if file_info.get("type") == "swarm_pieces" and file_info.get("swarm_id") not in self._swarms:
+                    client_socket.send("ERRORE: swarm sconosciuto".encode())
+                    status = "rejected"
+                    return
+                
+                # Invia conferma di ricezione
+                client_socket.send("OK".encode())
+            span.set(filename=file_info["filename"], filesize=file_info["filesize"])
+            
+            if sink is not None:
+                self.receive_to_sink(client_socket, file_info, sender_ip, span, sink)
+                status = "ok"
+                return
+            
+            # Archivio di file piccoli
+            if file_info.get("type") == "archive":
+                self.receive_archive(client_socket, file_info, sender_ip, span)
+                status = "ok"
+                return
             
-            # Invia conferma di ricezione
-            client_socket.send("OK".encode())
+            # Sincronizzazione cartelle: richiesta del manifest o delle eliminazioni
+            if file_info.get("type") == "sync_manifest":
+                self.send_manifest(client_socket, file_info)
+                status = "ok"
+                return
+            if file_info.get("type") == "sync_delete":
+                self.delete_synced(client_socket, file_info, sender_ip)
+                status = "ok"
+                return
             
-            # Crea il percorso di destinazione
-            save_path = os.path.join(self.config["receive_directory"], file_info["filename"])
+            # Flusso di lunghezza sconosciuta (pipe, stdin, ...)
+            if file_info.get("type") == "stream":
+                self.receive_stream(client_socket, file_info, sender_ip, span)
+                status = "ok"
+                return
             
-            # Riceve il file
-            with open(save_path, 'wb') as f:
+            # Distribuzione a catena: il file va anche inoltrato ai nodi successivi
+            if file_info.get("type") == "relay":
+                self.receive_relay(client_socket, file_info, sender_ip, span)
+                status = "ok"
+                return
+            
+            # Dati via UDP, controllo sulla connessione TCP
+            if file_info.get("type") == "udp":
+                self.receive_udp(client_socket, file_info, sender_ip, span)
+                status = "ok"
+                return
+            
+            # Sessione multiplexata: molti file, con priorità, sulla stessa connessione
+            if file_info.get("type") == "mux":
+                self.receive_mux(client_socket, file_info, sender_ip, span)
+                status = "ok"
+                return
+            
+            # Swarm: partecipazione alla distribuzione o richiesta di pezzi da un peer
+            if file_info.get("type") == "swarm":
+                self.receive_swarm(client_socket, file_info, sender_ip, span)
+                status = "ok"
+                return
+            if file_info.get("type") == "swarm_pieces":
+                session = self._swarms.get(file_info.get("swarm_id"))
+                if session is not None:
+                    serve_pieces(client_socket, session)
+                status = "ok"
+                return
+            
+            # Uno dei flussi di un trasferimento multipath
+            if file_info.get("type") == "multipath":
+                self.receive_multipath_stream(client_socket, file_info, sender_ip, span)
+                status = "ok"
+                return
+            
+            # Crea il percorso di destinazione (il nome può contenere sottocartelle).
+            # I dati vanno in un file temporaneo, spostato al suo posto solo se completo
+            save_path = safe_join(self.config["receive_directory"], file_info["filename"])
+            finalizer = self.finalizer
+            temp_path = finalizer.temp_path(save_path)
+            blob_store = self.blob_store
+            
+            # Riceve il file (per i file sparsi: solo le regioni con dati)
+            sparse = file_info.get("sparse", False)
+            extent_count = file_info.get("extents", 0) if sparse else 1
+            timed = span.timed
+            recv_time = write_time = 0.0
+            
+            # Verifica di integrità al volo, se il sender ha inviato l'hash
+            hasher = hashlib.sha256() if "sha256" in file_info and not sparse else None
+            compressed = "compression" in file_info
+            
+            # Zero-copy (Linux): i dati passano dal socket al file tramite una pipe,
+            # senza entrare in userspace. L'hash viene verificato rileggendo il file
+            zero_copy = (self.zero_copy_receive and SPLICE_AVAILABLE and not compressed
+                         and not isinstance(client_socket, ssl.SSLSocket) and client_socket.gettimeout() is None)
+            if zero_copy:
+                hasher = None
+            with open(temp_path, 'wb') as f, (SplicePipe() if zero_copy else contextlib.nullcontext()) as pipe:
                 bytes_received = 0
-                while bytes_received < file_info["filesize"]:
-                    data = client_socket.recv(self.buffer_size)
-                    if not data:
+                complete = True
+                for _ in range(extent_count):
+                    if sparse:
+                        offset, length = EXTENT.unpack(recv_exact(client_socket, EXTENT.size))
+                        f.seek(offset)
+                    else:
+                        offset, length = 0, file_info["filesize"]
+                    
+                    remaining = length
+                    
+                    if pipe is not None and remaining > 0:
+                        t0 = time.perf_counter() if timed else 0.0
+                        try:
+                            moved = splice_to_file(client_socket, f.fileno(), offset, remaining, pipe)
+                        except OSError as e:
+                            # Socket o filesystem senza splice: si prosegue con recv()
+                            moved = getattr(e, "moved", 0)
+                            print(f"Ricezione zero-copy non disponibile ({e}): uso recv()")
+                            pipe = None
+                            f.seek(offset + moved)
+                        if timed:
+                            recv_time += time.perf_counter() - t0
+                        remaining -= moved
+                        bytes_received += moved
+                        if moved < length and pipe is not None:
+                            # Connessione chiusa prima della fine
+                            complete = False
+                            break
+                    
+                    # Blocchi compressi: lunghezza + dati zlib
+                    while compressed and remaining > 0:
+                        frame_size, data = recv_compressed_frame(client_socket, remaining)
+                        f.write(data)
+                        if hasher:
+                            hasher.update(data)
+                        remaining -= len(data)
+                        bytes_received += frame_size
+                    
+                    while remaining > 0:
+                        if timed:
+                            t0 = time.perf_counter()
+                            data = client_socket.recv(min(self.buffer_size, remaining))
+                            t1 = time.perf_counter()
+                            recv_time += t1 - t0
+                        else:
+                            data = client_socket.recv(min(self.buffer_size, remaining))
+                        if not data:
+                            break
+                        f.write(data)
+                        if hasher:
+                            hasher.update(data)
+                        if timed:
+                            write_time += time.perf_counter() - t1
+                        remaining -= len(data)
+                        bytes_received += len(data)
+                    
+                    if remaining > 0:
+                        complete = False
                         break
-                    f.write(data)
-                    bytes_received += len(data)
+                
+                # Ricrea i buchi finali: seek + truncate lasciano il file sparso
+                if sparse and complete:
+                    f.truncate(file_info["filesize"])
+            
+            span.add("socket_recv", recv_time)
+            span.add("disk_write", write_time)
+            if not complete:
+                raise IOError(f"Trasferimento interrotto: {file_info['filename']}")
+            
+            # Verifica l'hash prima di rendere visibile il file
+            digest = None
+            if "sha256" in file_info:
+                digest = hasher.hexdigest() if hasher else file_digest(temp_path)
+                if digest != file_info["sha256"]:
+                    raise IOError(f"Hash non corrispondente per {file_info['filename']}")
+            
+            # Preserva la data di modifica originale e sposta il file al suo posto
+            with span.stage("finalize"):
+                policy = "overwrite" if file_info.get("replace") else None
+                final_path = finalizer.commit(temp_path, save_path, file_info.get("mtime_ns"),
+                                              digest=digest, policy=policy)
+                finalizer.flush()
+            if final_path is None:
+                print(f"{file_info['filename']} è già presente e identico: non sostituito")
+            else:
+                save_path = final_path
+                # Salva l'hash in cache: i manifest successivi non rileggono il file
+                if digest:
+                    get_hash_cache().store(save_path, digest)
+                    if blob_store:
+                        try:
+                            blob_store.add(save_path, digest)
+                        except Exception as e:
+                            print(f"Impossibile aggiungere {file_info['filename']} all'archivio: {e}")
+            metrics.inc("zapshare_bytes_received_total", bytes_received)
+            metrics.inc("zapshare_files_received_total")
             
             print(f"File ricevuto: {file_info['filename']} da {sender_ip}")
+            status = "ok"
             
             # Notifica tramite callback
             transfer_info = {
@@ -204,51 +1377,227 @@ class Receiver:
             
         except Exception as e:
             print(f"Errore durante la ricezione del file: {e}")
+            if temp_path:
+                finalizer.discard(temp_path)
         finally:
             client_socket.close()
+            span.end(status)
+    
+    def link_known_file(self, client_socket, file_info, sender_ip):
+        """Se il contenuto offerto (sha256) è già nell'archivio, lo collega nella
+        cartella di ricezione e risponde "HAVE" invece di "OK".
+        """
+        blob_store = self.blob_store
+        digest = file_info.get("sha256")
+        if not blob_store or not digest or file_info.get("type") or not blob_store.has(digest):
+            return False
+        
+        save_path = safe_join(self.config["receive_directory"], file_info["filename"])
+        finalizer = self.finalizer
+        temp_path = finalizer.temp_path(save_path)
+        try:
+            method = blob_store.link_into(digest, temp_path)
+            mtime_ns = file_info.get("mtime_ns")
+            policy = "overwrite" if file_info.get("replace") else None
+            save_path = finalizer.commit(temp_path, save_path, mtime_ns, digest=digest, policy=policy) or save_path
+            finalizer.flush()
+        except Exception as e:
+            finalizer.discard(temp_path)
+            print(f"Impossibile collegare {file_info['filename']} dall'archivio: {e}")
+            return False
+        client_socket.send("HAVE".encode())
+        
+        metrics.inc("zapshare_dedup_hits_total")
+        metrics.inc("zapshare_dedup_bytes_saved_total", file_info["filesize"])
+        metrics.inc("zapshare_files_received_total")
+        print(f"File ricevuto: {file_info['filename']} da {sender_ip} (già presente, {method})")
+        
+        transfer_info = {
+            "filename": file_info["filename"],
+            "filesize": file_info["filesize"],
+            "sender_ip": sender_ip,
+            "save_path": save_path
+        }
+        for callback in self.transfer_callbacks:
+            try:
+                callback(transfer_info)
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+        return True
     
-    def start(self):
+    def start(self, block=True):
+        """Avvia il receiver.
+        
+        I socket vengono collegati subito, così un errore di bind è visibile al
+        chiamante. Con block=False il metodo ritorna appena i servizi sono attivi.
+        """
+        if self.running:
+            return True
+        
+        # Crea il socket principale per la ricezione dei file e quelli di discovery
+        server_socket = None
+        if self.serve_transfers:
+            try:
+                server_socket = self._bind_server_socket()
+                server_socket.listen(5)
+            except Exception as e:
+                print(f"Errore nell'avvio del server: {e}")
+                return False
+            self.dual_stack = server_socket.family == socket.AF_INET6
+        
+        discovery_sockets = []
+        if self.serve_discovery:
+            try:
+                discovery_sockets.append(self._bind_socket(socket.SOCK_DGRAM, self.discovery_port))
+            except Exception as e:
+                print(f"Impossibile avviare il servizio di discovery: {e}")
+            if socket.has_ipv6:
+                try:
+                    discovery_sockets.append(self._bind_discovery6_socket())
+                except Exception as e:
+                    print(f"Discovery IPv6 non disponibile: {e}")
+        
+        self._server_socket = server_socket
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
         self.running = True
-        self.register_device()
+        if self.serve_discovery:
+            self.register_device()
+        self.config_service.subscribe(self.on_config_changed)
+        inventory.subscribe(self.invalidate_discovery_response)
+        self.invalidate_discovery_response()
+        
+        self.start_http_gateway()
         
         # Avvia il thread per il servizio di discovery
-        discovery_thread = threading.Thread(target=self.start_discovery_service)
-        discovery_thread.daemon = True
-        discovery_thread.start()
+        if discovery_sockets:
+            self._discovery_thread = threading.Thread(
+                target=self.start_discovery_service,
+                args=(discovery_sockets,)
+            )
+            self._discovery_thread.daemon = True
+            self._discovery_thread.start()
+        
+        print(f"Receiver avviato su {self.ip}:{self.port}")
+        print(f"Nome computer: {self.config['computer_name']}")
+        print(f"Cartella di ricezione: {self.config['receive_directory']}")
+        networks = ", ".join(i["network"] for i in inventory.interfaces())
+        print(f"Reti locali: {networks or 'nessuna'}")
         
-        # Crea il socket principale per la ricezione dei file
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if server_socket is not None:
+            self._accept_thread = threading.Thread(target=self._accept_loop, args=(server_socket,))
+            self._accept_thread.daemon = True
+            self._accept_thread.start()
         
+        if block:
+            self.wait()
+        return True
+    
+    def _accept_loop(self, server_socket):
         try:
-            server_socket.bind(('', self.port))
-            server_socket.listen(5)
-            print(f"Receiver avviato su {self.ip}:{self.port}")
-            print(f"Nome computer: {self.config['computer_name']}")
-            print(f"Cartella di ricezione: {self.config['receive_directory']}")
-            print(f"Configurato per la rete 192.168.1.x")
-            
             while self.running:
                 try:
+                    if self._wait_readable(server_socket) is None:
+                        break
                     client_socket, client_address = server_socket.accept()
                     # Avvia un thread per gestire la ricezione del file
                     client_thread = threading.Thread(
-                        target=self.receive_file,
+                        target=self._handle_client,
                         args=(client_socket, client_address)
                     )
                     client_thread.daemon = True
+                    with self._active_lock:
+                        self._active[client_socket] = client_thread
                     client_thread.start()
                 except Exception as e:
                     if self.running:
                         print(f"Errore nella connessione: {e}")
-        except Exception as e:
-            print(f"Errore nell'avvio del server: {e}")
         finally:
             server_socket.close()
     
-    def stop(self):
+    def _handle_client(self, client_socket, client_address):
+        try:
+            self.receive_file(client_socket, client_address)
+        finally:
+            # Il socket può essere stato sostituito da quello TLS
+            current = threading.current_thread()
+            with self._active_lock:
+                for sock in [s for s, t in self._active.items() if t is current]:
+                    del self._active[sock]
+    
+    def _replace_active(self, old_socket, new_socket):
+        """Registra il socket TLS al posto di quello TCP, così stop() può interromperlo"""
+        with self._active_lock:
+            thread = self._active.pop(old_socket, None)
+            if thread is not None:
+                self._active[new_socket] = thread
+    
+    def active_transfers(self):
+        """Numero di trasferimenti in corso"""
+        with self._active_lock:
+            return len(self._active)
+    
+    def wait(self, timeout=None):
+        """Attende la terminazione del receiver; restituisce True se è terminato"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in (self._accept_thread, self._discovery_thread):
+            if thread is None:
+                continue
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            thread.join(remaining)
+            if thread.is_alive():
+                return False
+        return True
+    
+    def stop(self, timeout=None):
+        """Ferma il receiver: chiude subito i socket in ascolto e attende i
+        trasferimenti in corso fino alla scadenza, poi li interrompe."""
+        if timeout is None:
+            timeout = self.drain_timeout
+        was_running = self.running
         self.running = False
-        print("Receiver arrestato")
+        self.config_service.unsubscribe(self.on_config_changed)
+        inventory.unsubscribe(self.invalidate_discovery_response)
+        
+        # Sveglia i thread bloccati in select()
+        if self._wakeup_w is not None:
+            try:
+                self._wakeup_w.send(b'x')
+            except OSError:
+                pass
+        
+        if self.http_gateway is not None:
+            self.http_gateway.stop()
+            self.http_gateway = None
+        
+        # I socket in ascolto vengono chiusi dai rispettivi thread: un riavvio
+        # può ricollegare subito le porte 9999/9998
+        self.wait(timeout=1.0)
+        
+        # Attende i trasferimenti in corso entro la scadenza
+        deadline = time.monotonic() + timeout
+        with self._active_lock:
+            active = list(self._active.items())
+        for client_socket, thread in active:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        
+        # Interrompe i trasferimenti ancora attivi
+        with self._active_lock:
+            leftover = list(self._active.keys())
+        for client_socket in leftover:
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if leftover:
+            print(f"Interrotti {len(leftover)} trasferimenti ancora in corso")
+        
+        for sock in (self._wakeup_r, self._wakeup_w):
+            if sock is not None:
+                sock.close()
+        self._wakeup_r = self._wakeup_w = None
+        
+        if was_running:
+            print("Receiver arrestato")
 
 if __name__ == "__main__":
     receiver = Receiver()
@@ -0,0 +1,213 @@
+import os
+import time
+import socket
+import threading
+import multiprocessing
+import queue
+
+from ConfigService import get_config_service
+from Receiver import Receiver
+
+
+def _worker_main(index, config_file, port, events, control, multipath, multipath_lock):
+    """Processo di lavoro: riceve i file sulla porta condivisa con SO_REUSEPORT"""
+    receiver = Receiver(get_config_service(config_file))
+    receiver.port = port
+    receiver.reuse_port = True
+    receiver.serve_discovery = False
+    receiver.serve_http = False  # Il gateway HTTP resta nel supervisore
+    # I flussi multipath di uno stesso file possono arrivare a worker diversi
+    receiver._multipath = multipath
+    receiver._multipath_lock = multipath_lock
+    receiver.add_transfer_callback(lambda info: events.put(("transfer", index, info)))
+
+    if not receiver.start(block=False):
+        events.put(("failed", index, None))
+        return
+    events.put(("ready", index, {"dual_stack": receiver.dual_stack}))
+
+    try:
+        while True:
+            message = control.get()
+            if message == "reload":
+                receiver.config_service.reload()
+            elif message == "stop":
+                break
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        receiver.stop()
+
+
+class ReceiverPool:
+    """Receiver multi-processo.
+
+    N processi di lavoro ascoltano sulla stessa porta con SO_REUSEPORT e il
+    kernel distribuisce tra loro le connessioni in arrivo, così la ricezione
+    di più peer contemporanei non è limitata dal GIL di un solo processo.
+    Il supervisore (questo processo) gestisce discovery e configurazione e
+    riceve dai worker gli eventi dei trasferimenti completati.
+    """
+
+    def __init__(self, config_service=None, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        # Receiver del supervisore: solo discovery (e creazione del certificato TLS)
+        self.receiver = Receiver(config_service)
+        self.receiver.serve_transfers = False
+        self.config_service = self.receiver.config_service
+        self.transfer_callbacks = []
+        self.start_timeout = 30
+        self.running = False
+        self._context = multiprocessing.get_context("spawn")
+        self._manager = None
+        self._multipath = None
+        self._multipath_lock = None
+        self._processes = []
+        self._controls = []
+        self._events = None
+        self._event_thread = None
+
+    @property
+    def port(self):
+        return self.receiver.port
+
+    @port.setter
+    def port(self, value):
+        self.receiver.port = value
+
+    @property
+    def ip(self):
+        return self.receiver.ip
+
+    def add_transfer_callback(self, callback):
+        """Aggiunge una funzione di callback da chiamare quando un file viene ricevuto (da qualsiasi worker)"""
+        self.transfer_callbacks.append(callback)
+
+    def start(self, block=True):
+        """Avvia i worker e poi la discovery; restituisce False se un worker non parte"""
+        if self.running:
+            return True
+        if not hasattr(socket, "SO_REUSEPORT"):
+            # Senza SO_REUSEPORT (es. Windows) si usa il receiver a processo singolo
+            print("SO_REUSEPORT non supportato: avvio del receiver a processo singolo")
+            self.receiver.serve_transfers = True
+            self.receiver.transfer_callbacks = self.transfer_callbacks
+            self.running = self.receiver.start(block=False)
+            if self.running and block:
+                self.receiver.wait()
+            return self.running
+
+        config_file = self.config_service.config_file
+        # Registro multipath condiviso (i riferimenti restano qui: il manager li
+        # libera quando il supervisore non li usa più)
+        self._manager = self._context.Manager()
+        self._multipath = self._manager.dict()
+        self._multipath_lock = self._manager.Lock()
+        self._events = self._context.Queue()
+
+        for index in range(self.workers):
+            control = self._context.Queue()
+            process = self._context.Process(
+                target=_worker_main,
+                args=(index, config_file, self.port, self._events, control, self._multipath, self._multipath_lock),
+                name=f"zapshare-receiver-{index}"
+            )
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+            self._controls.append(control)
+
+        # Attende che tutti i worker siano in ascolto
+        ready = 0
+        deadline = time.monotonic() + self.start_timeout
+        while ready < self.workers:
+            try:
+                kind, index, data = self._events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                print("Timeout nell'avvio dei worker del receiver")
+                self._shutdown_workers(0)
+                return False
+            if kind == "failed":
+                print(f"Impossibile avviare il worker {index} del receiver")
+                self._shutdown_workers(0)
+                return False
+            if kind == "ready":
+                ready += 1
+                self.receiver.dual_stack = data["dual_stack"]
+
+        self.running = True
+        self._event_thread = threading.Thread(target=self._dispatch_events)
+        self._event_thread.daemon = True
+        self._event_thread.start()
+        self.config_service.subscribe(self.on_config_changed)
+
+        if not self.receiver.start(block=False):
+            self.stop()
+            return False
+        print(f"Receiver avviato con {self.workers} processi sulla porta {self.port}")
+
+        if block:
+            self.wait()
+        return True
+
+    def on_config_changed(self, changes):
+        """Il file è già stato salvato dal supervisore: i worker lo rileggono"""
+        for control in self._controls:
+            control.put("reload")
+
+    def _dispatch_events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                break
+            kind, index, data = event
+            if kind != "transfer":
+                continue
+            for callback in self.transfer_callbacks:
+                try:
+                    callback(data)
+                except Exception as e:
+                    print(f"Errore nella callback: {e}")
+
+    def wait(self, timeout=None):
+        """Attende la terminazione dei worker; restituisce True se sono terminati"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for process in self._processes:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            process.join(remaining)
+            if process.is_alive():
+                return False
+        return True
+
+    def stop(self, timeout=None):
+        """Ferma discovery e worker (ognuno completa o interrompe i propri trasferimenti)"""
+        if timeout is None:
+            timeout = self.receiver.drain_timeout
+        self.config_service.unsubscribe(self.on_config_changed)
+        if self.receiver.serve_transfers:
+            # Modalità a processo singolo
+            self.receiver.stop(timeout)
+        else:
+            self.receiver.stop(timeout=0)
+            self._shutdown_workers(timeout)
+        self.running = False
+
+    def _shutdown_workers(self, timeout):
+        for control in self._controls:
+            control.put("stop")
+        # Margine per la chiusura dei worker dopo l'attesa dei trasferimenti
+        self.wait(timeout + 2.0)
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+                process.join(1.0)
+        if self._event_thread is not None:
+            self._events.put(None)
+            self._event_thread.join(1.0)
+            self._event_thread = None
+        if self._manager is not None:
+            self._multipath = self._multipath_lock = None
+            self._manager.shutdown()
+            self._manager = None
+        self._processes = []
+        self._controls = []
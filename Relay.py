@@ -0,0 +1,147 @@
+import time
+import select
+
+from Stream import send_chunk, end_stream
+from Sync import send_json, recv_json
+
+# Intervallo minimo tra due messaggi di avanzamento di uno stesso nodo
+RELAY_PROGRESS_INTERVAL = 0.25
+
+# Attesa massima di un messaggio dai nodi successivi dopo la fine dei dati
+RELAY_TIMEOUT = 60
+
+
+def build_tree(devices, fanout=1):
+    """Albero di distribuzione: ogni nodo inoltra a `fanout` dispositivi.
+
+    Con fanout=1 è una catena (il caso migliore se il collo di bottiglia è
+    la banda in uscita di ogni nodo). L'albero è un heap: il mittente è il
+    nodo 0 e i figli del nodo i sono i nodi i*fanout+1 ... i*fanout+fanout.
+    Restituisce i sottoalberi collegati direttamente al mittente.
+    """
+    fanout = max(1, fanout)
+    nodes = [None] + [{"device": device, "children": []} for device in devices]
+    for index in range(1, len(nodes)):
+        parent = (index - 1) // fanout
+        if parent:
+            nodes[parent]["children"].append(nodes[index])
+    return nodes[1:1 + fanout]
+
+
+def subtree_devices(subtree):
+    """Tutti i dispositivi di un sottoalbero, radice compresa"""
+    devices = [subtree["device"]]
+    for child in subtree["children"]:
+        devices.extend(subtree_devices(child))
+    return devices
+
+
+def node_message(device, status, bytes_done=0, error=None):
+    """Messaggio di stato di un nodo, inoltrato fino al mittente.
+    "node_id" identifica il nodo (i nomi possono ripetersi), "node" è il nome da mostrare"""
+    message = {"node_id": device.get("node_id"), "node": device["name"], "ip": device["ip"],
+               "status": status, "bytes": bytes_done}
+    if error is not None:
+        message["error"] = str(error)
+    return message
+
+
+class _Hop:
+    def __init__(self, sock, subtree):
+        self.sock = sock
+        self.subtree = subtree
+        self.finished = set()  # Nodi del sottoalbero che hanno già inviato l'esito finale
+
+    def pending(self):
+        # I dati già decifrati da un socket TLS non risultano leggibili per select()
+        pending = getattr(self.sock, "pending", None)
+        return bool(pending and pending())
+
+
+class RelayFanout:
+    """Collegamenti verso i nodi successivi di una distribuzione a catena/albero.
+
+    I dati vanno verso i figli, i messaggi di stato risalgono verso il
+    mittente. Tutto avviene nel thread del chiamante (un socket TLS non può
+    essere letto e scritto da thread diversi): poll() va chiamata tra un
+    blocco e l'altro e ogni messaggio ricevuto viene passato a on_message.
+    """
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.hops = []
+
+    def add(self, sock, subtree):
+        self.hops.append(_Hop(sock, subtree))
+
+    def fail(self, subtree, error, finished=()):
+        """Segnala come falliti i nodi del sottoalbero che non hanno ancora un esito"""
+        for device in subtree_devices(subtree):
+            if device.get("node_id") not in finished:
+                self.on_message(node_message(device, "failed", error=error))
+
+    def _drop(self, hop, error):
+        try:
+            hop.sock.close()
+        except OSError:
+            pass
+        self.hops.remove(hop)
+        self.fail(hop.subtree, error, hop.finished)
+
+    def abort(self, error, notify=True):
+        """Chiude tutti i collegamenti e segnala come falliti i nodi senza esito.
+        I socket vengono chiusi prima delle segnalazioni, che possono fallire."""
+        hops, self.hops = self.hops, []
+        for hop in hops:
+            try:
+                hop.sock.close()
+            except OSError:
+                pass
+        if notify:
+            for hop in hops:
+                self.fail(hop.subtree, error, hop.finished)
+
+    def send(self, data):
+        for hop in list(self.hops):
+            try:
+                send_chunk(hop.sock, data)
+            except OSError as e:
+                self._drop(hop, e)
+
+    def end(self, trailer):
+        for hop in list(self.hops):
+            try:
+                end_stream(hop.sock)
+                send_json(hop.sock, trailer)
+            except OSError as e:
+                self._drop(hop, e)
+
+    def poll(self, timeout=0.0):
+        """Inoltra i messaggi disponibili; restituisce quanti ne sono arrivati"""
+        if not self.hops:
+            return 0
+        ready = [hop for hop in self.hops if hop.pending()]
+        if not ready:
+            readable, _, _ = select.select([hop.sock for hop in self.hops], [], [], timeout)
+            ready = [hop for hop in self.hops if hop.sock in readable]
+        for hop in ready:
+            try:
+                message = recv_json(hop.sock)
+            except (OSError, ValueError) as e:
+                # Chiusura normale dopo gli esiti di tutto il sottoalbero, altrimenti errore
+                self._drop(hop, e)
+                continue
+            if message.get("status") in ("ok", "failed"):
+                hop.finished.add(message.get("node_id"))
+            self.on_message(message)
+        return len(ready)
+
+    def wait(self, timeout=RELAY_TIMEOUT):
+        """Attende che tutti i nodi successivi abbiano chiuso la connessione"""
+        deadline = time.monotonic() + timeout
+        while self.hops:
+            if self.poll(min(1.0, max(0.0, deadline - time.monotonic()))):
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() >= deadline:
+                for hop in list(self.hops):
+                    self._drop(hop, "timeout")
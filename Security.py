@@ -0,0 +1,180 @@
+import os
+import ssl
+import socket
+import shutil
+import hashlib
+import threading
+import subprocess
+
+from Metrics import metrics
+from ConfigService import user_data_dir
+
+CERT_FILE = "zapshare_cert.pem"
+KEY_FILE = "zapshare_key.pem"
+
+# Primo byte di un ClientHello TLS (record di tipo handshake): un header JSON inizia con "{"
+TLS_HANDSHAKE_RECORD = 0x16
+
+# Solo scambio di chiavi effimero e cifrari AEAD (AES-GCM usa AES-NI dove disponibile)
+TLS12_CIPHERS = "ECDHE+AESGCM:ECDHE+CHACHA20"
+
+
+class PinMismatchError(ssl.SSLError):
+    """Il certificato del dispositivo non corrisponde a quello memorizzato"""
+
+
+def fingerprint(der_certificate):
+    """Impronta SHA-256 di un certificato in formato DER"""
+    return hashlib.sha256(der_certificate).hexdigest()
+
+
+def identity_paths():
+    """Certificato e chiave privata, nella cartella dati dell'utente (non nella cartella corrente)"""
+    directory = user_data_dir()
+    return os.path.join(directory, CERT_FILE), os.path.join(directory, KEY_FILE)
+
+
+def ensure_identity(cert_file=None, key_file=None, common_name="zapshare"):
+    """Crea (una sola volta) il certificato autofirmato di questo dispositivo"""
+    if cert_file is None or key_file is None:
+        cert_file, key_file = identity_paths()
+        # Identità creata dalle versioni precedenti nella cartella corrente: si sposta,
+        # così le impronte già memorizzate dai sender restano valide
+        if not os.path.exists(cert_file) and os.path.exists(CERT_FILE) and os.path.exists(KEY_FILE):
+            shutil.move(KEY_FILE, key_file)
+            shutil.move(CERT_FILE, cert_file)
+    if os.path.exists(cert_file) and os.path.exists(key_file):
+        os.chmod(key_file, 0o600)
+        return cert_file, key_file
+    try:
+        _generate_with_cryptography(cert_file, key_file, common_name)
+    except ImportError:
+        _generate_with_openssl(cert_file, key_file, common_name)
+    return cert_file, key_file
+
+
+def _generate_with_cryptography(cert_file, key_file, common_name):
+    import datetime
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=3650))
+        .sign(key, hashes.SHA256())
+    )
+    _write_private(key_file, key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ))
+    with open(cert_file, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+
+
+def _generate_with_openssl(cert_file, key_file, common_name):
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+         "-nodes", "-keyout", key_file, "-out", cert_file, "-days", "3650", "-subj", f"/CN={common_name}"],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    os.chmod(key_file, 0o600)
+
+
+def _write_private(path, data):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+
+def server_context(cert_file, key_file):
+    """Contesto TLS del receiver (emette i ticket di sessione per la ripresa)"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.set_ciphers(TLS12_CIPHERS)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def is_tls_hello(sock):
+    """Guarda (senza consumarlo) il primo byte della connessione"""
+    first = sock.recv(1, socket.MSG_PEEK)
+    return bool(first) and first[0] == TLS_HANDSHAKE_RECORD
+
+
+class _ResumableSocket(ssl.SSLSocket):
+    # In TLS 1.3 il ticket arriva dopo l'handshake: la sessione si salva alla chiusura
+    on_close = None
+
+    def close(self):
+        if self.on_close is not None and self._sslobj is not None:
+            try:
+                self.on_close(self.session)
+            except Exception:
+                pass
+            self.on_close = None
+        super().close()
+
+
+class TLSConnector:
+    """Connessioni TLS verso i dispositivi.
+
+    I certificati sono autofirmati: al primo contatto si memorizza l'impronta
+    del dispositivo (trust on first use), ai successivi deve coincidere.
+    Le sessioni vengono riprese, così i trasferimenti brevi non pagano un
+    handshake completo.
+    """
+
+    def __init__(self):
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.context.set_ciphers(TLS12_CIPHERS)
+        # L'identità è verificata con l'impronta memorizzata, non con una CA
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_NONE
+        self.context.sslsocket_class = _ResumableSocket
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, sock, key, pinned=None, on_pin=None):
+        """Esegue l'handshake e verifica l'impronta; restituisce il socket cifrato.
+
+        key identifica il dispositivo (per le sessioni), pinned è l'impronta
+        memorizzata e on_pin(impronta) viene chiamata al primo contatto.
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+        try:
+            tls_socket = self.context.wrap_socket(sock, session=session)
+        except ssl.SSLError:
+            # Una sessione scaduta o rifiutata non deve impedire la connessione
+            with self._lock:
+                self._sessions.pop(key, None)
+            raise
+
+        peer = fingerprint(tls_socket.getpeercert(binary_form=True))
+        if pinned and peer != pinned:
+            tls_socket.close()
+            metrics.inc("zapshare_tls_pin_failures_total")
+            raise PinMismatchError(f"Il certificato di {key} è cambiato (impronta {peer[:16]}...)")
+        if not pinned and on_pin:
+            on_pin(peer)
+
+        tls_socket.on_close = lambda new_session: self._remember(key, new_session)
+        metrics.inc("zapshare_tls_handshakes_total", resumed="true" if tls_socket.session_reused else "false")
+        return tls_socket
+
+    def _remember(self, key, session):
+        if session is not None:
+            with self._lock:
+                self._sessions[key] = session
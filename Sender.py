@@ -3,242 +3,112 @@ import json
 import os
 import sys
 import time
-import re
+import logging
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import tkinter as tk
 from tkinter import messagebox
 
+from Metrics import metrics
+from Archive import SMALL_FILE_LIMIT, iter_pack
+from Sparse import EXTENT, find_data_extents, recv_exact
+from NetInterfaces import inventory, normalize_ip, DISCOVERY_GROUP6
+from Connection import connect_fastest, device_addresses
+from Multipath import StripeScheduler, pair_paths
+from HashCache import get_hash_cache
+from Sync import ManifestStore, build_manifest, diff_manifests, send_json, recv_json
+from Security import TLSConnector
+from Pipeline import FRAME, get_pipeline
+from Discovery import DISCOVERY_REQUEST, DISCOVERY_REQUEST_COMPACT, decode_response
+from Stream import iter_chunks, send_chunk, end_stream
+from Relay import RelayFanout, RELAY_TIMEOUT, build_tree
+from Swarm import SWARM_TIMEOUT, END_OF_PIECES, build_meta, send_piece
+from Mux import MuxSession
+from UdpBulk import UdpSender, UDP_PAYLOAD_SIZE, UDP_TIMEOUT, open_udp_socket
+
+logger = logging.getLogger("zapshare")
+
+# Selezione automatica del trasporto UDP: file grandi verso dispositivi lontani
+UDP_AUTO_RTT_MS = 30
+UDP_AUTO_MIN_SIZE = 16 * 1024 * 1024
+
 class Sender:
-    def __init__(self):
+    def __init__(self, config_service=None):
         self.host = socket.gethostname()
         
-        # Ottieni specificamente un indirizzo IP sulla rete 192.168.1.x
+        # Indirizzo IP sulla LAN
         self.ip = self.get_lan_ip()
         
         self.buffer_size = 4096
+        self.sparse_transfers = True  # Invia solo le regioni con dati dei file sparsi
+        self.multipath_stripe_size = 1024 * 1024
+        self.include_digest = False  # Invia lo SHA-256 del file (verifica di integrità e deduplicazione)
+        self.compress_transfers = False  # Compressione zlib a blocchi (utile per dati comprimibili)
+        self.pipeline_workers = None  # Processi/thread per gli stadi CPU (None = numero di core)
+        self.pipeline_mode = "thread"  # "thread" (zlib/hashlib rilasciano il GIL) oppure "process"
+        self.encrypt_transfers = False  # TLS verso il receiver, con impronta memorizzata al primo contatto
+        # Trasporto UDP per i file: "never", "auto" (RTT alto) o "always". Solo su richiesta:
+        # un receiver che non conosce il tipo "udp" rifiuterebbe il trasferimento
+        self.udp_transfers = "never"
+        self.rtt_ms = {}  # IP del dispositivo -> RTT dell'ultima connessione (solo in memoria)
+        self.tls = TLSConnector()
         self.devices_file = "zapshare_devices.json"
+        self.manifest_store = ManifestStore("zapshare_sync_cache.json")
         self.devices = self.load_devices()
         self.transfer_callbacks = []
         
+        # Configurazione condivisa (opzionale) per i parametri modificabili a caldo
+        self.config_service = config_service
+        if self.config_service:
+            self.buffer_size = self.config_service.get("buffer_size", self.buffer_size)
+            self.encrypt_transfers = self.config_service.get("encrypt_transfers", self.encrypt_transfers)
+            self.compress_transfers = self.config_service.get("compress_transfers", self.compress_transfers)
+            self.udp_transfers = self.config_service.get("udp_transfers", self.udp_transfers)
+            self.config_service.subscribe(self.on_config_changed)
+        
         print(f"Sender inizializzato con IP: {self.ip}")
     
+    def on_config_changed(self, changes):
+        """Applica le impostazioni modificate nella configurazione condivisa"""
+        if "buffer_size" in changes:
+            self.buffer_size = int(changes["buffer_size"])
+        if "encrypt_transfers" in changes:
+            self.encrypt_transfers = bool(changes["encrypt_transfers"])
+        if "compress_transfers" in changes:
+            self.compress_transfers = bool(changes["compress_transfers"])
+        if "udp_transfers" in changes:
+            self.udp_transfers = changes["udp_transfers"]
+    
     def get_lan_ip(self):
-        """Ottiene specificamente un indirizzo IP sulla rete 192.168.1.x"""
-        # Prova a trovare l'indirizzo specifico per la rete 192.168.1.x
-        try:
-            # Metodo 1: socket temporaneo
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            try:
-                # Non ha bisogno di essere raggiungibile
-                s.connect(('10.255.255.255', 1))
-                ip = s.getsockname()[0]
-                # Controlla se l'IP è nella rete 192.168.1.x
-                if ip.startswith('192.168.1.'):
-                    return ip
-            except Exception:
-                pass
-            finally:
-                s.close()
-            
-            # Metodo 2: ottieni tutti gli IP
-            hostname = socket.gethostname()
-            ip_list = socket.gethostbyname_ex(hostname)[2]
-            
-            # Filtra per trovare un indirizzo 192.168.1.x
-            for ip in ip_list:
-                if ip.startswith('192.168.1.'):
-                    return ip
-            
-            # Se non troviamo un IP specifico 192.168.1.x, proviamo a prendere qualsiasi IP nella classe 192.168
-            for ip in ip_list:
-                if ip.startswith('192.168.'):
-                    print(f"Attenzione: non trovato IP nella rete 192.168.1.x, utilizzo {ip}")
-                    return ip
-            
-            # Ultima risorsa: usa qualsiasi IP non locale
-            for ip in ip_list:
-                if not ip.startswith('127.') and not ip.startswith('169.254.'):
-                    print(f"Attenzione: utilizzo IP alternativo: {ip}")
-                    return ip
-            
-            # Se tutto fallisce, usa l'IP generico
-            return socket.gethostbyname(hostname)
-            
-        except Exception as e:
-            print(f"Errore nell'ottenere l'IP LAN: {e}")
-            # Fallback: IP generico
-            return socket.gethostbyname(socket.gethostname())
+        """Ottiene l'indirizzo IP usato per raggiungere la LAN"""
+        return inventory.primary_ip()
     
     def get_network_interfaces(self):
-        """Ottiene informazioni sulle interfacce di rete, con priorità per la rete 192.168.1.x"""
-        interfaces = []
-        
-        try:
-            # Su Windows
-            if sys.platform == 'win32':
-                # Ottieni tutti gli indirizzi IP associati all'hostname
-                hostname = socket.gethostname()
-                ip_list = socket.gethostbyname_ex(hostname)[2]
-                
-                # Filtra per prioritizzare 192.168.1.x
-                primary_ips = [ip for ip in ip_list if ip.startswith('192.168.1.')]
-                
-                # Se non troviamo IP nella rete 192.168.1.x, prendi qualsiasi nella 192.168.x.x
-                if not primary_ips:
-                    primary_ips = [ip for ip in ip_list if ip.startswith('192.168.')]
-                
-                # Se ancora non troviamo, prendi qualsiasi IP non locale
-                if not primary_ips:
-                    primary_ips = [ip for ip in ip_list if not ip.startswith('127.') and not ip.startswith('169.254.')]
-                
-                # Se abbiamo trovato almeno un IP valido
-                if primary_ips:
-                    for ip in primary_ips:
-                        # Calcola l'indirizzo broadcast
-                        ip_parts = ip.split('.')
-                        broadcast = f"{ip_parts[0]}.{ip_parts[1]}.{ip_parts[2]}.255"
-                        
-                        interfaces.append({
-                            "name": f"interface-{len(interfaces)+1}",
-                            "ip": ip,
-                            "netmask": "255.255.255.0",
-                            "broadcast": broadcast
-                        })
-                        
-                        print(f"Trovata interfaccia: {ip} (broadcast: {broadcast})")
-                else:
-                    # Ultima risorsa, crea un socket specifico
-                    temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    try:
-                        temp_socket.connect(('10.255.255.255', 1))
-                        ip = temp_socket.getsockname()[0]
-                        
-                        # Ottieni il broadcast address
-                        ip_parts = ip.split('.')
-                        broadcast = f"{ip_parts[0]}.{ip_parts[1]}.{ip_parts[2]}.255"
-                        
-                        interfaces.append({
-                            "name": "default",
-                            "ip": ip,
-                            "netmask": "255.255.255.0",
-                            "broadcast": broadcast
-                        })
-                        
-                        print(f"Interfaccia di fallback: {ip} (broadcast: {broadcast})")
-                    except Exception as e:
-                        print(f"Errore nella connessione di test: {e}")
-                    finally:
-                        temp_socket.close()
-            
-            # Per sistemi Unix
-            else:
-                try:
-                    import netifaces
-                    
-                    for interface in netifaces.interfaces():
-                        addrs = netifaces.ifaddresses(interface)
-                        
-                        if netifaces.AF_INET in addrs:
-                            for addr in addrs[netifaces.AF_INET]:
-                                if 'addr' in addr and 'netmask' in addr:
-                                    ip = addr['addr']
-                                    netmask = addr['netmask']
-                                    
-                                    # Ignora localhost e link-local, priorità alla rete 192.168.1.x
-                                    if ip.startswith('127.') or ip.startswith('169.254.'):
-                                        continue
-                                    
-                                    # Priorità alta per 192.168.1.x
-                                    priority = 1 if ip.startswith('192.168.1.') else 2
-                                    
-                                    # Calcola broadcast se non esiste
-                                    broadcast = addr.get('broadcast')
-                                    if not broadcast:
-                                        ip_parts = [int(part) for part in ip.split('.')]
-                                        mask_parts = [int(part) for part in netmask.split('.')]
-                                        broadcast_parts = []
-                                        
-                                        for i in range(4):
-                                            broadcast_part = (ip_parts[i] & mask_parts[i]) | (~mask_parts[i] & 255)
-                                            broadcast_parts.append(str(broadcast_part))
-                                        
-                                        broadcast = '.'.join(broadcast_parts)
-                                    
-                                    interfaces.append({
-                                        "name": interface,
-                                        "ip": ip,
-                                        "netmask": netmask,
-                                        "broadcast": broadcast,
-                                        "priority": priority
-                                    })
-                    
-                    # Ordina le interfacce per priorità (192.168.1.x prima)
-                    if interfaces:
-                        interfaces.sort(key=lambda x: x.get("priority", 99))
-                        # Rimuovi la chiave priority dopo l'ordinamento
-                        for interface in interfaces:
-                            if "priority" in interface:
-                                del interface["priority"]
-                
-                except ImportError:
-                    print("Il modulo netifaces non è installato. Utilizzo del metodo alternativo.")
-                    # Metodo alternativo semplificato per Unix
-                    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    try:
-                        s.connect(('10.255.255.255', 1))
-                        ip = s.getsockname()[0]
-                        
-                        # Priorità alla rete 192.168.1.x
-                        if not ip.startswith('192.168.1.'):
-                            # Prova a trovare interfacce specifiche
-                            try:
-                                import subprocess
-                                output = subprocess.check_output("ip addr show", shell=True).decode('utf-8')
-                                for line in output.split('\n'):
-                                    if '192.168.1.' in line:
-                                        match = re.search(r'inet (192\.168\.1\.[0-9]+)', line)
-                                        if match:
-                                            ip = match.group(1)
-                                            break
-                            except Exception:
-                                pass
-                        
-                        interfaces.append({
-                            "name": "default",
-                            "ip": ip,
-                            "netmask": "255.255.255.0",
-                            "broadcast": ip.rsplit('.', 1)[0] + '.255'
-                        })
-                    except Exception:
-                        pass
-                    finally:
-                        s.close()
-        
-        except Exception as e:
-            print(f"Errore nel recupero delle interfacce di rete: {e}")
-        
-        # Filtra le interfacce per prioritizzare 192.168.1.x
-        filtered_interfaces = [i for i in interfaces if i["ip"].startswith('192.168.1.')]
-        
-        # Se non abbiamo trovato interfacce nella sottorete 192.168.1.x, usa tutte le interfacce disponibili
-        if not filtered_interfaces:
-            print("Attenzione: nessuna interfaccia trovata nella sottorete 192.168.1.x")
-            return interfaces
-        
-        return filtered_interfaces
+        """Interfacce di rete locali (dall'inventario condiviso, in cache)"""
+        interfaces = inventory.interfaces()
+        for interface in interfaces:
+            print(f"Trovata interfaccia: {interface['ip']}/{interface['prefixlen']} (broadcast: {interface['broadcast']})")
+        return interfaces
     
-    # Il resto del codice rimane invariato
     def discover_devices(self, callback=None):
         # Cerca dispositivi sulla rete
         print("Ricerca dispositivi in corso...")
+        span = metrics.span("discover")
         
         # Ottieni informazioni sulle interfacce di rete
-        interfaces = self.get_network_interfaces()
-        if not interfaces:
+        with span.stage("interfaces"):
+            interfaces = self.get_network_interfaces()
+            multicast_indexes = inventory.multicast_indexes() if socket.has_ipv6 else []
+        if not interfaces and not multicast_indexes:
             print("Nessuna interfaccia di rete valida trovata")
+            span.end("no_interfaces")
             return []
         
         discovered = []
+        local_ips = {i["ip"] for i in interfaces} | {i["ip"] for i in inventory.ipv6_addresses()}
         
         # Per ogni interfaccia valida
         for interface in interfaces:
@@ -251,47 +121,47 @@ class Sender:
             discovery_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             discovery_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
             discovery_socket.settimeout(3)  # Timeout di 3 secondi
+            scan_start = time.time()
             
             try:
-                # Invia richiesta di discovery all'indirizzo broadcast specifico
-                discovery_socket.sendto(b'DISCOVERY_REQUEST', (network_broadcast, 9998))
+                # Invia richiesta di discovery all'indirizzo broadcast specifico: compatta
+                # e JSON, per i receiver precedenti al formato compatto. Le reti vengono
+                # scandite una per volta (3 s ciascuna), quindi un receiver riceve al
+                # massimo 2 richieste per scansione da questo IP, sotto il burst del limite
+                discovery_socket.sendto(DISCOVERY_REQUEST_COMPACT, (network_broadcast, 9998))
+                discovery_socket.sendto(DISCOVERY_REQUEST, (network_broadcast, 9998))
+                metrics.inc("zapshare_discovery_requests_sent_total", 2)
                 
                 # Raccoglie le risposte
-                start_time = time.time()
-                
-                while time.time() - start_time < 3:  # Aspetta risposte per 3 secondi
-                    try:
-                        data, addr = discovery_socket.recvfrom(1024)
-                        device_info = json.loads(data.decode())
-                        
-                        # Verifica che il dispositivo sia nella rete 192.168.1.x
-                        if not device_info["ip"].startswith('192.168.1.'):
-                            print(f"Ignorato dispositivo non nella rete 192.168.1.x: {device_info['ip']}")
-                            continue
-                        
-                        # Verifica se il dispositivo è già nell'elenco
-                        already_exists = False
-                        for device in discovered:
-                            if device["ip"] == device_info["ip"]:
-                                already_exists = True
-                                break
-                        
-                        if not already_exists and device_info["ip"] != network_ip:
-                            discovered.append(device_info)
-                            print(f"Trovato: {device_info['name']} ({device_info['ip']})")
-                            
-                            # Chiamata di callback per aggiornamento in tempo reale
-                            if callback:
-                                callback(device_info)
-                    except socket.timeout:
-                        pass
-                    except Exception as e:
-                        print(f"Errore durante la scoperta: {e}")
+                self._collect_responses(discovery_socket, discovered, local_ips, callback)
             
             except Exception as e:
                 print(f"Errore durante la ricerca sulla rete {network_ip}: {e}")
             finally:
                 discovery_socket.close()
+                span.add("collect", time.time() - scan_start)
+        
+        # Discovery IPv6: multicast link-local su ogni interfaccia (solo richiesta compatta:
+        # i receiver precedenti non ascoltavano su IPv6)
+        if multicast_indexes:
+            discovery_socket = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            discovery_socket.settimeout(3)
+            scan_start = time.time()
+            try:
+                for index in multicast_indexes:
+                    try:
+                        discovery_socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_IF, index)
+                        discovery_socket.sendto(DISCOVERY_REQUEST_COMPACT, (DISCOVERY_GROUP6, 9998, 0, index))
+                        metrics.inc("zapshare_discovery_requests_sent_total")
+                    except OSError as e:
+                        print(f"Errore nell'invio multicast IPv6 sull'interfaccia {index}: {e}")
+                
+                self._collect_responses(discovery_socket, discovered, local_ips, callback)
+            except Exception as e:
+                print(f"Errore durante la ricerca IPv6: {e}")
+            finally:
+                discovery_socket.close()
+                span.add("collect", time.time() - scan_start)
         
         # Aggiorna il file dei dispositivi
         existing_ips = [d["ip"] for d in self.devices["devices"]]
@@ -300,14 +170,61 @@ class Sender:
                 self.devices["devices"].append(device)
                 existing_ips.append(device["ip"])
             else:
-                # Aggiorna il nome del dispositivo se è cambiato
+                # Aggiorna nome e indirizzi del dispositivo se sono cambiati
                 for d in self.devices["devices"]:
                     if d["ip"] == device["ip"]:
                         d["name"] = device["name"]
+                        d["addresses"] = device.get("addresses", [])
         
         self.save_devices()
+        span.set(devices=len(discovered))
+        span.end()
         return discovered
     
+    def _collect_responses(self, discovery_socket, discovered, local_ips, callback, duration=3):
+        """Raccoglie le risposte di discovery per `duration` secondi"""
+        start_time = time.time()
+        
+        while time.time() - start_time < duration:
+            try:
+                data, addr = discovery_socket.recvfrom(1024)
+                device_info = decode_response(data)
+                
+                # L'indirizzo da cui arriva la risposta è sicuramente raggiungibile
+                source_ip = normalize_ip(addr[0])
+                if len(addr) == 4 and addr[3] and "%" not in source_ip:
+                    # Indirizzo link-local: serve lo scope (indice dell'interfaccia)
+                    source_ip = f"{source_ip}%{addr[3]}"
+                addresses = device_info.setdefault("addresses", [])
+                if source_ip not in addresses:
+                    addresses.append(source_ip)
+                
+                if device_info["ip"] in local_ips:
+                    continue
+                
+                # Verifica se il dispositivo è già nell'elenco
+                already_exists = False
+                for device in discovered:
+                    if device["ip"] == device_info["ip"]:
+                        already_exists = True
+                        for address in addresses:
+                            if address not in device["addresses"]:
+                                device["addresses"].append(address)
+                        break
+                
+                if not already_exists:
+                    discovered.append(device_info)
+                    metrics.inc("zapshare_discovery_devices_found_total")
+                    print(f"Trovato: {device_info['name']} ({', '.join(addresses)})")
+                    
+                    # Chiamata di callback per aggiornamento in tempo reale
+                    if callback:
+                        callback(device_info)
+            except socket.timeout:
+                pass
+            except Exception as e:
+                print(f"Errore durante la scoperta: {e}")
+    
     # Resto del codice rimane uguale
     def load_devices(self):
         """Carica la lista dei dispositivi conosciuti"""
@@ -346,8 +263,38 @@ class Sender:
         
         print()
     
-    def send_file(self, file_path, device_index, progress_callback=None):
-        """Invia un file al dispositivo specificato"""
+    def connect_device(self, device, timeout=10):
+        """Si connette al dispositivo provando in parallelo tutti i suoi indirizzi
+        (IPv4 e IPv6) e usando quello che risponde per primo"""
+        start = time.perf_counter()
+        client_socket, address = connect_fastest(device_addresses(device), device.get("port", 9999), timeout=timeout)
+        # Il tempo di connessione approssima l'RTT (per la scelta automatica del trasporto)
+        self.rtt_ms[device["ip"]] = round((time.perf_counter() - start) * 1000, 1)
+        client_socket.settimeout(timeout)
+        metrics.inc("zapshare_connections_total", family="ipv6" if ":" in address else "ipv4")
+        if address != device["ip"]:
+            print(f"Connesso a {device['name']} tramite {address}")
+        return self.secure_socket(client_socket, device)
+    
+    def secure_socket(self, client_socket, device):
+        """Cifra la connessione se richiesto (trust on first use del certificato)"""
+        if not self.encrypt_transfers:
+            return client_socket
+        
+        def pin(peer_fingerprint):
+            device["fingerprint"] = peer_fingerprint
+            self.save_devices()
+            print(f"Memorizzato il certificato di {device['name']}: {peer_fingerprint[:16]}...")
+        
+        return self.tls.wrap(client_socket, device["ip"], device.get("fingerprint"), pin)
+    
+    def send_file(self, file_path, device_index, progress_callback=None, remote_name=None, replace=False):
+        """Invia un file al dispositivo specificato.
+        
+        remote_name permette di indicare un percorso relativo (es. "cartella/file.txt")
+        con cui il file viene salvato dal receiver; con replace=True il file
+        esistente viene sempre sostituito (sincronizzazione delle cartelle).
+        """
         if not os.path.exists(file_path):
             print(f"Il file {file_path} non esiste")
             return False
@@ -358,53 +305,131 @@ class Sender:
         
         device = self.devices["devices"][device_index]
         
-        file_size = os.path.getsize(file_path)
-        file_name = os.path.basename(file_path)
+        file_stat = os.stat(file_path)
+        file_size = file_stat.st_size
+        file_name = remote_name or os.path.basename(file_path)
+        
+        # Trasporto UDP imposto: non serve misurare la connessione
+        if self.choose_transport(device, file_size) == "udp":
+            return self.send_file_udp(file_path, device_index, progress_callback, remote_name, replace)
         
         print(f"Invio di {file_name} ({file_size} bytes) a {device['name']} ({device['ip']})...")
         
         # Creazione socket
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.settimeout(10)  # Timeout di 10 secondi
+        client_socket = None
+        span = metrics.span("send", filename=file_name, filesize=file_size, peer=device["ip"])
         
         try:
             # Connessione al dispositivo
-            client_socket.connect((device["ip"], device.get("port", 9999)))
+            with span.stage("connect"):
+                client_socket = self.connect_device(device)
+            
+            # "auto": l'RTT appena misurato su questa connessione può far passare a UDP
+            if self.choose_transport(device, file_size, measured=True) == "udp":
+                span.end("udp")
+                return self.send_file_udp(file_path, device_index, progress_callback, remote_name, replace,
+                                          client_socket=client_socket)
             
             # Invio informazioni sul file
             file_info = {
                 "filename": file_name,
-                "filesize": file_size
+                "filesize": file_size,
+                "mtime_ns": file_stat.st_mtime_ns
             }
+            if replace:
+                file_info["replace"] = True
             
-            client_socket.send(json.dumps(file_info).encode())
+            # Hash per la verifica lato receiver (dalla cache se il file non è cambiato)
+            if self.include_digest:
+                with span.stage("digest"):
+                    file_info["sha256"] = get_hash_cache().digest(file_path)
             
-            # Attesa conferma
-            response = client_socket.recv(self.buffer_size).decode()
-            if response != "OK":
+            # File sparsi: si inviano solo le regioni con dati più la mappa dei buchi
+            extents = find_data_extents(file_path, file_size) if self.sparse_transfers else None
+            if extents is not None:
+                file_info["sparse"] = True
+                file_info["extents"] = len(extents)
+                data_size = sum(length for _, length in extents)
+                span.set(sparse=True, data_size=data_size)
+            else:
+                extents = [(0, file_size)]
+                data_size = file_size
+            sparse = file_info.get("sparse", False)
+            
+            # Compressione a blocchi, eseguita in parallelo dalla pipeline
+            if self.compress_transfers:
+                file_info["compression"] = "zlib"
+            
+            with span.stage("handshake"):
+                client_socket.send(json.dumps(file_info).encode())
+                
+                # Attesa conferma
+                response = client_socket.recv(self.buffer_size).decode()
+            if response not in ("OK", "HAVE"):
                 print(f"Errore nella conferma: {response}")
+                span.end("rejected")
                 return False
             
+            # "HAVE": il receiver ha già questo contenuto, non serve inviare dati
+            dedup = response == "HAVE"
+            if dedup:
+                extents = []
+            compressed = "compression" in file_info
+            
             # Invio del file
             bytes_sent = 0
+            timed = span.timed
+            verbose = logger.isEnabledFor(logging.DEBUG)
+            read_time = send_time = 0.0
             with open(file_path, 'rb') as f:
-                while bytes_sent < file_size:
-                    # Leggi un chunk di dati
-                    chunk = f.read(self.buffer_size)
-                    if not chunk:
-                        break
-                    
-                    # Invia il chunk
-                    client_socket.send(chunk)
-                    bytes_sent += len(chunk)
+                if compressed:
+                    bytes_sent = self._send_compressed(client_socket, f, extents, sparse, data_size, progress_callback)
+                else:
+                    for offset, length in extents:
+                        if sparse:
+                            client_socket.sendall(EXTENT.pack(offset, length))
+                            f.seek(offset)
                     
-                    # Aggiorna il progresso
-                    progress = int((bytes_sent / file_size) * 100)
-                    if progress_callback:
-                        progress_callback(progress)
+                        remaining = length
+                        while remaining > 0:
+                            # Leggi un chunk di dati
+                            if timed:
+                                t0 = time.perf_counter()
+                            chunk = f.read(min(self.buffer_size, remaining))
+                            if not chunk:
+                                break
+                        
+                            # Invia il chunk
+                            if timed:
+                                t1 = time.perf_counter()
+                                client_socket.sendall(chunk)
+                                read_time += t1 - t0
+                                send_time += time.perf_counter() - t1
+                            else:
+                                client_socket.sendall(chunk)
+                            remaining -= len(chunk)
+                            bytes_sent += len(chunk)
+                        
+                            # Aggiorna il progresso
+                            progress = int((bytes_sent / data_size) * 100) if data_size else 100
+                            if progress_callback:
+                                progress_callback(progress)
+                        
+                            # Aggiorna il terminale (solo in modalità debug)
+                            if verbose:
+                                print(f"\rInvio in corso: {progress}%", end="")
                     
-                    # Aggiorna il terminale
-                    print(f"\rInvio in corso: {progress}%", end="")
+                        if remaining > 0:
+                            raise IOError(f"Il file {file_path} è stato modificato durante l'invio")
+            
+            if sparse and not dedup:
+                metrics.inc("zapshare_sparse_bytes_skipped_total", file_size - data_size)
+            if compressed and not dedup:
+                metrics.inc("zapshare_compression_bytes_saved_total", data_size - bytes_sent)
+            span.add("disk_read", read_time)
+            span.add("socket_send", send_time)
+            metrics.inc("zapshare_bytes_sent_total", bytes_sent)
+            metrics.inc("zapshare_files_sent_total")
             
             print("\nInvio completato con successo!")
             
@@ -421,6 +446,8 @@ class Sender:
                 except Exception as e:
                     print(f"Errore nella callback: {e}")
             
+            client_socket.close()
+            span.end("dedup" if dedup else "ok")
             return True
             
         except ConnectionRefusedError:
@@ -430,6 +457,10 @@ class Sender:
         except Exception as e:
             print(f"Errore durante l'invio del file: {e}")
         
+        if client_socket:
+            client_socket.close()
+        span.end("failed")
+        
         # Se arriviamo qui, c'è stato un errore
         for callback in self.transfer_callbacks:
             try:
@@ -443,4 +474,942 @@ class Sender:
             except Exception as e:
                 print(f"Errore nella callback: {e}")
         
-        return False
\ No newline at end of file
+        return False
+    
+    def choose_transport(self, device, file_size, measured=False):
+        """"tcp" o "udp": il campo "transport" del dispositivo prevale sulla configurazione.
+        
+        "auto" usa l'RTT misurato dalla connessione appena aperta (measured=True):
+        senza misura si resta su TCP.
+        """
+        transport = device.get("transport")
+        if transport not in ("tcp", "udp"):
+            transport = "tcp"
+            if self.udp_transfers == "always":
+                transport = "udp"
+            elif (self.udp_transfers == "auto" and measured and file_size >= UDP_AUTO_MIN_SIZE
+                  and self.rtt_ms.get(device["ip"], 0) >= UDP_AUTO_RTT_MS):
+                transport = "udp"
+        if transport == "udp" and self.encrypt_transfers:
+            # I datagrammi non sono cifrati
+            return "tcp"
+        return transport
+    
+    def send_file_udp(self, file_path, device_index, progress_callback=None, remote_name=None, replace=False,
+                      client_socket=None):
+        """Invia un file con il trasporto UDP a frequenza controllata.
+        
+        Pensato per collegamenti con RTT alto o perdite (ponti Wi-Fi), dove
+        TCP rallenta a ogni perdita: i datagrammi persi vengono ritrasmessi
+        su NACK del receiver e la frequenza segue il ritardo di coda. La
+        connessione TCP resta aperta come canale di controllo (client_socket:
+        connessione già aperta da send_file per misurare l'RTT).
+        """
+        if device_index < 0 or device_index >= len(self.devices["devices"]):
+            print("Indice dispositivo non valido")
+            return False
+        
+        device = self.devices["devices"][device_index]
+        file_stat = os.stat(file_path)
+        file_size = file_stat.st_size
+        file_name = remote_name or os.path.basename(file_path)
+        if client_socket is None:
+            print(f"Invio di {file_name} ({file_size} bytes) a {device['name']} ({device['ip']}) via UDP...")
+        else:
+            print(f"RTT di {self.rtt_ms.get(device['ip'])} ms: invio via UDP")
+        
+        udp_socket = None
+        span = metrics.span("send_udp", filename=file_name, filesize=file_size, peer=device["ip"])
+        try:
+            if client_socket is None:
+                with span.stage("connect"):
+                    client_socket = self.connect_device(device)
+            
+            file_info = {
+                "type": "udp",
+                "filename": file_name,
+                "filesize": file_size,
+                "mtime_ns": file_stat.st_mtime_ns,
+                "datagram_size": UDP_PAYLOAD_SIZE
+            }
+            if replace:
+                file_info["replace"] = True
+            with span.stage("handshake"):
+                client_socket.send(json.dumps(file_info).encode())
+                # La porta UDP segue subito la conferma: si leggono solo i 2 byte di "OK"
+                response = recv_exact(client_socket, 2).decode()
+                if response != "OK":
+                    raise ConnectionError(f"Errore nella conferma: {response}")
+                client_socket.settimeout(UDP_TIMEOUT)
+                udp_port = recv_json(client_socket)["udp_port"]
+            
+            # "udp_port" del dispositivo: porta inoltrata (NAT, port forwarding) al posto di quella annunciata
+            peer = client_socket.getpeername()
+            peer = (peer[0], device.get("udp_port", udp_port)) + tuple(peer[2:])
+            udp_socket = open_udp_socket(client_socket.family)
+            with open(file_path, 'rb') as f, open(file_path, 'rb') as retransmit_file:
+                sender = UdpSender(udp_socket, peer, f, retransmit_file, file_size)
+                with span.stage("socket_send"):
+                    sender.run(client_socket, progress_callback)
+            
+            response = recv_json(client_socket)
+            if response.get("status") != "received":
+                raise IOError(response.get("error", "ricezione non completata"))
+            send_json(client_socket, {"sha256": sender.digest})
+            with span.stage("finalize"):
+                response = recv_json(client_socket)
+            if response.get("status") != "ok":
+                raise IOError(response.get("error", "file non confermato"))
+            span.set(retransmits=sender.retransmits, rate=int(sender.rate))
+        except Exception as e:
+            print(f"Errore durante l'invio UDP: {e}")
+            span.end("failed")
+            return self._notify_failed(file_name, device, str(e))
+        finally:
+            for sock in (udp_socket, client_socket):
+                if sock:
+                    sock.close()
+        
+        metrics.inc("zapshare_bytes_sent_total", file_size)
+        metrics.inc("zapshare_files_sent_total")
+        metrics.inc("zapshare_udp_retransmits_total", sender.retransmits)
+        print(f"Invio completato con successo! ({sender.retransmits} ritrasmissioni)")
+        for callback in self.transfer_callbacks:
+            try:
+                callback({
+                    "status": "completed",
+                    "filename": file_name,
+                    "filesize": file_size,
+                    "recipient": device["name"],
+                    "recipient_ip": device["ip"]
+                })
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+        span.end()
+        return True
+    
+    def _send_compressed(self, client_socket, f, extents, sparse, data_size, progress_callback=None):
+        """Invia le regioni del file come blocchi compressi (lunghezza + dati).
+
+        La compressione gira sui core disponibili tramite la pipeline; i blocchi
+        tornano in ordine e vengono scritti sul socket da questo thread.
+        Restituisce i byte effettivamente inviati.
+        """
+        pipeline = get_pipeline(("zlib",), self.pipeline_workers, self.pipeline_mode)
+        plan = [(offset + start, min(pipeline.chunk_size, length - start), start == 0, offset, length)
+                for offset, length in extents
+                for start in range(0, length, pipeline.chunk_size)]
+        
+        def read_chunks():
+            for chunk_offset, chunk_length, _, _, _ in plan:
+                f.seek(chunk_offset)
+                chunk = f.read(chunk_length)
+                if len(chunk) != chunk_length:
+                    raise IOError(f"Il file {f.name} è stato modificato durante l'invio")
+                yield chunk
+        
+        bytes_sent = 0
+        bytes_done = 0
+        for (_, chunk_length, first, offset, length), frame in zip(plan, pipeline.map(read_chunks())):
+            if sparse and first:
+                client_socket.sendall(EXTENT.pack(offset, length))
+            client_socket.sendall(FRAME.pack(len(frame)) + frame)
+            bytes_sent += len(frame)
+            bytes_done += chunk_length
+            if progress_callback:
+                progress_callback(int((bytes_done / data_size) * 100) if data_size else 100)
+        return bytes_sent
+    
+    def send_directory(self, dir_path, device_index, progress_callback=None):
+        """Invia una cartella: i file piccoli viaggiano in un unico archivio,
+        quelli grandi vengono inviati singolarmente"""
+        if not os.path.isdir(dir_path):
+            print(f"La cartella {dir_path} non esiste")
+            return False
+        
+        # I percorsi relativi includono il nome della cartella
+        base_dir = os.path.dirname(os.path.abspath(dir_path))
+        small_files = []
+        large_files = []
+        for root, dirs, files in os.walk(dir_path):
+            for name in files:
+                local_path = os.path.join(root, name)
+                relative_path = os.path.relpath(local_path, base_dir).replace(os.sep, "/")
+                st = os.stat(local_path)
+                if st.st_size < SMALL_FILE_LIMIT:
+                    small_files.append((local_path, relative_path, st))
+                else:
+                    large_files.append((local_path, relative_path, st))
+        
+        success = True
+        if small_files:
+            success = self.send_archive(small_files, device_index, progress_callback)
+        for local_path, relative_path, st in large_files:
+            if not self.send_file(local_path, device_index, progress_callback, remote_name=relative_path):
+                success = False
+        return success
+    
+    def sync_directory(self, dir_path, device_index, delete=False, progress_callback=None):
+        """Sincronizza una cartella con il dispositivo: invia solo i file nuovi o
+        modificati e, con delete=True, elimina quelli rimossi localmente"""
+        if not os.path.isdir(dir_path):
+            print(f"La cartella {dir_path} non esiste")
+            return False
+        
+        if device_index < 0 or device_index >= len(self.devices["devices"]):
+            print("Indice dispositivo non valido")
+            return False
+        
+        device = self.devices["devices"][device_index]
+        folder = os.path.basename(os.path.abspath(dir_path))
+        span = metrics.span("sync", folder=folder, peer=device["ip"])
+        
+        try:
+            # Il manifest locale viene calcolato mentre si attende quello remoto
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                local_future = pool.submit(build_manifest, dir_path, self.manifest_store.get(dir_path))
+                with span.stage("remote_manifest"):
+                    remote = self._request_manifest(device, folder)
+                with span.stage("local_manifest"):
+                    local = local_future.result()
+            self.manifest_store.put(dir_path, local)
+        except Exception as e:
+            print(f"Errore durante il confronto dei manifest: {e}")
+            span.end("failed")
+            return False
+        
+        to_send, to_delete = diff_manifests(local, remote, delete)
+        print(f"Sincronizzazione di {folder}: {len(to_send)} file da inviare, {len(to_delete)} da eliminare, "
+              f"{len(local) - len(to_send)} invariati")
+        span.set(files=len(local), changed=len(to_send), deleted=len(to_delete))
+        metrics.inc("zapshare_sync_files_skipped_total", len(local) - len(to_send))
+        
+        # Invio dei file nuovi o modificati (i piccoli in un unico archivio)
+        small_files = []
+        large_files = []
+        for relative_path in to_send:
+            local_path = os.path.join(dir_path, *relative_path.split("/"))
+            st = os.stat(local_path)
+            entry = (local_path, f"{folder}/{relative_path}", st)
+            if st.st_size < SMALL_FILE_LIMIT:
+                small_files.append(entry)
+            else:
+                large_files.append(entry)
+        
+        success = True
+        with span.stage("transfer"):
+            if small_files:
+                success = self.send_archive(small_files, device_index, progress_callback, replace=True)
+            for local_path, remote_name, st in large_files:
+                if not self.send_file(local_path, device_index, progress_callback, remote_name=remote_name, replace=True):
+                    success = False
+        
+        # Propagazione delle eliminazioni
+        if to_delete and success:
+            with span.stage("delete"):
+                try:
+                    client_socket = self.connect_device(device)
+                    try:
+                        client_socket.send(json.dumps({
+                            "type": "sync_delete",
+                            "filename": folder,
+                            "folder": folder,
+                            "filesize": 0
+                        }).encode())
+                        if client_socket.recv(self.buffer_size).decode() != "OK":
+                            raise IOError("Richiesta di eliminazione rifiutata")
+                        send_json(client_socket, to_delete)
+                        if client_socket.recv(self.buffer_size).decode() != "DONE":
+                            raise IOError("Eliminazione non confermata")
+                    finally:
+                        client_socket.close()
+                except Exception as e:
+                    print(f"Errore durante la propagazione delle eliminazioni: {e}")
+                    success = False
+        
+        span.end("ok" if success else "failed")
+        return success
+    
+    def _request_manifest(self, device, folder):
+        """Chiede al receiver il manifest della cartella sincronizzata"""
+        client_socket = self.connect_device(device)
+        try:
+            client_socket.send(json.dumps({
+                "type": "sync_manifest",
+                "filename": folder,
+                "folder": folder,
+                "filesize": 0
+            }).encode())
+            # Lettura esatta: il manifest segue subito la conferma sullo stesso flusso
+            response = recv_exact(client_socket, 2).decode()
+            if response != "OK":
+                raise IOError(f"Errore nella conferma: {response}")
+            
+            # Il receiver può impiegare tempo a calcolare gli hash
+            client_socket.settimeout(None)
+            return recv_json(client_socket)
+        finally:
+            client_socket.close()
+    
+    def send_archive(self, entries, device_index, progress_callback=None, replace=False):
+        """Invia molti file piccoli in un unico flusso aggregato.
+        
+        entries: lista di (percorso_locale, percorso_relativo, stat_result)
+        """
+        if device_index < 0 or device_index >= len(self.devices["devices"]):
+            print("Indice dispositivo non valido")
+            return False
+        
+        device = self.devices["devices"][device_index]
+        total_size = sum(st.st_size for _, _, st in entries)
+        archive_name = f"{len(entries)} file"
+        
+        print(f"Invio di {len(entries)} file piccoli ({total_size} bytes) a {device['name']} ({device['ip']})...")
+        
+        client_socket = None
+        span = metrics.span("send_archive", files=len(entries), filesize=total_size, peer=device["ip"])
+        
+        try:
+            with span.stage("connect"):
+                client_socket = self.connect_device(device)
+            
+            file_info = {
+                "type": "archive",
+                "filename": archive_name,
+                "files": len(entries),
+                "filesize": total_size
+            }
+            if replace:
+                file_info["replace"] = True
+            
+            with span.stage("handshake"):
+                client_socket.send(json.dumps(file_info).encode())
+                response = client_socket.recv(self.buffer_size).decode()
+            if response != "OK":
+                print(f"Errore nella conferma: {response}")
+                client_socket.close()
+                span.end("rejected")
+                return False
+            
+            # Invio dei blocchi dell'archivio
+            bytes_sent = 0
+            with span.stage("socket_send"):
+                for block in iter_pack(entries):
+                    client_socket.sendall(block)
+                    bytes_sent += len(block)
+                    if progress_callback and total_size:
+                        progress_callback(min(100, int((bytes_sent / total_size) * 100)))
+            
+            # Attende che il receiver abbia scritto tutti i file
+            with span.stage("finalize"):
+                response = client_socket.recv(self.buffer_size).decode()
+            client_socket.close()
+            if response != "DONE":
+                print(f"Errore nella conferma finale: {response}")
+                span.end("failed")
+                return False
+            
+            metrics.inc("zapshare_bytes_sent_total", bytes_sent)
+            metrics.inc("zapshare_files_sent_total", len(entries))
+            print(f"Invio di {len(entries)} file completato con successo!")
+            
+            for callback in self.transfer_callbacks:
+                try:
+                    callback({
+                        "status": "completed",
+                        "filename": archive_name,
+                        "filesize": total_size,
+                        "files": len(entries),
+                        "recipient": device["name"],
+                        "recipient_ip": device["ip"]
+                    })
+                except Exception as e:
+                    print(f"Errore nella callback: {e}")
+            
+            span.end()
+            return True
+        
+        except Exception as e:
+            print(f"Errore durante l'invio dell'archivio: {e}")
+            if client_socket:
+                client_socket.close()
+            span.end("failed")
+            error = str(e)
+        
+        for callback in self.transfer_callbacks:
+            try:
+                callback({
+                    "status": "failed",
+                    "filename": archive_name,
+                    "recipient": device["name"],
+                    "recipient_ip": device["ip"],
+                    "error": error
+                })
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+        
+        return False
+
+    def send_stream(self, source, device_index, remote_name, progress_callback=None, replace=False):
+        """Invia dati di lunghezza sconosciuta (pipe, stdin, generatore).
+        
+        source può essere un oggetto file-like o un iterabile di bytes/str.
+        Il flusso viene inviato a blocchi e chiuso da un trailer con la
+        dimensione finale e l'hash; progress_callback riceve i byte inviati
+        (la percentuale non è calcolabile).
+        """
+        if device_index < 0 or device_index >= len(self.devices["devices"]):
+            print("Indice dispositivo non valido")
+            return False
+        
+        device = self.devices["devices"][device_index]
+        print(f"Invio del flusso {remote_name} a {device['name']} ({device['ip']})...")
+        
+        client_socket = None
+        span = metrics.span("send_stream", filename=remote_name, peer=device["ip"])
+        
+        try:
+            with span.stage("connect"):
+                client_socket = self.connect_device(device)
+            
+            file_info = {
+                "type": "stream",
+                "filename": remote_name,
+                "filesize": None,
+                "mtime_ns": time.time_ns()
+            }
+            if replace:
+                file_info["replace"] = True
+            
+            with span.stage("handshake"):
+                client_socket.send(json.dumps(file_info).encode())
+                response = client_socket.recv(self.buffer_size).decode()
+            if response != "OK":
+                print(f"Errore nella conferma: {response}")
+                client_socket.close()
+                span.end("rejected")
+                return False
+            
+            hasher = hashlib.sha256()
+            bytes_sent = 0
+            for chunk in iter_chunks(source):
+                hasher.update(chunk)
+                send_chunk(client_socket, chunk)
+                bytes_sent += len(chunk)
+                if progress_callback:
+                    progress_callback(bytes_sent)
+            end_stream(client_socket)
+            send_json(client_socket, {"size": bytes_sent, "sha256": hasher.hexdigest()})
+            
+            # Il receiver conferma dopo aver verificato e reso visibile il file
+            with span.stage("finalize"):
+                response = client_socket.recv(self.buffer_size).decode()
+            client_socket.close()
+            if response != "DONE":
+                print(f"Errore nella conferma finale: {response}")
+                span.end("failed")
+                return self._notify_failed(remote_name, device, response)
+            
+            span.set(filesize=bytes_sent)
+            metrics.inc("zapshare_bytes_sent_total", bytes_sent)
+            metrics.inc("zapshare_files_sent_total")
+            print(f"Invio del flusso completato ({bytes_sent} bytes)")
+            
+            for callback in self.transfer_callbacks:
+                try:
+                    callback({
+                        "status": "completed",
+                        "filename": remote_name,
+                        "filesize": bytes_sent,
+                        "recipient": device["name"],
+                        "recipient_ip": device["ip"]
+                    })
+                except Exception as e:
+                    print(f"Errore nella callback: {e}")
+            
+            span.end()
+            return True
+        
+        except Exception as e:
+            print(f"Errore durante l'invio del flusso: {e}")
+            if client_socket:
+                client_socket.close()
+            span.end("failed")
+            return self._notify_failed(remote_name, device, str(e))
+    
+    def send_relay(self, file_path, device_indexes, fanout=1, progress_callback=None, replace=False):
+        """Invia un file a molti dispositivi con una distribuzione a catena.
+        
+        Il mittente invia ai primi `fanout` dispositivi; ognuno scrive il file
+        e lo inoltra blocco per blocco ai successivi (fanout=1: catena), così
+        la banda in uscita del mittente non si divide tra tutti i destinatari.
+        progress_callback riceve i messaggi di stato di ogni nodo
+        ({"node_id", "node", "ip", "status", "bytes"}; node_id è la posizione
+        in device_indexes); restituisce True se tutti i dispositivi hanno
+        ricevuto il file.
+        """
+        if not os.path.exists(file_path):
+            print(f"Il file {file_path} non esiste")
+            return False
+        if not device_indexes or any(i < 0 or i >= len(self.devices["devices"]) for i in device_indexes):
+            print("Indice dispositivo non valido")
+            return False
+        
+        # Ogni nodo dell'albero porta la propria posizione: gli esiti non dipendono dai nomi
+        devices = [dict(self.devices["devices"][i], node_id=n) for n, i in enumerate(device_indexes)]
+        file_stat = os.stat(file_path)
+        file_name = os.path.basename(file_path)
+        print(f"Invio di {file_name} ({file_stat.st_size} bytes) a {len(devices)} dispositivi in catena (fanout {fanout})...")
+        
+        span = metrics.span("send_relay", filename=file_name, filesize=file_stat.st_size, peers=len(devices))
+        results = {n: None for n in range(len(devices))}
+        
+        def on_message(message):
+            if message.get("status") in ("ok", "failed") and message.get("node_id") in results:
+                results[message["node_id"]] = message
+            if progress_callback:
+                progress_callback(message)
+        
+        relay = RelayFanout(on_message)
+        file_info = {
+            "type": "relay",
+            "filename": file_name,
+            "filesize": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns
+        }
+        if replace:
+            file_info["replace"] = True
+        
+        try:
+            with span.stage("connect"):
+                for subtree in build_tree(devices, fanout):
+                    device = subtree["device"]
+                    try:
+                        client_socket = self.connect_device(device)
+                        client_socket.settimeout(RELAY_TIMEOUT)
+                        client_socket.send(json.dumps(file_info).encode())
+                        response = client_socket.recv(self.buffer_size).decode()
+                        if response != "OK":
+                            client_socket.close()
+                            raise ConnectionError(f"risposta {response}")
+                        send_json(client_socket, subtree)
+                        relay.add(client_socket, subtree)
+                    except Exception as e:
+                        print(f"Impossibile connettersi a {device['name']}: {e}")
+                        relay.fail(subtree, e)
+            
+            hasher = hashlib.sha256()
+            bytes_sent = 0
+            with open(file_path, 'rb') as f:
+                for chunk in iter_chunks(f):
+                    if not relay.hops:
+                        break
+                    relay.send(chunk)
+                    hasher.update(chunk)
+                    bytes_sent += len(chunk)
+                    relay.poll()
+            relay.end({"size": bytes_sent, "sha256": hasher.hexdigest()})
+            
+            # Attende gli esiti di tutti i nodi
+            with span.stage("relay_wait"):
+                relay.wait()
+        except Exception as e:
+            print(f"Errore durante l'invio in catena: {e}")
+            relay.abort(e)
+            span.end("failed")
+            return self._notify_devices_failed(file_name, devices, results, str(e))
+        
+        metrics.inc("zapshare_bytes_sent_total", bytes_sent)
+        failed = [device["name"] for n, device in enumerate(devices)
+                  if not results[n] or results[n]["status"] != "ok"]
+        for n, device in enumerate(devices):
+            message = results[n] or {"status": "failed", "error": "nessuna risposta"}
+            for callback in self.transfer_callbacks:
+                try:
+                    callback({
+                        "status": "completed" if message["status"] == "ok" else "failed",
+                        "filename": file_name,
+                        "filesize": file_stat.st_size,
+                        "recipient": device["name"],
+                        "recipient_ip": device["ip"],
+                        "error": message.get("error")
+                    })
+                except Exception as e:
+                    print(f"Errore nella callback: {e}")
+        
+        if failed:
+            print(f"Invio in catena non riuscito per: {', '.join(failed)}")
+        else:
+            print(f"Invio in catena completato su {len(devices)} dispositivi")
+        span.end("partial" if failed else "ok")
+        return not failed
+    
+    def send_swarm(self, file_path, device_indexes, progress_callback=None, replace=False):
+        """Distribuisce un file a molti dispositivi in modalità swarm.
+        
+        Il file è diviso in pezzi con hash; il mittente invia ogni pezzo a
+        un solo dispositivo e i receiver si scambiano il resto tra loro,
+        quindi il tempo cresce poco con il numero di destinatari.
+        progress_callback (chiamata da più thread) riceve i messaggi di
+        ogni nodo ({"node_id", "node", "ip", "status", "pieces", "bytes"};
+        node_id è la posizione in device_indexes); restituisce True se
+        tutti i dispositivi hanno ricevuto il file.
+        """
+        if not os.path.exists(file_path):
+            print(f"Il file {file_path} non esiste")
+            return False
+        if not device_indexes or any(i < 0 or i >= len(self.devices["devices"]) for i in device_indexes):
+            print("Indice dispositivo non valido")
+            return False
+        
+        devices = [self.devices["devices"][i] for i in device_indexes]
+        file_stat = os.stat(file_path)
+        file_name = os.path.basename(file_path)
+        print(f"Invio swarm di {file_name} ({file_stat.st_size} bytes) a {len(devices)} dispositivi...")
+        
+        span = metrics.span("send_swarm", filename=file_name, filesize=file_stat.st_size, peers=len(devices))
+        results = {n: None for n in range(len(devices))}
+        links = []  # (posizione in devices, dispositivo, socket, porte)
+        try:
+            with span.stage("digest"):
+                meta = build_meta(file_path)
+            file_info = {
+                "type": "swarm",
+                "filename": file_name,
+                "filesize": meta["filesize"],
+                "mtime_ns": file_stat.st_mtime_ns,
+                "swarm_id": meta["swarm_id"]
+            }
+            if replace:
+                file_info["replace"] = True
+            
+            with span.stage("connect"):
+                for n, device in enumerate(devices):
+                    client_socket = None
+                    try:
+                        client_socket = self.connect_device(device)
+                        client_socket.settimeout(SWARM_TIMEOUT)
+                        client_socket.send(json.dumps(file_info).encode())
+                        response = client_socket.recv(self.buffer_size).decode()
+                        if response != "OK":
+                            raise ConnectionError(f"risposta {response}")
+                        send_json(client_socket, meta)
+                        links.append((n, device, client_socket, recv_json(client_socket)))
+                    except Exception as e:
+                        print(f"Impossibile connettersi a {device['name']}: {e}")
+                        if client_socket:
+                            client_socket.close()
+                        results[n] = {"status": "failed", "error": str(e)}
+            
+            # Ogni receiver conosce gli altri: indirizzi, porta dei trasferimenti e di discovery
+            peers = [{
+                "id": index,
+                "name": device["name"],
+                "ip": device["ip"],
+                "addresses": device.get("addresses", []),
+                "port": ports["port"],
+                "discovery_port": ports["discovery_port"]
+            } for index, (_, device, _, ports) in enumerate(links)]
+            for index, (_, _, client_socket, _) in enumerate(links):
+                send_json(client_socket, {"you": index, "peers": peers})
+            
+            # Byte dei pezzi scritti davvero verso ogni receiver (il resto lo scambiano tra loro)
+            sent = [0] * len(links)
+            with span.stage("swarm"):
+                threads = [threading.Thread(target=self._seed_swarm,
+                                            args=(index, n, device, client_socket, file_path, meta,
+                                                  results, sent, progress_callback))
+                           for index, (n, device, client_socket, _) in enumerate(links)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        except Exception as e:
+            print(f"Errore durante l'invio swarm: {e}")
+            span.end("failed")
+            return self._notify_devices_failed(file_name, devices, results, str(e))
+        finally:
+            # La chiusura libera i receiver, rimasti nello swarm per servire i peer
+            for _, _, client_socket, _ in links:
+                client_socket.close()
+        
+        metrics.inc("zapshare_bytes_sent_total", sum(sent))
+        failed = [device["name"] for n, device in enumerate(devices)
+                  if not results[n] or results[n]["status"] != "ok"]
+        for n, device in enumerate(devices):
+            message = results[n] or {"status": "failed", "error": "nessuna risposta"}
+            for callback in self.transfer_callbacks:
+                try:
+                    callback({
+                        "status": "completed" if message["status"] == "ok" else "failed",
+                        "filename": file_name,
+                        "filesize": meta["filesize"],
+                        "recipient": device["name"],
+                        "recipient_ip": device["ip"],
+                        "error": message.get("error")
+                    })
+                except Exception as e:
+                    print(f"Errore nella callback: {e}")
+        
+        if failed:
+            print(f"Invio swarm non riuscito per: {', '.join(failed)}")
+        else:
+            print(f"Invio swarm completato su {len(devices)} dispositivi")
+        span.end("partial" if failed else "ok")
+        return not failed
+    
+    def _seed_swarm(self, index, node_id, device, client_socket, file_path, meta, results, sent, progress_callback):
+        """Invia al receiver la sua quota di pezzi, poi ne segue l'avanzamento
+        e risponde alle richieste dei pezzi che nessun peer ha.
+        
+        index è la posizione tra i receiver collegati (len(sent) in tutto),
+        node_id quella in results; sent[index] conta i byte dei pezzi inviati.
+        """
+        piece_size = meta["piece_size"]
+        try:
+            with open(file_path, 'rb') as f:
+                for piece in range(index, len(meta["pieces"]), len(sent)):
+                    f.seek(piece * piece_size)
+                    data = f.read(piece_size)
+                    send_piece(client_socket, piece, data)
+                    sent[index] += len(data)
+                send_piece(client_socket, END_OF_PIECES, b"")
+                
+                while True:
+                    message = recv_json(client_socket)
+                    if message["status"] == "request":
+                        f.seek(message["piece"] * piece_size)
+                        data = f.read(piece_size)
+                        send_piece(client_socket, message["piece"], data)
+                        sent[index] += len(data)
+                        continue
+                    message.update(node_id=node_id, node=device["name"], ip=device["ip"])
+                    if progress_callback:
+                        progress_callback(message)
+                    if message["status"] in ("ok", "failed"):
+                        results[node_id] = message
+                        return
+        except Exception as e:
+            print(f"Errore nello swarm con {device['name']}: {e}")
+            results[node_id] = {"status": "failed", "error": str(e)}
+    
+    def open_mux(self, device_index):
+        """Apre una sessione multiplexata verso il dispositivo.
+        
+        I file accodati con session.send_file() viaggiano sulla stessa
+        connessione a frame intercalati: quelli piccoli hanno priorità sui
+        trasferimenti bulk. Restituisce la MuxSession (da chiudere con
+        close()) oppure None se la connessione fallisce.
+        """
+        if device_index < 0 or device_index >= len(self.devices["devices"]):
+            print("Indice dispositivo non valido")
+            return None
+        
+        device = self.devices["devices"][device_index]
+        client_socket = None
+        try:
+            client_socket = self.connect_device(device)
+            client_socket.send(json.dumps({"type": "mux", "filename": "mux", "filesize": None}).encode())
+            response = client_socket.recv(self.buffer_size).decode()
+            if response != "OK":
+                print(f"Errore nella conferma: {response}")
+                client_socket.close()
+                return None
+        except Exception as e:
+            print(f"Errore nell'apertura della sessione con {device['name']}: {e}")
+            if client_socket:
+                client_socket.close()
+            return None
+        
+        def on_result(transfer):
+            ok = transfer.result.get("status") == "ok"
+            if ok:
+                metrics.inc("zapshare_bytes_sent_total", transfer.sent)
+                metrics.inc("zapshare_files_sent_total")
+            for callback in self.transfer_callbacks:
+                try:
+                    callback({
+                        "status": "completed" if ok else "failed",
+                        "filename": transfer.info["filename"],
+                        "filesize": transfer.info["filesize"],
+                        "recipient": device["name"],
+                        "recipient_ip": device["ip"],
+                        "error": transfer.result.get("error")
+                    })
+                except Exception as e:
+                    print(f"Errore nella callback: {e}")
+        
+        return MuxSession(client_socket, on_result)
+    
+    def multipath_pairs(self, device):
+        """Coppie (indirizzo locale, indirizzo remoto) utilizzabili per il multipath"""
+        return pair_paths(inventory.interfaces(), device_addresses(device))
+    
+    def send_file_multipath(self, file_path, device_index, progress_callback=None, paths=None, remote_name=None):
+        """Invia un file su più percorsi in parallelo (es. cavo + Wi-Fi).
+        
+        Apre una connessione per ogni coppia di interfacce, collegando il socket
+        all'indirizzo locale, e divide il file in strisce assegnate ai percorsi in
+        base al throughput misurato. Il receiver riassembla le strisce per offset.
+        """
+        if not os.path.exists(file_path):
+            print(f"Il file {file_path} non esiste")
+            return False
+        
+        if device_index < 0 or device_index >= len(self.devices["devices"]):
+            print("Indice dispositivo non valido")
+            return False
+        
+        device = self.devices["devices"][device_index]
+        pairs = paths if paths is not None else self.multipath_pairs(device)
+        if len(pairs) < 2:
+            print("Un solo percorso disponibile, invio standard")
+            return self.send_file(file_path, device_index, progress_callback, remote_name=remote_name)
+        
+        file_stat = os.stat(file_path)
+        file_size = file_stat.st_size
+        file_name = remote_name or os.path.basename(file_path)
+        port = device.get("port", 9999)
+        span = metrics.span("send_multipath", filename=file_name, filesize=file_size, peer=device["ip"])
+        
+        # Apre una connessione per percorso, collegata all'indirizzo locale
+        streams = []
+        with span.stage("connect"):
+            for local_ip, remote_ip in pairs:
+                try:
+                    client_socket, _ = connect_fastest([remote_ip], port, timeout=10, source_address=(local_ip, 0))
+                    client_socket.settimeout(10)
+                    client_socket = self.secure_socket(client_socket, device)
+                    streams.append((client_socket, local_ip, remote_ip))
+                    print(f"Percorso attivo: {local_ip} -> {remote_ip}")
+                except Exception as e:
+                    print(f"Percorso {local_ip} -> {remote_ip} non disponibile: {e}")
+        
+        if not streams:
+            span.end("failed")
+            return self._notify_failed(file_name, device, "Nessun percorso disponibile")
+        
+        transfer_id = uuid.uuid4().hex
+        scheduler = StripeScheduler(file_size, len(streams), self.multipath_stripe_size)
+        progress_lock = threading.Lock()
+        state = {"sent": 0, "errors": []}
+        
+        def send_path(index, client_socket):
+            try:
+                with open(file_path, 'rb') as f:
+                    while True:
+                        stripe = scheduler.next_stripe(index)
+                        if stripe is None:
+                            break
+                        offset, length = stripe
+                        t0 = time.perf_counter()
+                        client_socket.sendall(EXTENT.pack(offset, length))
+                        f.seek(offset)
+                        remaining = length
+                        while remaining > 0:
+                            chunk = f.read(min(self.buffer_size * 16, remaining))
+                            if not chunk:
+                                raise IOError(f"Il file {file_path} è stato modificato durante l'invio")
+                            client_socket.sendall(chunk)
+                            remaining -= len(chunk)
+                        scheduler.record(index, length, time.perf_counter() - t0)
+                        
+                        with progress_lock:
+                            state["sent"] += length
+                            progress = int((state["sent"] / file_size) * 100) if file_size else 100
+                        if progress_callback:
+                            progress_callback(progress)
+                
+                # Fine del flusso e attesa della conferma
+                client_socket.sendall(EXTENT.pack(0, 0))
+                response = client_socket.recv(self.buffer_size).decode()
+                if response != "DONE":
+                    raise IOError(f"Errore nella conferma: {response}")
+            except Exception as e:
+                state["errors"].append(e)
+            finally:
+                client_socket.close()
+        
+        try:
+            # Intestazioni: tutte dichiarano lo stesso numero di flussi
+            with span.stage("handshake"):
+                for index, (client_socket, local_ip, remote_ip) in enumerate(streams):
+                    file_info = {
+                        "type": "multipath",
+                        "transfer_id": transfer_id,
+                        "stream": index,
+                        "streams": len(streams),
+                        "filename": file_name,
+                        "filesize": file_size,
+                        "mtime_ns": file_stat.st_mtime_ns
+                    }
+                    client_socket.send(json.dumps(file_info).encode())
+                    response = client_socket.recv(self.buffer_size).decode()
+                    if response != "OK":
+                        raise IOError(f"Errore nella conferma: {response}")
+            
+            threads = []
+            with span.stage("stripes"):
+                for index, (client_socket, local_ip, remote_ip) in enumerate(streams):
+                    thread = threading.Thread(target=send_path, args=(index, client_socket))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+                for thread in threads:
+                    thread.join()
+            
+            if state["errors"]:
+                raise state["errors"][0]
+        except Exception as e:
+            print(f"Errore durante l'invio multipath: {e}")
+            for client_socket, _, _ in streams:
+                client_socket.close()
+            span.end("failed")
+            return self._notify_failed(file_name, device, str(e))
+        
+        for index, stats in scheduler.stats().items():
+            local_ip, remote_ip = streams[index][1], streams[index][2]
+            print(f"Percorso {local_ip} -> {remote_ip}: {stats['bytes']} bytes, {stats['throughput'] / 1e6:.1f} MB/s")
+        span.set(paths=len(streams))
+        metrics.inc("zapshare_bytes_sent_total", file_size)
+        metrics.inc("zapshare_files_sent_total")
+        print("Invio multipath completato con successo!")
+        
+        for callback in self.transfer_callbacks:
+            try:
+                callback({
+                    "status": "completed",
+                    "filename": file_name,
+                    "filesize": file_size,
+                    "recipient": device["name"],
+                    "recipient_ip": device["ip"]
+                })
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+        
+        span.end()
+        return True
+    
+    def _notify_devices_failed(self, file_name, devices, results, error):
+        """Notifica il fallimento a ogni dispositivo che non ha già confermato il file
+        (results è indicizzato per posizione in devices)"""
+        for n, device in enumerate(devices):
+            message = results.get(n)
+            if not message or message["status"] != "ok":
+                self._notify_failed(file_name, device, (message or {}).get("error", error))
+        return False
+    
+    def _notify_failed(self, file_name, device, error):
+        """Notifica alle callback un trasferimento fallito; restituisce sempre False"""
+        for callback in self.transfer_callbacks:
+            try:
+                callback({
+                    "status": "failed",
+                    "filename": file_name,
+                    "recipient": device["name"],
+                    "recipient_ip": device["ip"],
+                    "error": error
+                })
+            except Exception as e:
+                print(f"Errore nella callback: {e}")
+        return False
@@ -0,0 +1,149 @@
+import abc
+import time
+import queue
+import threading
+import subprocess
+
+# Dimensione dei blocchi di zeri con cui vengono riempiti i buchi dei file sparsi
+_ZERO_BLOCK = bytes(1024 * 1024)
+
+
+class Sink(abc.ABC):
+    """Destinazione dei dati ricevuti al posto della cartella di ricezione.
+
+    write() viene chiamata dal thread di ricezione con i blocchi nell'ordine
+    del file: finché non ritorna il socket non viene letto, quindi un
+    consumatore lento rallenta il sender tramite il controllo di flusso TCP.
+    close() segnala un trasferimento completo e verificato; abort() uno
+    interrotto o corrotto (i dati già scritti vanno scartati).
+    """
+
+    @abc.abstractmethod
+    def write(self, data):
+        """Un blocco di dati del file"""
+
+    def write_zeros(self, length):
+        """Buco di un file sparso"""
+        while length > 0:
+            block = _ZERO_BLOCK[:min(length, len(_ZERO_BLOCK))]
+            self.write(block)
+            length -= len(block)
+
+    def close(self):
+        pass
+
+    def abort(self, error):
+        pass
+
+
+class FileSink(Sink):
+    """Scrive su un oggetto file-like già aperto (socket, BytesIO, pipe, ...)"""
+
+    def __init__(self, fileobj, close_file=False):
+        self.fileobj = fileobj
+        self.close_file = close_file
+
+    def write(self, data):
+        self.fileobj.write(data)
+
+    def close(self):
+        if hasattr(self.fileobj, "flush"):
+            self.fileobj.flush()
+        if self.close_file:
+            self.fileobj.close()
+
+    def abort(self, error):
+        if self.close_file:
+            self.fileobj.close()
+
+
+class ProcessSink(Sink):
+    """Invia i dati allo stdin di un sottoprocesso (es. ["tar", "-x"]).
+
+    La pipe ha un buffer limitato: se il processo non legge, write() si
+    blocca e con lei la ricezione.
+    """
+
+    def __init__(self, args, **popen_kwargs):
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, **popen_kwargs)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise IOError(f"Il processo {self.process.args} è terminato con codice {returncode}")
+
+    def abort(self, error):
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+
+
+class IteratorSink(Sink):
+    """Espone i blocchi ricevuti come iteratore, da consumare in un altro thread.
+
+    La coda contiene al massimo max_chunks blocchi; quando è piena write()
+    attende il consumatore, al massimo `timeout` secondi. Se il consumatore
+    smette di iterare (o chiama stop()) write() fallisce invece di restare
+    bloccata. Se il trasferimento fallisce, l'iterazione solleva l'errore
+    invece di terminare normalmente.
+    """
+
+    _END = object()
+
+    def __init__(self, max_chunks=16, timeout=60):
+        self._queue = queue.Queue(max_chunks)
+        self.timeout = timeout
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Il consumatore non leggerà altri blocchi"""
+        self._stopped.set()
+
+    def _put(self, item):
+        deadline = time.monotonic() + self.timeout
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=min(0.5, max(0.0, deadline - time.monotonic())))
+                return
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    raise IOError("Il consumatore del sink non legge i dati")
+        raise IOError("Il consumatore del sink ha smesso di leggere")
+
+    def write(self, data):
+        self._put(data)
+
+    def close(self):
+        self._put(self._END)
+
+    def abort(self, error):
+        # Non blocca mai: i blocchi non ancora letti non servono più, l'errore sì
+        error = error if isinstance(error, BaseException) else IOError(error)
+        while True:
+            try:
+                self._queue.put_nowait(error)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._stopped.set()
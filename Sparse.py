@@ -0,0 +1,53 @@
+import os
+import errno
+import struct
+
+# Intestazione di ogni extent di dati: offset, lunghezza
+EXTENT = struct.Struct("!QQ")
+
+
+def find_data_extents(path, size):
+    """Restituisce la lista di (offset, lunghezza) delle regioni con dati di un file sparso.
+
+    Restituisce None se il file non ha buchi o se il sistema (o il filesystem)
+    non supporta SEEK_DATA/SEEK_HOLE: in quel caso si invia il file per intero.
+    """
+    if size == 0 or not hasattr(os, "SEEK_DATA") or not hasattr(os, "SEEK_HOLE"):
+        return None
+
+    extents = []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        offset = 0
+        while offset < size:
+            try:
+                data_start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # Nessun altro dato fino alla fine del file
+                    break
+                return None
+            if data_start >= size:
+                break
+            hole_start = min(os.lseek(fd, data_start, os.SEEK_HOLE), size)
+            extents.append((data_start, hole_start - data_start))
+            offset = hole_start
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+    if extents == [(0, size)]:
+        return None
+    return extents
+
+
+def recv_exact(sock, size):
+    """Riceve esattamente size byte dal socket"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = sock.recv(size - len(buffer))
+        if not data:
+            raise ConnectionError("Connessione chiusa durante la ricezione")
+        buffer += data
+    return bytes(buffer)
@@ -0,0 +1,55 @@
+import struct
+
+from Sparse import recv_exact
+
+# Dimensione dei blocchi inviati per i flussi di lunghezza sconosciuta
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Ogni blocco è preceduto dalla sua lunghezza; un blocco vuoto chiude il flusso
+CHUNK = struct.Struct("!I")
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def iter_chunks(source, chunk_size=STREAM_CHUNK_SIZE):
+    """Blocchi di bytes da un oggetto file-like (read) o da un iterabile.
+
+    I pezzi piccoli di un iterabile (es. righe) vengono accorpati fino a
+    chunk_size, così il framing non aggiunge un'intestazione per riga.
+    """
+    if hasattr(source, "read"):
+        # stdin e i file aperti in modalità testo espongono i bytes tramite buffer
+        source = getattr(source, "buffer", source)
+        while True:
+            data = source.read(chunk_size)
+            if not data:
+                return
+            yield data.encode() if isinstance(data, str) else data
+
+    pending = bytearray()
+    for piece in source:
+        pending += piece.encode() if isinstance(piece, str) else piece
+        while len(pending) >= chunk_size:
+            yield bytes(pending[:chunk_size])
+            del pending[:chunk_size]
+    if pending:
+        yield bytes(pending)
+
+
+def send_chunk(sock, data):
+    # Intestazione e dati in una sola scrittura (evita l'attesa di Nagle sul pacchetto piccolo)
+    sock.sendall(CHUNK.pack(len(data)) + data)
+
+
+def end_stream(sock):
+    sock.sendall(CHUNK.pack(0))
+
+
+def iter_received_chunks(sock):
+    """Blocchi ricevuti fino al marcatore di fine flusso"""
+    while True:
+        (length,) = CHUNK.unpack(recv_exact(sock, CHUNK.size))
+        if length == 0:
+            return
+        if length > MAX_CHUNK_SIZE:
+            raise IOError(f"Blocco del flusso troppo grande: {length} bytes")
+        yield recv_exact(sock, length)
@@ -0,0 +1,323 @@
+import json
+import time
+import random
+import socket
+import struct
+import hashlib
+import threading
+from collections import deque
+
+from Sparse import recv_exact
+from Sync import send_json, recv_json
+
+# Dimensione dei pezzi in cui viene diviso il file
+PIECE_SIZE = 1024 * 1024
+
+# Pezzo: indice e lunghezza, poi i dati (lunghezza 0: pezzo non disponibile)
+PIECE = struct.Struct("!II")
+END_OF_PIECES = 0xFFFFFFFF
+
+# Annuncio dei pezzi posseduti, inviato via UDP alla porta di discovery dei peer
+SWARM_ANNOUNCE = b"ZSW1"
+SWARM_ANNOUNCE_INTERVAL = 0.25
+
+SWARM_PIPELINE = 4  # Richieste in corso per ogni peer (il collegamento non resta mai fermo)
+SWARM_STALL = 2.0  # Secondi senza nuovi pezzi prima di chiederli al mittente
+SWARM_TIMEOUT = 60
+
+
+def build_meta(path, piece_size=PIECE_SIZE):
+    """Descrizione del file per lo swarm: hash di ogni pezzo e identificativo"""
+    pieces = []
+    filesize = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(piece_size)
+            if not data:
+                break
+            pieces.append(hashlib.sha256(data).hexdigest())
+            filesize += len(data)
+    return {"swarm_id": swarm_id(pieces), "piece_size": piece_size, "filesize": filesize, "pieces": pieces}
+
+
+def swarm_id(pieces):
+    return hashlib.sha256("".join(pieces).encode()).hexdigest()
+
+
+def send_piece(sock, index, data):
+    sock.sendall(PIECE.pack(index, len(data)) + data)
+
+
+def recv_piece(sock):
+    """(indice, dati); dati è None se il peer non ha il pezzo"""
+    index, length = PIECE.unpack(recv_exact(sock, PIECE.size))
+    return index, recv_exact(sock, length) if length else None
+
+
+def encode_announce(swarm, peer_id, have):
+    return SWARM_ANNOUNCE + json.dumps({"swarm_id": swarm, "peer": peer_id, "have": have.hex()}).encode()
+
+
+def decode_announce(data):
+    message = json.loads(data[len(SWARM_ANNOUNCE):].decode())
+    return message["swarm_id"], message["peer"], bytes.fromhex(message["have"])
+
+
+def _bit(bitfield, index):
+    return bitfield[index >> 3] >> (7 - (index & 7)) & 1
+
+
+class SwarmSession:
+    """Stato di un file distribuito a pezzi tra i receiver.
+
+    I pezzi arrivano dal mittente (ognuno a un solo receiver) e dagli altri
+    peer; ogni pezzo viene verificato con il suo hash e scritto al suo
+    offset nel file temporaneo. I pezzi posseduti vengono annunciati ai peer
+    via UDP e i pezzi da chiedere sono scelti "rarest first": prima quelli
+    che hanno meno peer, così le copie si moltiplicano e ogni collegamento
+    ha sempre qualcosa da trasferire. La disponibilità di ogni pezzo è
+    aggiornata solo per i bit cambiati negli annunci, e i pezzi mancanti
+    sono raggruppati per disponibilità: scegliere non richiede ordinamenti.
+    """
+
+    def __init__(self, meta, temp_path):
+        if swarm_id(meta["pieces"]) != meta["swarm_id"]:
+            raise ValueError("Descrizione dello swarm non valida")
+        self.meta = meta
+        self.id = meta["swarm_id"]
+        self.piece_size = meta["piece_size"]
+        self.count = len(meta["pieces"])
+        self.have = bytearray((self.count + 7) // 8)
+        self.have_count = 0
+        self.me = None
+        self.peers = {}  # id -> {"ip", "addresses", "port", "discovery_port"}
+        self.peer_have = {}  # id -> bitfield annunciato
+        self.inflight = set()
+        self.closed = False
+        self.last_progress = time.monotonic()
+        self.availability = [0] * self.count  # Numero di peer che hanno ogni pezzo
+        self._buckets = {0: set(range(self.count))}  # disponibilità -> pezzi mancanti
+        self._cond = threading.Condition()
+        self._file_lock = threading.Lock()
+        self._file = open(temp_path, "w+b")
+        self._file.truncate(meta["filesize"])
+        self._announce_sockets = {}
+        self._announce_lock = threading.Lock()
+        self._last_announce = 0.0
+
+    @property
+    def complete(self):
+        return self.have_count == self.count
+
+    def piece_length(self, index):
+        return min(self.piece_size, self.meta["filesize"] - index * self.piece_size)
+
+    def has(self, index):
+        return _bit(self.have, index)
+
+    def set_peers(self, me, peers):
+        with self._cond:
+            self.me = me
+            self.peers = {peer["id"]: peer for peer in peers if peer["id"] != me}
+
+    def store(self, index, data):
+        """Scrive un pezzo verificato; restituisce False se l'hash non corrisponde"""
+        if (index >= self.count or len(data) != self.piece_length(index)
+                or hashlib.sha256(data).hexdigest() != self.meta["pieces"][index]):
+            self.release(index)
+            return False
+        with self._cond:
+            if self.has(index):
+                self.inflight.discard(index)
+                return True
+        with self._file_lock:
+            self._file.seek(index * self.piece_size)
+            self._file.write(data)
+        with self._cond:
+            if not self.has(index):
+                self.have[index >> 3] |= 0x80 >> (index & 7)
+                self.have_count += 1
+                self._buckets[self.availability[index]].discard(index)
+                self.last_progress = time.monotonic()
+            self.inflight.discard(index)
+            self._cond.notify_all()
+        self.announce()
+        return True
+
+    def read_piece(self, index):
+        if index >= self.count or not self.has(index):
+            return None
+        with self._file_lock:
+            if self._file is None:
+                return None
+            self._file.seek(index * self.piece_size)
+            return self._file.read(self.piece_length(index))
+
+    def release(self, index):
+        """Richiesta fallita: il pezzo torna disponibile per un altro peer"""
+        with self._cond:
+            self.inflight.discard(index)
+            self._cond.notify_all()
+
+    def _change_availability(self, index, delta):
+        level = self.availability[index]
+        self.availability[index] = level + delta
+        if not self.has(index):
+            self._buckets[level].discard(index)
+            self._buckets.setdefault(level + delta, set()).add(index)
+
+    def update_peer(self, peer_id, have):
+        if len(have) != len(self.have):
+            return
+        with self._cond:
+            if peer_id not in self.peers:
+                return
+            old = self.peer_have.get(peer_id, bytes(len(have)))
+            # Solo i bit cambiati dall'annuncio precedente
+            changed = int.from_bytes(old, "big") ^ int.from_bytes(have, "big")
+            last_bit = len(have) * 8 - 1
+            while changed:
+                low = changed & -changed
+                index = last_bit - (low.bit_length() - 1)
+                changed ^= low
+                if index < self.count:
+                    self._change_availability(index, 1 if _bit(have, index) else -1)
+            self.peer_have[peer_id] = bytes(have)
+            self._cond.notify_all()
+
+    def drop_peer_piece(self, peer_id, index):
+        with self._cond:
+            have = self.peer_have.get(peer_id)
+            if have is not None and _bit(have, index):
+                have = bytearray(have)
+                have[index >> 3] &= ~(0x80 >> (index & 7))
+                self.peer_have[peer_id] = bytes(have)
+                self._change_availability(index, -1)
+
+    def pick(self, peer_id):
+        """Prossimo pezzo da chiedere a peer_id (il più raro tra quelli che ha), o None"""
+        with self._cond:
+            have = self.peer_have.get(peer_id)
+            if have is None or self.complete:
+                return None
+            # Un pezzo che il peer possiede ha disponibilità almeno 1
+            for level in sorted(level for level, pieces in self._buckets.items() if level and pieces):
+                for index in self._buckets[level]:
+                    if index not in self.inflight and _bit(have, index):
+                        self.inflight.add(index)
+                        return index
+            return None
+
+    def pick_unavailable(self):
+        """Un pezzo mancante che nessun peer ha annunciato (da chiedere al mittente)"""
+        with self._cond:
+            candidates = [i for i in self._buckets.get(0, ()) if i not in self.inflight]
+            if not candidates:
+                candidates = [i for i in range(self.count) if not self.has(i) and i not in self.inflight]
+            if not candidates:
+                return None
+            index = random.choice(candidates)
+            self.inflight.add(index)
+            return index
+
+    def wait(self, timeout):
+        with self._cond:
+            if not self.complete and not self.closed:
+                self._cond.wait(timeout)
+
+    def announce(self, force=False):
+        """Invia i pezzi posseduti ai peer (al massimo ogni SWARM_ANNOUNCE_INTERVAL)"""
+        with self._announce_lock:
+            now = time.monotonic()
+            if self.me is None or self.closed or (not force and now - self._last_announce < SWARM_ANNOUNCE_INTERVAL):
+                return
+            self._last_announce = now
+            self._send_announce(encode_announce(self.id, self.me, bytes(self.have)))
+
+    def _send_announce(self, message):
+        for peer in list(self.peers.values()):
+            family = socket.AF_INET6 if ":" in peer["ip"] else socket.AF_INET
+            try:
+                sock = self._announce_sockets.get(family)
+                if sock is None:
+                    sock = self._announce_sockets[family] = socket.socket(family, socket.SOCK_DGRAM)
+                sock.sendto(message, (peer["ip"], peer["discovery_port"]))
+            except OSError:
+                pass
+
+    def finish_file(self):
+        """Chiude il file temporaneo (prima del rename)"""
+        with self._file_lock:
+            self._file.close()
+            self._file = None
+
+    def serve_from(self, path):
+        """Dopo il rename i pezzi vengono letti dal file definitivo"""
+        with self._file_lock:
+            self._file = open(path, "rb")
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        with self._announce_lock:
+            for sock in self._announce_sockets.values():
+                sock.close()
+
+
+def serve_pieces(sock, session):
+    """Risponde alle richieste di pezzi di un peer finché non chiude"""
+    while True:
+        request = recv_json(sock)
+        index = request.get("piece")
+        if index is None:
+            return
+        send_piece(sock, index, session.read_piece(index) or b"")
+
+
+def download_from_peer(session, peer, connect, retry_delay=0.5):
+    """Scarica dal peer i pezzi scelti da session.pick(), con SWARM_PIPELINE
+    richieste in corso, finché il file non è completo.
+
+    connect(peer) restituisce un socket già abilitato alla richiesta dei pezzi.
+    """
+    while not session.complete and not session.closed:
+        try:
+            sock = connect(peer)
+        except Exception:
+            session.wait(retry_delay)
+            continue
+
+        inflight = deque()
+        try:
+            # A file completo si leggono comunque le risposte già richieste
+            while inflight or not (session.complete or session.closed):
+                while len(inflight) < SWARM_PIPELINE and not session.complete:
+                    index = session.pick(peer["id"])
+                    if index is None:
+                        break
+                    send_json(sock, {"piece": index})
+                    inflight.append(index)
+                if not inflight:
+                    session.wait(SWARM_ANNOUNCE_INTERVAL)
+                    continue
+                index, data = recv_piece(sock)
+                expected = inflight.popleft()
+                if index != expected:
+                    raise IOError(f"Pezzo inatteso {index} (atteso {expected})")
+                if data is None:
+                    session.drop_peer_piece(peer["id"], index)
+                    session.release(index)
+                else:
+                    session.store(index, data)
+            send_json(sock, {"piece": None})
+        except Exception:
+            session.wait(retry_delay)
+        finally:
+            for index in inflight:
+                session.release(index)
+            sock.close()
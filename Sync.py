@@ -0,0 +1,154 @@
+import os
+import json
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from Sparse import recv_exact
+from HashCache import get_hash_cache
+from Finalize import PART_SUFFIX
+
+_LENGTH = struct.Struct("!Q")
+
+
+def _scan(directory):
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(PART_SUFFIX):
+                        # File temporaneo di una ricezione in corso
+                        continue
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append((entry.path, entry.stat(follow_symlinks=False)))
+                except OSError:
+                    pass
+    except OSError as e:
+        print(f"Impossibile leggere la cartella {directory}: {e}")
+    return files, subdirs
+
+
+def walk_files(root, workers=8):
+    """Elenca ricorsivamente i file di root, esplorando le sottocartelle in parallelo.
+
+    Restituisce una lista di (percorso, stat_result); i link simbolici vengono ignorati.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                results.extend(files)
+                for subdir in subdirs:
+                    pending.add(pool.submit(_scan, subdir))
+    return results
+
+
+def build_manifest(root, cache=None, workers=8, hash_cache=None):
+    """Costruisce il manifest di una cartella: {percorso_relativo: {size, mtime_ns, hash}}.
+
+    cache è un manifest precedente: i file con dimensione e mtime invariati
+    riutilizzano l'hash già calcolato. Gli altri passano dalla cache degli
+    hash persistente (che riconosce anche i file rinominati o spostati),
+    quindi solo i file nuovi o modificati vengono riletti dal disco.
+    """
+    cache = cache or {}
+    hash_cache = hash_cache or get_hash_cache()
+    manifest = {}
+    to_hash = []
+    if not os.path.isdir(root):
+        return manifest
+
+    for path, st in walk_files(root, workers):
+        relative_path = os.path.relpath(path, root).replace(os.sep, "/")
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        cached = cache.get(relative_path)
+        if cached and cached.get("size") == entry["size"] and cached.get("mtime_ns") == entry["mtime_ns"]:
+            entry["hash"] = cached["hash"]
+        else:
+            to_hash.append((relative_path, path))
+        manifest[relative_path] = entry
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = pool.map(lambda item: (item[0], _safe_digest(hash_cache, item[1])), to_hash)
+        for relative_path, digest in digests:
+            if digest is None:
+                manifest.pop(relative_path, None)
+            else:
+                manifest[relative_path]["hash"] = digest
+    return manifest
+
+
+def _safe_digest(hash_cache, path):
+    try:
+        return hash_cache.digest(path)
+    except OSError as e:
+        print(f"Impossibile calcolare l'hash di {path}: {e}")
+        return None
+
+
+def diff_manifests(local, remote, delete=False):
+    """Confronta due manifest e restituisce (da_inviare, da_eliminare)"""
+    to_send = [path for path, entry in local.items()
+               if path not in remote or remote[path].get("hash") != entry.get("hash")]
+    to_delete = [path for path in remote if path not in local] if delete else []
+    return sorted(to_send), sorted(to_delete)
+
+
+def send_json(sock, obj):
+    """Invia un oggetto JSON preceduto dalla sua lunghezza"""
+    data = json.dumps(obj).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def recv_json(sock):
+    """Riceve un oggetto JSON inviato con send_json"""
+    (length,) = _LENGTH.unpack(recv_exact(sock, _LENGTH.size))
+    return json.loads(recv_exact(sock, length).decode())
+
+
+class ManifestStore:
+    """Manifest persistenti su disco, uno per cartella sincronizzata"""
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            self._data = {}
+            if os.path.exists(self.store_file):
+                try:
+                    with open(self.store_file, "r") as f:
+                        self._data = json.load(f)
+                except Exception as e:
+                    print(f"Errore nel caricamento dei manifest: {e}")
+        return self._data
+
+    def get(self, root):
+        with self._lock:
+            return dict(self._load().get(os.path.abspath(root), {}))
+
+    def put(self, root, manifest):
+        with self._lock:
+            self._load()[os.path.abspath(root)] = manifest
+            directory = os.path.dirname(os.path.abspath(self.store_file))
+            fd, tmp_path = tempfile.mkstemp(prefix=".zapshare_manifest.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._data, f)
+                os.replace(tmp_path, self.store_file)
+            except Exception:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
@@ -0,0 +1,285 @@
+import json
+import time
+import select
+import socket
+import struct
+import hashlib
+from collections import deque
+
+# Datagramma: tipo, numero di sequenza, timestamp del mittente (secondi, monotonic)
+DATAGRAM = struct.Struct("!BId")
+DATA, FEEDBACK, FIN = 1, 2, 3
+
+# 1200 byte di dati: il datagramma resta sotto l'MTU minimo IPv6 (1280) anche con le intestazioni
+UDP_PAYLOAD_SIZE = 1200
+
+FEEDBACK_INTERVAL = 0.01  # Il receiver invia NACK e ritardo ogni 10 ms
+FIN_INTERVAL = 0.05  # Il sender ripete il FIN finché il receiver non conferma
+MAX_NACK_RANGES = 64
+UDP_TIMEOUT = 30  # Secondi senza datagrammi prima di considerare perso il trasferimento
+
+# Controllo di frequenza basato sul ritardo (tipo LEDBAT): la perdita su un
+# collegamento wireless non indica congestione, l'aumento del ritardo di coda sì
+TARGET_DELAY = 0.025
+INITIAL_RATE = 8 * 1024 * 1024
+MIN_RATE = 256 * 1024
+MAX_RATE = 1024 * 1024 * 1024
+MAX_BURST = 32  # Datagrammi inviati di fila prima di controllare il feedback
+
+
+def datagram_count(filesize, payload_size=UDP_PAYLOAD_SIZE):
+    return (filesize + payload_size - 1) // payload_size
+
+
+def missing_ranges(received, start, end, limit=MAX_NACK_RANGES):
+    """Intervalli [a, b] di sequenze mancanti in received[start:end] (bytearray di 0/1)"""
+    ranges = []
+    position = start
+    while position < end and len(ranges) < limit:
+        first = received.find(0, position, end)
+        if first < 0:
+            break
+        last = received.find(1, first, end)
+        last = end if last < 0 else last
+        ranges.append((first, last - 1))
+        position = last
+    return ranges
+
+
+class UdpReceiver:
+    """Riceve i datagrammi di un file e li scrive al loro offset.
+
+    Ogni FEEDBACK_INTERVAL invia al sender quanti datagrammi ha ricevuto,
+    le sequenze mancanti (NACK selettivi) e il ritardo di coda misurato
+    (ritardo di sola andata meno il minimo osservato).
+    """
+
+    def __init__(self, sock, f, filesize, peer_ip, payload_size=UDP_PAYLOAD_SIZE):
+        self.sock = sock
+        self.file = f
+        self.payload_size = payload_size
+        self.count = datagram_count(filesize, payload_size)
+        self.received = bytearray(self.count)
+        self.got = 0
+        self.peer_ip = peer_ip
+        self.peer = None
+        self.sender_done = False
+        self.contiguous = 0  # Prima sequenza non ancora ricevuta
+        self.highest = -1
+        self.base_delay = None
+        self.interval_delay = None
+        self.last_echo = 0.0
+        self.duplicates = 0
+
+    @property
+    def complete(self):
+        return self.got == self.count
+
+    def run(self, control_socket, normalize=lambda ip: ip):
+        """Riceve fino al completamento; solleva un errore se il sender chiude o tace"""
+        last_datagram = last_feedback = time.monotonic()
+        while not self.complete:
+            readable, _, _ = select.select([self.sock, control_socket], [], [], FEEDBACK_INTERVAL)
+            now = time.monotonic()
+            if control_socket in readable:
+                raise ConnectionError("Il sender ha chiuso la connessione")
+            if self.sock in readable:
+                last_datagram = now
+                self._drain(normalize)
+            elif now - last_datagram > UDP_TIMEOUT:
+                raise TimeoutError("Nessun datagramma ricevuto")
+            if self.peer is not None and (now - last_feedback >= FEEDBACK_INTERVAL or self.complete):
+                self.send_feedback()
+                last_feedback = now
+
+    def _drain(self, normalize):
+        # Legge tutti i datagrammi in coda senza bloccare
+        for _ in range(1024):
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            if normalize(addr[0]) != self.peer_ip or len(data) < DATAGRAM.size:
+                continue
+            self.peer = addr
+            kind, seq, timestamp = DATAGRAM.unpack_from(data)
+            if kind == FIN:
+                self.sender_done = True
+                continue
+            if kind != DATA or seq >= self.count:
+                continue
+
+            delay = time.monotonic() - timestamp  # Include lo scarto tra gli orologi, costante
+            if self.base_delay is None or delay < self.base_delay:
+                self.base_delay = delay
+            if self.interval_delay is None or delay < self.interval_delay:
+                self.interval_delay = delay
+            self.last_echo = timestamp
+
+            if self.received[seq]:
+                self.duplicates += 1
+                continue
+            self.file.seek(seq * self.payload_size)
+            self.file.write(memoryview(data)[DATAGRAM.size:])
+            self.received[seq] = 1
+            self.got += 1
+            self.highest = max(self.highest, seq)
+            while self.contiguous < self.count and self.received[self.contiguous]:
+                self.contiguous += 1
+
+    def send_feedback(self):
+        # Finché il sender invia dati nuovi, mancano solo le sequenze prima della più alta ricevuta
+        end = self.count if self.sender_done else self.highest
+        queue_delay = 0.0
+        if self.interval_delay is not None:
+            queue_delay = self.interval_delay - self.base_delay
+        self.interval_delay = None
+        message = {
+            "got": self.got,
+            "delay": queue_delay,
+            "missing": missing_ranges(self.received, self.contiguous, max(end, self.contiguous))
+        }
+        try:
+            self.sock.sendto(DATAGRAM.pack(FEEDBACK, 0, self.last_echo) + json.dumps(message).encode(), self.peer)
+        except OSError:
+            pass
+
+
+class UdpSender:
+    """Invia un file in datagrammi a frequenza controllata.
+
+    I dati nuovi vengono letti in sequenza (e inclusi nell'hash), le
+    sequenze segnalate dal receiver vengono ritrasmesse con precedenza.
+    La frequenza cresce finché il ritardo di coda resta sotto
+    TARGET_DELAY e cala quando lo supera.
+    """
+
+    def __init__(self, sock, peer, f, retransmit_file, filesize, payload_size=UDP_PAYLOAD_SIZE):
+        self.sock = sock
+        self.peer = peer
+        self.file = f
+        self.retransmit_file = retransmit_file
+        self.payload_size = payload_size
+        self.count = datagram_count(filesize, payload_size)
+        self.hasher = hashlib.sha256()
+        self.next_seq = 0
+        self.got = 0
+        self.rate = INITIAL_RATE
+        self.rtt = 0.1
+        self.retransmits = 0
+        self._queue = deque()
+        self._queued = set()
+        self._resent_at = {}
+        self._tokens = 0.0
+        self._last_refill = time.monotonic()
+        self._last_fin = 0.0
+
+    @property
+    def digest(self):
+        return self.hasher.hexdigest()
+
+    def run(self, control_socket, progress_callback=None):
+        """Invia finché il receiver non segnala sul canale TCP di avere tutto"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._last_refill) * self.rate,
+                               MAX_BURST * (self.payload_size + DATAGRAM.size))
+            self._last_refill = now
+
+            sent = 0
+            while sent < MAX_BURST and self._tokens >= self.payload_size:
+                size = self._send_next(now)
+                if not size:
+                    break
+                self._tokens -= size
+                sent += 1
+
+            if self.next_seq >= self.count and not self._queue and now - self._last_fin >= FIN_INTERVAL:
+                self.sock.sendto(DATAGRAM.pack(FIN, self.count, now), self.peer)
+                self._last_fin = now
+
+            # Attende il feedback o il momento di inviare il prossimo gruppo
+            wait = 0.0 if sent == MAX_BURST else max(0.0005, (self.payload_size - self._tokens) / self.rate)
+            readable, _, _ = select.select([self.sock, control_socket], [], [], min(wait, FIN_INTERVAL))
+            if self.sock in readable:
+                self._read_feedback()
+                if progress_callback and self.count:
+                    progress_callback(int(self.got * 100 / self.count))
+            if control_socket in readable:
+                return
+
+    def _send_next(self, now):
+        if self._queue:
+            seq = self._queue.popleft()
+            self._queued.discard(seq)
+            self.retransmit_file.seek(seq * self.payload_size)
+            data = self.retransmit_file.read(self.payload_size)
+            self._resent_at[seq] = now
+            self.retransmits += 1
+        elif self.next_seq < self.count:
+            seq = self.next_seq
+            data = self.file.read(self.payload_size)
+            if not data:
+                raise IOError("Il file è stato modificato durante l'invio")
+            self.hasher.update(data)
+            self.next_seq += 1
+        else:
+            return 0
+        datagram = DATAGRAM.pack(DATA, seq, now) + data
+        try:
+            self.sock.sendto(datagram, self.peer)
+        except BlockingIOError:
+            # Buffer del socket pieno: la sequenza verrà richiesta di nuovo dal receiver
+            pass
+        return len(datagram)
+
+    def _read_feedback(self):
+        for _ in range(64):
+            try:
+                data, _ = self.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            kind, _, echo = DATAGRAM.unpack_from(data)
+            if kind != FEEDBACK:
+                continue
+            now = time.monotonic()
+            feedback = json.loads(data[DATAGRAM.size:].decode())
+            self.got = feedback["got"]
+            if echo:
+                # RTT approssimato: include il ritardo di invio del feedback
+                self.rtt = 0.875 * self.rtt + 0.125 * max(0.0, now - echo)
+            self._adjust_rate(feedback["delay"])
+
+            # NACK: si ignorano le sequenze già ritrasmesse nell'ultimo RTT
+            holdoff = max(2 * self.rtt, 2 * FEEDBACK_INTERVAL)
+            for first, last in feedback["missing"]:
+                for seq in range(first, min(last + 1, self.next_seq)):
+                    if seq in self._queued or now - self._resent_at.get(seq, 0.0) < holdoff:
+                        continue
+                    self._queue.append(seq)
+                    self._queued.add(seq)
+
+    def _adjust_rate(self, queue_delay):
+        off_target = (TARGET_DELAY - queue_delay) / TARGET_DELAY
+        if off_target >= 0:
+            self.rate *= 1 + 0.05 * off_target
+        else:
+            self.rate *= max(0.5, 1 + 0.1 * off_target)
+        self.rate = min(MAX_RATE, max(MIN_RATE, self.rate))
+
+
+def open_udp_socket(family, port=0, buffer_size=4 * 1024 * 1024):
+    """Socket UDP non bloccante con buffer ampi (i picchi non vanno persi nel kernel)"""
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, buffer_size)
+        except OSError:
+            pass
+    if family == socket.AF_INET6:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        sock.bind(("::", port))
+    else:
+        sock.bind(("", port))
+    sock.setblocking(False)
+    return sock
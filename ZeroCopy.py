@@ -0,0 +1,70 @@
+import os
+import sys
+
+# os.splice esiste solo su Linux (Python 3.10+)
+SPLICE_AVAILABLE = hasattr(os, "splice")
+
+PIPE_SIZE = 1024 * 1024
+_F_SETPIPE_SZ = 1031
+
+
+class SplicePipe:
+    """Pipe del kernel usata come buffer intermedio tra socket e file"""
+
+    def __init__(self, size=PIPE_SIZE):
+        self.read_fd, self.write_fd = os.pipe()
+        self.size = 65536
+        if sys.platform.startswith("linux"):
+            import fcntl
+            try:
+                # Una pipe più grande riduce il numero di chiamate (limite: /proc/sys/fs/pipe-max-size)
+                self.size = fcntl.fcntl(self.write_fd, _F_SETPIPE_SZ, size)
+            except OSError:
+                pass
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def splice_to_file(sock, fd, offset, length, pipe):
+    """Sposta fino a length byte dal socket al file (a partire da offset) senza
+    copiarli in userspace. Restituisce i byte scritti: meno di length solo se
+    la connessione si chiude.
+
+    Solleva OSError se il socket o il filesystem non supportano splice; i
+    dati già usciti dal socket vengono comunque scritti, quindi il chiamante
+    può proseguire con recv() dal byte restituito in e.moved.
+    """
+    sock_fd = sock.fileno()
+    done = 0
+    while done < length:
+        try:
+            received = os.splice(sock_fd, pipe.write_fd, min(pipe.size, length - done), flags=os.SPLICE_F_MOVE)
+        except OSError as e:
+            e.moved = done
+            raise
+        if received == 0:
+            break
+
+        written = 0
+        try:
+            while written < received:
+                written += os.splice(pipe.read_fd, fd, received - written,
+                                     offset_dst=offset + done + written, flags=os.SPLICE_F_MOVE)
+        except OSError as e:
+            # Svuota la pipe con una scrittura normale, così nessun byte va perso
+            while written < received:
+                data = os.read(pipe.read_fd, received - written)
+                os.pwrite(fd, data, offset + done + written)
+                written += len(data)
+            e.moved = done + written
+            raise
+        done += received
+    return done